@@ -1,139 +1,94 @@
-from flask import Flask, request, render_template, redirect, url_for, session, jsonify
-from datetime import datetime
-import psycopg2
-from psycopg2 import Error
+from flask import Flask, Response, current_app, request, render_template, redirect, url_for, session, jsonify, make_response
+from datetime import datetime, timedelta
+import base64
+import binascii
+import hashlib
+import itertools
+import json
+import os
+import secrets
+import time
+from psycopg2 import Error, errors
 
-app = Flask(__name__)
-app.secret_key = 'your_secret_key_here_12345!@#$%'
+import app_logging
+import changes
+import db
+import exports
+import metrics
+import migrations
+import oee
+import parts
+import plans
+import query_stats
+import rollups
+import scheduler
+import seed
+from app_logging import log_message
+from db import get_db_connection
 
-def log_message(message):
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}")
+# Маршруты собираются при импорте модуля и регистрируются в каждом
+# приложении из create_app; имя endpoint - имя функции, как у @app.route
+_routes = []
 
-def get_db_connection():
-    try:
-        connection = psycopg2.connect(
-            host="rc1b-31bfnlmu4csa6hn5.mdb.yandexcloud.net",
-            port=6432,
-            database="db1",
-            user="user1",
-            password="12345678",
-            sslmode="verify-full",
-            sslrootcert="/home/yc-user/.postgrsql/root.crt"
-        )
-        log_message("INFO: Подключение к базе данных установлено.")
-        return connection
-    except Error as e:
-        log_message(f"ERROR: Ошибка при подключении к базе данных: {e}")
-        return None
 
-def init_database():
+def route(rule, **options):
+    """Декоратор маршрута для приложений, создаваемых create_app"""
+    def decorator(view):
+        _routes.append((rule, view, options))
+        return view
+    return decorator
+
+
+def create_app(config=None):
     """
-    Инициализация базы данных - создание таблиц если они не существуют.
+    Создание приложения. Настройки читаются из словаря config, затем из
+    файла APP_CONFIG_FILE (Python-модуль или .json), остальные - из
+    переменных окружения в init_app модулей. При создании приложение к базе
+    данных не обращается: пул соединений создается, а миграции применяются
+    при первом запросе, которому нужна база.
     """
-    conn = get_db_connection()
-    if conn is None:
-        log_message("ERROR: Не удалось подключиться к БД для инициализации")
-        return False
-    
-    cursor = None
-    try:
-        cursor = conn.cursor()
-        
-        # Создаем таблицу production_plan
-        create_table_query = """
-        CREATE TABLE IF NOT EXISTS production_plan (
-            id SERIAL PRIMARY KEY,
-            part_name VARCHAR(255) NOT NULL,
-            planned_quantity INTEGER NOT NULL,
-            machine_number INTEGER NOT NULL,
-            start_time TIMESTAMP NOT NULL,
-            end_time TIMESTAMP NOT NULL
-        );
-        """
-        cursor.execute(create_table_query)
-        
-        # Создаем таблицу production для отчетов
-        create_production_table_query = """
-        CREATE TABLE IF NOT EXISTS production (
-            id SERIAL PRIMARY KEY,
-            order_id INTEGER NOT NULL REFERENCES production_plan(id),
-            part_number VARCHAR(255),
-            actual_quantity INTEGER NOT NULL,
-            bubble_count INTEGER DEFAULT 0,
-            underfill_count INTEGER DEFAULT 0,
-            inclusion_count INTEGER DEFAULT 0,
-            defect_count INTEGER DEFAULT 0,
-            actual_start_time TIMESTAMP NOT NULL,
-            actual_end_time TIMESTAMP NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(order_id)
-        );
-        """
-        cursor.execute(create_production_table_query)
-        
-        # Создаем таблицу events для событий с русскими названиями столбцов
-        create_events_table_query = """
-        CREATE TABLE IF NOT EXISTS events (
-            event_id SERIAL PRIMARY KEY,
-            event_name VARCHAR(255) NOT NULL,
-            batch INTEGER NOT NULL REFERENCES production_plan(id),
-            "Фактические время начала события" TIMESTAMP NOT NULL,
-            "Фактические время конца события" TIMESTAMP NOT NULL,
-            "Time_group" VARCHAR(50) NOT NULL CHECK ("Time_group" IN ('Planned pause time', 'Utilization hours', 'Breakdown time'))
-        );
-        """
-        cursor.execute(create_events_table_query)
-        
-        conn.commit()
-        
-        log_message("SUCCESS: Таблицы production_plan, production и events проверены/созданы успешно")
-        return True
-        
-    except (Exception, Error) as error:
-        log_message(f"ERROR: Ошибка при создании таблиц: {error}")
-        return False
-        
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+    started = time.perf_counter()
+    config = dict(config or {})
+    app = Flask(__name__)
 
-def get_parts_list():
-    """Получение списка деталей из таблицы parts"""
-    conn = get_db_connection()
-    if conn is None:
-        return []
-    
-    cursor = None
-    try:
-        cursor = conn.cursor()
-        
-        select_query = """
-        SELECT "Наименование детали" 
-        FROM parts 
-        ORDER BY "Наименование детали";
-        """
-        
-        cursor.execute(select_query)
-        parts = cursor.fetchall()
-        
-        # Преобразуем список кортежей в список строк
-        parts_list = [part[0] for part in parts]
-        
-        log_message(f"INFO: Получено {len(parts_list)} деталей из БД")
-        return parts_list
-        
-    except (Exception, Error) as error:
-        log_message(f"ERROR: Ошибка при получении списка деталей: {error}")
-        return []
-        
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+    config_file = config.get('APP_CONFIG_FILE') or os.environ.get('APP_CONFIG_FILE')
+    if config_file:
+        if config_file.endswith('.json'):
+            app.config.from_file(os.path.abspath(config_file), load=json.load)
+        else:
+            app.config.from_pyfile(os.path.abspath(config_file))
+    app.config.from_mapping(config)
+
+    # SECRET_KEY есть в настройках Flask по умолчанию (None), setdefault не подходит
+    if not app.config['SECRET_KEY']:
+        app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY')
+    if not app.config['SECRET_KEY']:
+        if not (app.debug or app.testing):
+            raise RuntimeError("Не задан SECRET_KEY: укажите его в окружении или в файле APP_CONFIG_FILE")
+        # Для отладки и тестов: сессии не переживут перезапуск процесса
+        app.config['SECRET_KEY'] = secrets.token_hex(32)
+        log_message("WARNING: SECRET_KEY не задан, используется случайный ключ процесса")
+
+    app_logging.init_app(app)
+    db.init_app(app)
+    query_stats.init_app(app)
+    metrics.init_app(app)
+    parts.init_app(app)
+    changes.init_app(app)
+    exports.init_app(app)
+    plans.init_app(app)
+    scheduler.init_app(app)
 
+    for rule, view, options in _routes:
+        app.add_url_rule(rule, view_func=view, **options)
+
+    app.cli.add_command(migrations.db_cli)
+    app.cli.add_command(plans.plans_cli)
+    app.cli.add_command(rollups.rollups_cli)
+    app.cli.add_command(seed.seed_command)
+
+    log_message(f"INFO: Приложение создано за {(time.perf_counter() - started) * 1000:.0f} мс")
+    return app
 
 def check_auth(username, password):
     """Проверка логина и пароля"""
@@ -150,7 +105,35 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-@app.route('/', methods=['GET', 'POST'])
+def make_etag(*fingerprint):
+    """
+    Сильный ETag ответа из отпечатка данных, адреса запроса и пользователя.
+    Тело ответа не хешируется: ETag известен до выполнения тяжелых запросов.
+    """
+    payload = json.dumps([
+        current_app.config['ETAG_VERSION'],
+        request.path,
+        request.query_string.decode('utf-8', 'replace'),
+        session.get('username'),
+        list(fingerprint)
+    ])
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+def with_cache_headers(response, etag):
+    """ETag и заголовки кэширования для маршрутов, доступных только после входа"""
+    response.set_etag(etag)
+    # Браузер может хранить ответ, но обязан проверять его при каждом обращении
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+def not_modified(etag):
+    """Ответ 304, если у клиента уже есть версия с этим ETag, иначе None"""
+    if request.if_none_match.contains_weak(etag):
+        return with_cache_headers(Response(status=304), etag)
+    return None
+
+@route('/', methods=['GET', 'POST'])
 def login():
     """Страница входа в систему"""
     if 'logged_in' in session and session['logged_in']:
@@ -172,18 +155,16 @@ def login():
     
     return render_template('login.html', error=error)
 
-@app.route('/home')
+@route('/home')
 @login_required
 def home():
     """Главная страница после авторизации"""
-    parts_list = get_parts_list()
-    return render_template('home.html', username=session.get('username'), parts_list=parts_list)
+    return render_template('home.html', username=session.get('username'))
 
-@app.route('/edit/<int:id>')
+@route('/edit/<int:id>')
 @login_required
 def edit_record(id):
     """Страница редактирования записи"""
-    parts_list = get_parts_list()
     conn = get_db_connection()
     if conn is None:
         return "Ошибка подключения к базе данных", 500
@@ -214,7 +195,7 @@ def edit_record(id):
             'end_time': record[5].strftime('%Y-%m-%dT%H:%M')
         }
         
-        return render_template('edit.html', data=data, username=session.get('username'), parts_list=parts_list)
+        return render_template('edit.html', data=data, username=session.get('username'))
         
     except (Exception, Error) as error:
         log_message(f"ERROR: Ошибка при получении записи: {error}")
@@ -223,10 +204,37 @@ def edit_record(id):
     finally:
         if cursor:
             cursor.close()
-        if conn:
-            conn.close()
 
-@app.route('/production_report/<int:order_id>')
+PARTS_SEARCH_LIMIT_DEFAULT = 20
+PARTS_SEARCH_LIMIT_MAX = 100
+
+@route('/api/parts', methods=['GET'])
+@login_required
+def api_parts():
+    """Поиск деталей для автодополнения: ?q=<строка>&limit=<N>"""
+    query = request.args.get('q', '')
+    try:
+        limit = int(request.args.get('limit', PARTS_SEARCH_LIMIT_DEFAULT))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit должен быть числом'}), 400
+    limit = max(1, min(limit, PARTS_SEARCH_LIMIT_MAX))
+    
+    try:
+        parts_list = parts.search_parts(query, limit)
+    except (Exception, Error) as error:
+        log_message(f"ERROR: Ошибка при поиске деталей: {error}")
+        return jsonify({'success': False, 'error': str(error)}), 500
+    
+    if parts_list is None:
+        return jsonify({'success': False, 'error': 'Ошибка подключения к базе данных'}), 500
+    
+    response = jsonify({'success': True, 'count': len(parts_list), 'data': parts_list})
+    # Справочник меняется редко; ответ зависит от сессии, поэтому только private
+    response.headers['Cache-Control'] = f"private, max-age={current_app.config['PARTS_SEARCH_MAX_AGE']}"
+    response.vary.add('Cookie')
+    return response
+
+@route('/production_report/<int:order_id>')
 @login_required
 def production_report(order_id):
     """Страница для создания отчета по производству"""
@@ -238,6 +246,11 @@ def production_report(order_id):
     try:
         cursor = conn.cursor()
         
+        etag = make_etag(changes.data_fingerprint(cursor, order_id))
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
         select_order_query = """
         SELECT id, part_name, planned_quantity, machine_number, 
                start_time, end_time 
@@ -284,10 +297,10 @@ def production_report(order_id):
                 'actual_end_time': existing_report[8].strftime('%Y-%m-%dT%H:%M') if existing_report[8] else ''
             }
         
-        return render_template('production_report.html', 
+        return with_cache_headers(make_response(render_template('production_report.html', 
                              order=order_data, 
                              report=report_data,
-                             username=session.get('username'))
+                             username=session.get('username'))), etag)
         
     except (Exception, Error) as error:
         log_message(f"ERROR: Ошибка при получении данных отчета: {error}")
@@ -296,10 +309,8 @@ def production_report(order_id):
     finally:
         if cursor:
             cursor.close()
-        if conn:
-            conn.close()
 
-@app.route('/save_production_report', methods=['POST'])
+@route('/save_production_report', methods=['POST'])
 @login_required
 def save_production_report():
     """Сохранение отчета по производству"""
@@ -360,52 +371,27 @@ def save_production_report():
         try:
             cursor = conn.cursor()
             
-            check_order_query = "SELECT id FROM production_plan WHERE id = %s;"
-            cursor.execute(check_order_query, (order_id_int,))
-            if not cursor.fetchone():
-                return jsonify({'success': False, 'error': 'Заказ не найден'}), 404
+            # Одна команда вместо проверки заказа, поиска отчета и INSERT/UPDATE:
+            # xmax = 0 только у только что вставленной строки
+            upsert_query = """
+            INSERT INTO production 
+            (order_id, part_number, actual_quantity, bubble_count, underfill_count, 
+             inclusion_count, defect_count, actual_start_time, actual_end_time) 
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) 
+            ON CONFLICT (order_id) DO UPDATE 
+            SET part_number = EXCLUDED.part_number,
+                actual_quantity = EXCLUDED.actual_quantity, 
+                bubble_count = EXCLUDED.bubble_count, 
+                underfill_count = EXCLUDED.underfill_count, 
+                inclusion_count = EXCLUDED.inclusion_count,
+                defect_count = EXCLUDED.defect_count,
+                actual_start_time = EXCLUDED.actual_start_time, 
+                actual_end_time = EXCLUDED.actual_end_time
+            RETURNING id, (xmax = 0) AS inserted;
+            """
             
-            check_report_query = "SELECT id FROM production WHERE order_id = %s;"
-            cursor.execute(check_report_query, (order_id_int,))
-            existing_report = cursor.fetchone()
-            
-            if existing_report:
-                update_query = """
-                UPDATE production 
-                SET part_number = %s,
-                    actual_quantity = %s, 
-                    bubble_count = %s, 
-                    underfill_count = %s, 
-                    inclusion_count = %s,
-                    defect_count = %s,
-                    actual_start_time = %s, 
-                    actual_end_time = %s
-                WHERE order_id = %s
-                RETURNING id;
-                """
-                
-                cursor.execute(update_query, (
-                    part_number.strip() if part_number else None,
-                    actual_quantity_int,
-                    int(bubble_count),
-                    int(underfill_count),
-                    int(inclusion_count),
-                    defect_count,
-                    actual_start_time_dt,
-                    actual_end_time_dt,
-                    order_id_int
-                ))
-                action = 'обновлен'
-            else:
-                insert_query = """
-                INSERT INTO production 
-                (order_id, part_number, actual_quantity, bubble_count, underfill_count, 
-                 inclusion_count, defect_count, actual_start_time, actual_end_time) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) 
-                RETURNING id;
-                """
-                
-                cursor.execute(insert_query, (
+            try:
+                cursor.execute(upsert_query, (
                     order_id_int,
                     part_number.strip() if part_number else None,
                     actual_quantity_int,
@@ -416,16 +402,21 @@ def save_production_report():
                     actual_start_time_dt,
                     actual_end_time_dt
                 ))
-                action = 'сохранен'
+            except errors.ForeignKeyViolation:
+                conn.rollback()
+                return jsonify({'success': False, 'error': 'Заказ не найден'}), 404
             
+            report_id, inserted = cursor.fetchone()
             conn.commit()
-            report_id = cursor.fetchone()[0]
+            action = 'сохранен' if inserted else 'обновлен'
             
             log_message(f"SUCCESS: Отчет по производству {action} с ID={report_id} для заказа {order_id_int}")
             
             return jsonify({
                 'success': True,
-                'message': f'Отчет по производству успешно {action} (ID отчета: {report_id})'
+                'message': f'Отчет по производству успешно {action} (ID отчета: {report_id})',
+                'report_id': report_id,
+                'created': inserted
             })
             
         except (Exception, Error) as error:
@@ -437,63 +428,38 @@ def save_production_report():
         finally:
             if cursor:
                 cursor.close()
-            if conn:
-                conn.close()
                 
     except Exception as e:
         log_message(f"ERROR: Ошибка обработки запроса: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/save_data', methods=['POST'])
+def find_plan_conflicts(cursor, plan, conflict_mode, exclude_id=None):
+    """Батчи того же станка, пересекающиеся по времени с сохраняемым"""
+    if conflict_mode == 'strict':
+        plans.lock_machine_schedule(cursor, plan['machine_number'])
+    return plans.find_schedule_conflicts(
+        cursor, plan['machine_number'], plan['start_time'], plan['end_time'], exclude_id
+    )
+
+def format_plan_conflicts(plan, conflicts):
+    ids = ', '.join(str(plan_id) for plan_id in conflicts)
+    return f"Станок {plan['machine_number']} в это время занят батчами: {ids}"
+
+@route('/save_data', methods=['POST'])
 @login_required
 def save_data():
     """Сохранение новых данных в базу данных"""
     try:
         data = request.get_json()
         
-        part_name = data.get('part_name')
-        planned_quantity = data.get('planned_quantity')
-        machine_number = data.get('machine_number')
-        start_time = data.get('start_time')
-        end_time = data.get('end_time')
-        
-        if not part_name or not part_name.strip():
-            return jsonify({'success': False, 'error': 'Part name не может быть пустым'}), 400
-        
-        if not planned_quantity:
-            return jsonify({'success': False, 'error': 'Planned quantity не может быть пустым'}), 400
-        
-        if not machine_number:
-            return jsonify({'success': False, 'error': 'Machine number не может быть пустым'}), 400
-        
-        if not start_time:
-            return jsonify({'success': False, 'error': 'Start time не может быть пустым'}), 400
-        
-        if not end_time:
-            return jsonify({'success': False, 'error': 'End time не может быть пустым'}), 400
-        
         try:
-            planned_quantity_int = int(planned_quantity)
-            if planned_quantity_int <= 0:
-                return jsonify({'success': False, 'error': 'Planned quantity должен быть положительным числом'}), 400
-        except ValueError:
-            return jsonify({'success': False, 'error': 'Planned quantity должен быть числом'}), 400
-        
-        try:
-            machine_number_int = int(machine_number)
-            if machine_number_int <= 0:
-                return jsonify({'success': False, 'error': 'Machine number должен быть положительным числом'}), 400
-        except ValueError:
-            return jsonify({'success': False, 'error': 'Machine number должен быть числом'}), 400
+            plan = plans.validate_plan(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        try:
-            start_time_dt = datetime.strptime(start_time, '%Y-%m-%dT%H:%M')
-            end_time_dt = datetime.strptime(end_time, '%Y-%m-%dT%H:%M')
-            
-            if end_time_dt <= start_time_dt:
-                return jsonify({'success': False, 'error': 'End time должен быть позже start time'}), 400
-        except ValueError:
-            return jsonify({'success': False, 'error': 'Неверный формат времени. Используйте YYYY-MM-DDTHH:MM'}), 400
+        conflict_mode = data.get('conflict_mode') or current_app.config['PLAN_CONFLICT_MODE']
+        if conflict_mode not in plans.CONFLICT_MODES:
+            return jsonify({'success': False, 'error': 'conflict_mode должен быть strict или warn'}), 400
         
         conn = get_db_connection()
         if conn is None:
@@ -503,6 +469,15 @@ def save_data():
         try:
             cursor = conn.cursor()
             
+            conflicts = find_plan_conflicts(cursor, plan, conflict_mode)
+            if conflicts and conflict_mode == 'strict':
+                conn.rollback()
+                return jsonify({
+                    'success': False,
+                    'error': format_plan_conflicts(plan, conflicts),
+                    'conflicts': conflicts
+                }), 409
+            
             insert_query = """
             INSERT INTO production_plan 
             (part_name, planned_quantity, machine_number, start_time, end_time) 
@@ -511,11 +486,11 @@ def save_data():
             """
             
             cursor.execute(insert_query, (
-                part_name.strip(),
-                planned_quantity_int, 
-                machine_number_int,
-                start_time_dt,
-                end_time_dt
+                plan['part_name'],
+                plan['planned_quantity'], 
+                plan['machine_number'],
+                plan['start_time'],
+                plan['end_time']
             ))
             conn.commit()
             
@@ -523,17 +498,15 @@ def save_data():
             
             log_message(f"SUCCESS: Добавлена запись с ID={inserted_id}")
             
+            message = f'Данные успешно сохранены (ID: {inserted_id})'
+            if conflicts:
+                message += '. Внимание! ' + format_plan_conflicts(plan, conflicts)
+            
             return jsonify({
                 'success': True,
-                'message': f'Данные успешно сохранены (ID: {inserted_id})',
-                'data': {
-                    'id': inserted_id,
-                    'part_name': part_name.strip(),
-                    'planned_quantity': planned_quantity_int,
-                    'machine_number': machine_number_int,
-                    'start_time': start_time_dt.strftime('%Y-%m-%d %H:%M'),
-                    'end_time': end_time_dt.strftime('%Y-%m-%d %H:%M')
-                }
+                'message': message,
+                'data': plans.plan_to_dict(inserted_id, plan),
+                'conflicts': conflicts
             })
             
         except (Exception, Error) as error:
@@ -545,63 +518,174 @@ def save_data():
         finally:
             if cursor:
                 cursor.close()
-            if conn:
-                conn.close()
                 
     except Exception as e:
         log_message(f"ERROR: Ошибка обработки запроса: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/update_data/<int:id>', methods=['POST'])
+@route('/api/plans/conflicts', methods=['GET'])
+@login_required
+def plans_conflicts():
+    """Пересечения батчей на станках за период: ?from=YYYY-MM-DD&to=YYYY-MM-DD&machine=1,2"""
+    try:
+        date_from, date_to = oee.parse_period(request.args.get('from'), request.args.get('to'), default_days=7)
+        machines = [int(m) for m in request.args.get('machine', '').split(',') if m.strip()]
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({'success': False, 'error': 'Ошибка подключения к базе данных'}), 500
+    
+    try:
+        conflicts = plans.find_conflicts_in_range(conn, date_from, date_to, machines)
+    except (Exception, Error) as error:
+        log_message(f"ERROR: Ошибка при поиске пересечений расписания: {error}")
+        return jsonify({'success': False, 'error': str(error)}), 500
+    
+    return jsonify({'success': True, 'count': len(conflicts), 'conflicts': conflicts})
+
+@route('/api/plans/changes', methods=['GET'])
+@login_required
+def plans_changes():
+    """
+    Изменения батчей после токена: ?since=<token>&limit=500.
+    Без since возвращается только токен текущего момента: клиент получает
+    его до полной загрузки списка и дальше запрашивает изменения с ним.
+    Удаленные батчи приходят как {"id": ..., "deleted": true}.
+    """
+    token = request.args.get('since')
+    try:
+        limit, _, _ = parse_page_args(request.args, default_limit=PAGE_SIZE_MAX)
+        if token:
+            changes.decode_sync_token(token)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({'success': False, 'error': 'Ошибка подключения к базе данных'}), 500
+    
+    try:
+        with conn.cursor() as cursor:
+            if not token:
+                return jsonify({
+                    'success': True,
+                    'changes': [],
+                    'next_token': changes.encode_sync_token(changes.current_horizon(cursor)),
+                    'has_more': False
+                })
+            result = changes.fetch_changes_page(cursor, token, limit)
+    except (Exception, Error) as error:
+        log_message(f"ERROR: Ошибка при получении изменений батчей: {error}")
+        return jsonify({'success': False, 'error': str(error)}), 500
+    
+    if result is None:
+        return jsonify({
+            'success': False,
+            'error': 'Журнал изменений за этот период очищен, требуется полная синхронизация',
+            'full_sync_required': True
+        }), 410
+    return jsonify({'success': True, 'count': len(result['changes']), **result})
+
+@route('/api/plans/import', methods=['POST'])
+@login_required
+def import_plans():
+    """
+    Массовый импорт записей плана из CSV/XLSX файла (поле формы file).
+    Поле conflict_mode (strict или warn) задает обработку пересечений расписания.
+    """
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return jsonify({'success': False, 'error': 'Файл не передан'}), 400
+    
+    conflict_mode = request.form.get('conflict_mode') or current_app.config['PLAN_CONFLICT_MODE']
+    if conflict_mode not in plans.CONFLICT_MODES:
+        return jsonify({'success': False, 'error': 'conflict_mode должен быть strict или warn'}), 400
+    
+    try:
+        file_format = request.form.get('format') or plans.detect_format(upload.filename)
+        rows = plans.iter_plan_rows(upload.stream, file_format)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({'success': False, 'error': 'Ошибка подключения к базе данных'}), 500
+    
+    try:
+        report = plans.import_plans(conn, rows, conflict_mode)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except (Exception, Error) as error:
+        log_message(f"ERROR: Ошибка при импорте плана: {error}")
+        return jsonify({'success': False, 'error': str(error)}), 500
+    
+    return jsonify({'success': True, **report})
+
+@route('/api/plans/batch', methods=['POST'])
+@login_required
+def plans_batch():
+    """
+    Пакетное создание и обновление записей плана.
+    Тело - JSON-массив записей (или {"items": [...]}) либо NDJSON
+    (Content-Type: application/x-ndjson). ?atomic=1 - все или ничего;
+    ?conflict_mode=strict|warn - обработка пересечений расписания.
+    """
+    atomic = request.args.get('atomic', '').lower() in ('1', 'true', 'yes')
+    conflict_mode = request.args.get('conflict_mode') or current_app.config['PLAN_CONFLICT_MODE']
+    if conflict_mode not in plans.CONFLICT_MODES:
+        return jsonify({'success': False, 'error': 'conflict_mode должен быть strict или warn'}), 400
+    
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items = list(itertools.islice(plans.iter_ndjson_items(request.stream), plans.BATCH_MAX_ITEMS + 1))
+    else:
+        data = request.get_json(silent=True)
+        items = data.get('items') if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            return jsonify({'success': False, 'error': 'Ожидается массив записей'}), 400
+    
+    if not items:
+        return jsonify({'success': False, 'error': 'Пакет не содержит записей'}), 400
+    
+    if len(items) > plans.BATCH_MAX_ITEMS:
+        return jsonify({'success': False, 'error': f'Не более {plans.BATCH_MAX_ITEMS} записей в одном пакете'}), 413
+    
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({'success': False, 'error': 'Ошибка подключения к базе данных'}), 500
+    
+    try:
+        results = plans.apply_plan_batch(conn, items, atomic=atomic, conflict_mode=conflict_mode)
+    except (Exception, Error) as error:
+        log_message(f"ERROR: Ошибка при пакетной записи плана: {error}")
+        return jsonify({'success': False, 'error': str(error)}), 500
+    
+    written = sum(1 for result in results if result['success'])
+    log_message(f"SUCCESS: Пакет плана: записано {written} из {len(results)}")
+    
+    return jsonify({
+        'success': written == len(results),
+        'written': written,
+        'error_count': len(results) - written,
+        'results': results
+    })
+
+@route('/update_data/<int:id>', methods=['POST'])
 @login_required
 def update_data(id):
     """Обновление существующей записи в базе данных"""
     try:
         data = request.get_json()
         
-        part_name = data.get('part_name')
-        planned_quantity = data.get('planned_quantity')
-        machine_number = data.get('machine_number')
-        start_time = data.get('start_time')
-        end_time = data.get('end_time')
-        
-        if not part_name or not part_name.strip():
-            return jsonify({'success': False, 'error': 'Part name не может быть пустым'}), 400
-        
-        if not planned_quantity:
-            return jsonify({'success': False, 'error': 'Planned quantity не может быть пустым'}), 400
-        
-        if not machine_number:
-            return jsonify({'success': False, 'error': 'Machine number не может быть пустым'}), 400
-        
-        if not start_time:
-            return jsonify({'success': False, 'error': 'Start time не может быть пустым'}), 400
-        
-        if not end_time:
-            return jsonify({'success': False, 'error': 'End time не может быть пустым'}), 400
-        
         try:
-            planned_quantity_int = int(planned_quantity)
-            if planned_quantity_int <= 0:
-                return jsonify({'success': False, 'error': 'Planned quantity должен быть положительным числом'}), 400
-        except ValueError:
-            return jsonify({'success': False, 'error': 'Planned quantity должен быть числом'}), 400
+            plan = plans.validate_plan(data)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        try:
-            machine_number_int = int(machine_number)
-            if machine_number_int <= 0:
-                return jsonify({'success': False, 'error': 'Machine number должен быть положительным числом'}), 400
-        except ValueError:
-            return jsonify({'success': False, 'error': 'Machine number должен быть числом'}), 400
-        
-        try:
-            start_time_dt = datetime.strptime(start_time, '%Y-%m-%dT%H:%M')
-            end_time_dt = datetime.strptime(end_time, '%Y-%m-%dT%H:%M')
-            
-            if end_time_dt <= start_time_dt:
-                return jsonify({'success': False, 'error': 'End time должен быть позже start time'}), 400
-        except ValueError:
-            return jsonify({'success': False, 'error': 'Неверный формат времени. Используйте YYYY-MM-DDTHH:MM'}), 400
+        conflict_mode = data.get('conflict_mode') or current_app.config['PLAN_CONFLICT_MODE']
+        if conflict_mode not in plans.CONFLICT_MODES:
+            return jsonify({'success': False, 'error': 'conflict_mode должен быть strict или warn'}), 400
         
         conn = get_db_connection()
         if conn is None:
@@ -611,6 +695,15 @@ def update_data(id):
         try:
             cursor = conn.cursor()
             
+            conflicts = find_plan_conflicts(cursor, plan, conflict_mode, exclude_id=id)
+            if conflicts and conflict_mode == 'strict':
+                conn.rollback()
+                return jsonify({
+                    'success': False,
+                    'error': format_plan_conflicts(plan, conflicts),
+                    'conflicts': conflicts
+                }), 409
+            
             update_query = """
             UPDATE production_plan 
             SET part_name = %s,
@@ -623,11 +716,11 @@ def update_data(id):
             """
             
             cursor.execute(update_query, (
-                part_name.strip(),
-                planned_quantity_int, 
-                machine_number_int,
-                start_time_dt,
-                end_time_dt,
+                plan['part_name'],
+                plan['planned_quantity'], 
+                plan['machine_number'],
+                plan['start_time'],
+                plan['end_time'],
                 id
             ))
             conn.commit()
@@ -639,17 +732,15 @@ def update_data(id):
             
             log_message(f"SUCCESS: Обновлена запись с ID={updated_id}")
             
+            message = f'Данные успешно обновлены (ID: {updated_id})'
+            if conflicts:
+                message += '. Внимание! ' + format_plan_conflicts(plan, conflicts)
+            
             return jsonify({
                 'success': True,
-                'message': f'Данные успешно обновлены (ID: {updated_id})',
-                'data': {
-                    'id': updated_id,
-                    'part_name': part_name.strip(),
-                    'planned_quantity': planned_quantity_int,
-                    'machine_number': machine_number_int,
-                    'start_time': start_time_dt.strftime('%Y-%m-%d %H:%M'),
-                    'end_time': end_time_dt.strftime('%Y-%m-%d %H:%M')
-                }
+                'message': message,
+                'data': plans.plan_to_dict(updated_id, plan),
+                'conflicts': conflicts
             })
             
         except (Exception, Error) as error:
@@ -661,21 +752,146 @@ def update_data(id):
         finally:
             if cursor:
                 cursor.close()
-            if conn:
-                conn.close()
                 
     except Exception as e:
         log_message(f"ERROR: Ошибка обработки запроса: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/get_filtered_data', methods=['GET'])
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 500
+
+def encode_page_cursor(start_time, record_id):
+    """Токен следующей страницы: позиция последней строки в порядке (start_time DESC, id DESC)"""
+    payload = json.dumps([start_time.isoformat(), record_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+def decode_page_cursor(token):
+    """Разбор токена страницы; ValueError при неверном формате"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        start_time, record_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(start_time), int(record_id)
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError('Неверный токен страницы')
+
+def parse_page_args(args, default_limit=PAGE_SIZE_DEFAULT):
+    """Размер страницы, позиция курсора и флаг подсчета общего количества из query string"""
+    try:
+        limit = int(args.get('limit', default_limit))
+    except ValueError:
+        raise ValueError('limit должен быть числом')
+    if limit <= 0:
+        raise ValueError('limit должен быть положительным числом')
+    limit = min(limit, PAGE_SIZE_MAX)
+    
+    token = args.get('cursor')
+    after = decode_page_cursor(token) if token else None
+    with_total = args.get('include_total', '').lower() in ('1', 'true', 'yes')
+    return limit, after, with_total
+
+def fetch_plans_page(cursor, limit, after=None, start_date=None, end_date=None, with_total=False):
+    """
+    Страница производственных батчей в порядке (start_time DESC, id DESC).
+    Keyset-пагинация: следующая страница начинается строго после строки after,
+    поэтому стоимость запроса не растет с номером страницы.
+    """
+    where_conditions = []
+    params = []
+    
+    if start_date:
+        where_conditions.append("pp.start_time >= %s")
+        params.append(start_date + ' 00:00:00')
+    
+    if end_date:
+        where_conditions.append("pp.start_time <= %s")
+        params.append(end_date + ' 23:59:59')
+    
+    total = None
+    if with_total:
+        count_query = "SELECT COUNT(*) FROM production_plan pp"
+        if where_conditions:
+            count_query += " WHERE " + " AND ".join(where_conditions)
+        cursor.execute(count_query, params)
+        total = cursor.fetchone()[0]
+    
+    if after is not None:
+        where_conditions.append("(pp.start_time, pp.id) < (%s, %s)")
+        params.extend(after)
+    
+    # Флаги считаются полусоединениями EXISTS: несколько событий
+    # 'Utilization hours' у батча не размножают строки, а GROUP BY не нужен
+    select_query = """
+    SELECT 
+        pp.id, 
+        pp.part_name, 
+        pp.planned_quantity, 
+        pp.machine_number, 
+        pp.start_time, 
+        pp.end_time,
+        EXISTS (
+            SELECT 1 FROM production p WHERE p.order_id = pp.id
+        ) as has_report,
+        EXISTS (
+            SELECT 1 FROM events e 
+            WHERE e.batch = pp.id AND e."Time_group" = 'Utilization hours'
+        ) as has_utilization_event
+    FROM production_plan pp
+    """
+    if where_conditions:
+        select_query += "WHERE " + " AND ".join(where_conditions)
+    
+    # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+    select_query += """
+    ORDER BY pp.start_time DESC, pp.id DESC
+    LIMIT %s
+    """
+    params.append(limit + 1)
+    
+    cursor.execute(select_query, params)
+    records = cursor.fetchall()
+    
+    next_cursor = None
+    if len(records) > limit:
+        records = records[:limit]
+        last = records[-1]
+        next_cursor = encode_page_cursor(last[4], last[0])
+    
+    data_list = []
+    for record in records:
+        data_list.append({
+            'id': record[0],
+            'part_name': record[1],
+            'planned_quantity': record[2],
+            'machine_number': record[3],
+            'start_time': record[4].strftime('%Y-%m-%d %H:%M'),
+            'end_time': record[5].strftime('%Y-%m-%d %H:%M'),
+            'has_report': record[6],  # True если отчет есть, False если нет
+            'has_utilization_event': record[7]  # True если есть событие с Utilization hours
+        })
+    
+    result = {
+        'success': True,
+        'count': len(data_list),
+        'data': data_list,
+        'next_cursor': next_cursor
+    }
+    if with_total:
+        result['total'] = total
+    return result
+
+@route('/get_filtered_data', methods=['GET'])
 @login_required
 def get_filtered_data():
-    """Получение отфильтрованных данных по диапазону дат"""
+    """Получение отфильтрованных данных по диапазону дат постранично"""
     try:
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
+        try:
+            limit, after, with_total = parse_page_args(request.args)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
         conn = get_db_connection()
         if conn is None:
             return jsonify({'success': False, 'error': 'Ошибка подключения к базе данных'}), 500
@@ -684,75 +900,14 @@ def get_filtered_data():
         try:
             cursor = conn.cursor()
             
-            # Базовый запрос
-            base_query = """
-            SELECT 
-                pp.id, 
-                pp.part_name, 
-                pp.planned_quantity, 
-                pp.machine_number, 
-                pp.start_time, 
-                pp.end_time,
-                CASE 
-                    WHEN p.id IS NOT NULL THEN true 
-                    ELSE false 
-                END as has_report,
-                CASE 
-                    WHEN e.event_id IS NOT NULL AND e."Time_group" = 'Utilization hours' THEN true 
-                    ELSE false 
-                END as has_utilization_event
-            FROM production_plan pp
-            LEFT JOIN production p ON pp.id = p.order_id
-            LEFT JOIN events e ON pp.id = e.batch AND e."Time_group" = 'Utilization hours'
-            """
+            etag = make_etag(changes.data_fingerprint(cursor))
+            cached = not_modified(etag)
+            if cached is not None:
+                return cached
             
-            where_conditions = []
-            params = []
-            
-            # Добавляем условия фильтрации, если указаны даты
-            if start_date:
-                where_conditions.append("pp.start_time >= %s")
-                params.append(start_date + ' 00:00:00')
-            
-            if end_date:
-                where_conditions.append("pp.start_time <= %s")
-                params.append(end_date + ' 23:59:59')
-            
-            # Собираем полный запрос
-            if where_conditions:
-                where_clause = "WHERE " + " AND ".join(where_conditions)
-                select_query = base_query + " " + where_clause
-            else:
-                select_query = base_query
-            
-            # Добавляем GROUP BY и сортировку
-            select_query += """
-            GROUP BY pp.id, pp.part_name, pp.planned_quantity, pp.machine_number, 
-                     pp.start_time, pp.end_time, p.id, e.event_id, e."Time_group"
-            ORDER BY pp.start_time DESC, pp.id DESC
-            """
-            
-            cursor.execute(select_query, params)
-            records = cursor.fetchall()
-            
-            data_list = []
-            for record in records:
-                data_list.append({
-                    'id': record[0],
-                    'part_name': record[1],
-                    'planned_quantity': record[2],
-                    'machine_number': record[3],
-                    'start_time': record[4].strftime('%Y-%m-%d %H:%M'),
-                    'end_time': record[5].strftime('%Y-%m-%d %H:%M'),
-                    'has_report': record[6],
-                    'has_utilization_event': record[7]
-                })
-            
-            return jsonify({
-                'success': True,
-                'count': len(data_list),
-                'data': data_list
-            })
+            result = fetch_plans_page(cursor, limit, after=after, start_date=start_date,
+                                      end_date=end_date, with_total=with_total)
+            return with_cache_headers(jsonify(result), etag)
             
         except (Exception, Error) as error:
             log_message(f"ERROR: Ошибка при получении отфильтрованных данных: {error}")
@@ -761,19 +916,22 @@ def get_filtered_data():
         finally:
             if cursor:
                 cursor.close()
-            if conn:
-                conn.close()
                 
     except Exception as e:
         log_message(f"ERROR: Ошибка обработки запроса: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/get_data', methods=['GET'])
+@route('/get_data', methods=['GET'])
 @login_required
 def get_data():
-    """Получение списка сохраненных данных - только 10 последних записей с информацией о наличии отчета и событий"""
+    """Получение списка сохраненных данных - первая страница (10 последних записей) с информацией о наличии отчета и событий"""
     try:
+        try:
+            limit, after, with_total = parse_page_args(request.args, default_limit=10)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
         conn = get_db_connection()
         if conn is None:
             return jsonify({'success': False, 'error': 'Ошибка подключения к базе данных'}), 500
@@ -782,53 +940,13 @@ def get_data():
         try:
             cursor = conn.cursor()
             
-            # Измененный запрос с LEFT JOIN для проверки наличия отчета и события с Utilization hours
-            select_query = """
-            SELECT 
-                pp.id, 
-                pp.part_name, 
-                pp.planned_quantity, 
-                pp.machine_number, 
-                pp.start_time, 
-                pp.end_time,
-                CASE 
-                    WHEN p.id IS NOT NULL THEN true 
-                    ELSE false 
-                END as has_report,
-                CASE 
-                    WHEN e.event_id IS NOT NULL AND e."Time_group" = 'Utilization hours' THEN true 
-                    ELSE false 
-                END as has_utilization_event
-            FROM production_plan pp
-            LEFT JOIN production p ON pp.id = p.order_id
-            LEFT JOIN events e ON pp.id = e.batch AND e."Time_group" = 'Utilization hours'
-            GROUP BY pp.id, pp.part_name, pp.planned_quantity, pp.machine_number, 
-                     pp.start_time, pp.end_time, p.id, e.event_id, e."Time_group"
-            ORDER BY pp.id DESC
-            LIMIT 10;
-            """
+            etag = make_etag(changes.data_fingerprint(cursor))
+            cached = not_modified(etag)
+            if cached is not None:
+                return cached
             
-            cursor.execute(select_query)
-            records = cursor.fetchall()
-            
-            data_list = []
-            for record in records:
-                data_list.append({
-                    'id': record[0],
-                    'part_name': record[1],
-                    'planned_quantity': record[2],
-                    'machine_number': record[3],
-                    'start_time': record[4].strftime('%Y-%m-%d %H:%M'),
-                    'end_time': record[5].strftime('%Y-%m-%d %H:%M'),
-                    'has_report': record[6],  # True если отчет есть, False если нет
-                    'has_utilization_event': record[7]  # True если есть событие с Utilization hours
-                })
-            
-            return jsonify({
-                'success': True,
-                'count': len(data_list),
-                'data': data_list
-            })
+            result = fetch_plans_page(cursor, limit, after=after, with_total=with_total)
+            return with_cache_headers(jsonify(result), etag)
             
         except (Exception, Error) as error:
             log_message(f"ERROR: Ошибка при получении данных: {error}")
@@ -837,14 +955,12 @@ def get_data():
         finally:
             if cursor:
                 cursor.close()
-            if conn:
-                conn.close()
                 
     except Exception as e:
         log_message(f"ERROR: Ошибка обработки запроса: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/delete_data/<int:id>', methods=['DELETE'])
+@route('/delete_data/<int:id>', methods=['DELETE'])
 @login_required
 def delete_data(id):
     """Удаление записи из базы данных"""
@@ -895,14 +1011,12 @@ def delete_data(id):
         finally:
             if cursor:
                 cursor.close()
-            if conn:
-                conn.close()
                 
     except Exception as e:
         log_message(f"ERROR: Ошибка обработки запроса: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/events/<int:batch_id>')
+@route('/events/<int:batch_id>')
 @login_required
 def events_page(batch_id):
     """Страница для внесения событий"""
@@ -914,6 +1028,11 @@ def events_page(batch_id):
     try:
         cursor = conn.cursor()
         
+        etag = make_etag(changes.data_fingerprint(cursor, batch_id))
+        cached = not_modified(etag)
+        if cached is not None:
+            return cached
+        
         # Получаем информацию о батче
         select_batch_query = """
         SELECT id, part_name, planned_quantity, machine_number, 
@@ -964,10 +1083,10 @@ def events_page(batch_id):
                 'comments': event[6]
             })
         
-        return render_template('events.html', 
+        return with_cache_headers(make_response(render_template('events.html', 
                              batch=batch_data, 
                              events=events_list,
-                             username=session.get('username'))
+                             username=session.get('username'))), etag)
         
     except (Exception, Error) as error:
         log_message(f"ERROR: Ошибка при получении данных событий: {error}")
@@ -976,10 +1095,40 @@ def events_page(batch_id):
     finally:
         if cursor:
             cursor.close()
-        if conn:
-            conn.close()
 
-@app.route('/save_event', methods=['POST'])
+def find_overlapping_event(cursor, batch_id, start_time, end_time):
+    """Событие батча, пересекающееся с интервалом [start_time, end_time) (по индексу events_no_overlap)"""
+    select_query = """
+    SELECT event_id, event_name, 
+           "Фактические время начала события", "Фактические время конца события", 
+           "Time_group"
+    FROM events 
+    WHERE batch = %s 
+      AND tsrange("Фактические время начала события", "Фактические время конца события", '[)') 
+          && tsrange(%s, %s, '[)')
+    ORDER BY "Фактические время начала события"
+    LIMIT 1;
+    """
+    cursor.execute(select_query, (batch_id, start_time, end_time))
+    event = cursor.fetchone()
+    if event is None:
+        return None
+    return {
+        'event_id': event[0],
+        'event_name': event[1],
+        'actual_start_time': event[2].strftime('%Y-%m-%d %H:%M'),
+        'actual_end_time': event[3].strftime('%Y-%m-%d %H:%M'),
+        'time_group': event[4]
+    }
+
+def format_event_conflict(conflict):
+    if conflict is None:
+        return 'Событие пересекается по времени с другим событием батча'
+    return (f"Событие пересекается с событием ID {conflict['event_id']} "
+            f"«{conflict['event_name']}» ({conflict['time_group']}, "
+            f"{conflict['actual_start_time']} – {conflict['actual_end_time']})")
+
+@route('/save_event', methods=['POST'])
 @login_required
 def save_event():
     """Сохранение нового события"""
@@ -1049,15 +1198,24 @@ def save_event():
             RETURNING event_id;
             """
             
-            cursor.execute(insert_query, (
-                event_name.strip(),
-                batch_id,
-                actual_start_time_dt,
-                actual_end_time_dt,
-                time_group,
-                responsible if time_group == 'Breakdown time' else None,
-                comments.strip() if comments else None
-            ))
+            try:
+                cursor.execute(insert_query, (
+                    event_name.strip(),
+                    batch_id,
+                    actual_start_time_dt,
+                    actual_end_time_dt,
+                    time_group,
+                    responsible if time_group == 'Breakdown time' else None,
+                    comments.strip() if comments else None
+                ))
+            except errors.ExclusionViolation:
+                conn.rollback()
+                conflict = find_overlapping_event(cursor, batch_id, actual_start_time_dt, actual_end_time_dt)
+                return jsonify({
+                    'success': False,
+                    'error': format_event_conflict(conflict),
+                    'conflict': conflict
+                }), 409
             conn.commit()
             
             event_id = cursor.fetchone()[0]
@@ -1104,15 +1262,13 @@ def save_event():
         finally:
             if cursor:
                 cursor.close()
-            if conn:
-                conn.close()
                 
     except Exception as e:
         log_message(f"ERROR: Ошибка обработки запроса: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/delete_event/<int:event_id>', methods=['DELETE'])
+@route('/delete_event/<int:event_id>', methods=['DELETE'])
 @login_required
 def delete_event(event_id):
     """Удаление события"""
@@ -1182,14 +1338,204 @@ def delete_event(event_id):
         finally:
             if cursor:
                 cursor.close()
-            if conn:
-                conn.close()
                 
     except Exception as e:
         log_message(f"ERROR: Ошибка обработки запроса: {e}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/logout')
+@route('/api/oee', methods=['GET'])
+@login_required
+def api_oee():
+    """
+    Показатели OEE за период.
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD&group_by=machine,batch,shift,day,part&machine=1,2
+    """
+    try:
+        date_from, date_to = oee.parse_period(request.args.get('from'), request.args.get('to'))
+        dimensions = oee.parse_dimensions(request.args.get('group_by', 'machine'))
+        machines = [int(m) for m in request.args.get('machine', '').split(',') if m.strip()]
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({'success': False, 'error': 'Ошибка подключения к базе данных'}), 500
+    
+    try:
+        result = oee.compute_oee(conn, date_from, date_to, dimensions, machines)
+    except (Exception, Error) as error:
+        log_message(f"ERROR: Ошибка при расчете OEE: {error}")
+        return jsonify({'success': False, 'error': str(error)}), 500
+    
+    return jsonify({
+        'success': True,
+        'from': date_from.strftime('%Y-%m-%d'),
+        'to': (date_to - timedelta(days=1)).strftime('%Y-%m-%d'),
+        'group_by': dimensions,
+        **result
+    })
+
+@route('/api/rollups', methods=['GET'])
+@login_required
+def api_rollups():
+    """Сводка по дням и сменам: ?from=YYYY-MM-DD&to=YYYY-MM-DD&machine=1,2"""
+    try:
+        date_from, date_to = oee.parse_period(request.args.get('from'), request.args.get('to'))
+        machines = [int(m) for m in request.args.get('machine', '').split(',') if m.strip()]
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({'success': False, 'error': 'Ошибка подключения к базе данных'}), 500
+    
+    try:
+        rows = rollups.query_rollups(conn, date_from.date(), (date_to - timedelta(days=1)).date(), machines)
+    except (Exception, Error) as error:
+        log_message(f"ERROR: Ошибка при получении сводки: {error}")
+        return jsonify({'success': False, 'error': str(error)}), 500
+    
+    return jsonify({'success': True, 'count': len(rows), 'data': rows})
+
+@route('/api/export/<name>', methods=['GET'])
+@login_required
+def api_export(name):
+    """
+    Потоковая выгрузка: /api/export/{plans,reports,events}
+    ?from=YYYY-MM-DD&to=YYYY-MM-DD&format=csv|ndjson&gzip=1
+    """
+    if name not in exports.EXPORTS:
+        return jsonify({'success': False, 'error': f'Неизвестная выгрузка: {name}'}), 404
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in exports.FORMATS:
+        return jsonify({'success': False, 'error': 'Формат должен быть csv или ndjson'}), 400
+    try:
+        date_from, date_to = oee.parse_period(request.args.get('from'), request.args.get('to'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true', 'yes')
+    
+    # Ответ читается уже после выхода из обработчика, поэтому соединение
+    # берется отдельно от контекста приложения и возвращается при закрытии ответа
+    conn = db.checkout_connection()
+    if conn is None:
+        return jsonify({'success': False, 'error': 'Ошибка подключения к базе данных'}), 500
+    
+    try:
+        body = exports.iter_export(conn, name, date_from, date_to, export_format)
+    except (Exception, Error) as error:
+        db.return_connection(conn)
+        log_message(f"ERROR: Ошибка при выгрузке {name}: {error}")
+        return jsonify({'success': False, 'error': str(error)}), 500
+    
+    filename = f"{name}_{date_from:%Y%m%d}_{(date_to - timedelta(days=1)):%Y%m%d}.{export_format}"
+    mimetype = exports.FORMATS[export_format]
+    if compress:
+        body = exports.gzip_stream(body)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response.call_on_close(lambda: db.return_connection(conn))
+    log_message(f"INFO: Начата выгрузка {name} ({export_format}) за {date_from:%Y-%m-%d} - {date_to - timedelta(days=1):%Y-%m-%d}")
+    return response
+
+@route('/stream/plans')
+@login_required
+def stream_plans():
+    """
+    Поток Server-Sent Events с изменениями батчей: событие plan содержит
+    текущее состояние батча (или deleted=true), событие reset - признак
+    того, что данные нужно перезагрузить. Продолжение после обрыва - по Last-Event-ID.
+    Сверх STREAM_MAX_CLIENTS потоков в процессе отвечает 503.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    since = None
+    if last_event_id:
+        try:
+            since = int(last_event_id)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Неверный Last-Event-ID'}), 400
+    
+    if not changes.acquire_stream_slot():
+        # Страница переходит на опрос /api/plans/changes
+        response = jsonify({'success': False, 'error': 'Достигнут предел открытых потоков, используйте /api/plans/changes'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '60'
+        return response
+    
+    try:
+        response = Response(changes.stream_plan_changes(since), mimetype='text/event-stream')
+    except Exception:
+        changes.release_stream_slot()
+        raise
+    response.headers['Cache-Control'] = 'no-cache'
+    # Отключает буферизацию ответа в nginx
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(changes.release_stream_slot)
+    return response
+
+@route('/api/schedule/preview', methods=['POST'])
+@login_required
+def schedule_preview():
+    """
+    Расчет расписания для незапланированных батчей без записи в базу.
+    Тело: {"batches": [{"part_name", "quantity", "priority"}], "start": "YYYY-MM-DDTHH:MM",
+           "machines": [1, 2], "pauses": [{"machine_number", "start", "end"}]}
+    """
+    try:
+        batches, start, machines, pauses = scheduler.parse_request(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({'success': False, 'error': 'Ошибка подключения к базе данных'}), 500
+    
+    try:
+        result = scheduler.build_schedule(conn, batches, start, machines, pauses)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except (Exception, Error) as error:
+        log_message(f"ERROR: Ошибка при расчете расписания: {error}")
+        return jsonify({'success': False, 'error': str(error)}), 500
+    
+    return jsonify({'success': True, **result})
+
+@route('/api/schedule/commit', methods=['POST'])
+@login_required
+def schedule_commit():
+    """Запись расписания из /api/schedule/preview: {"plans": [...]}"""
+    data = request.get_json(silent=True)
+    items = data.get('plans') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'error': 'Список plans не может быть пустым'}), 400
+    
+    conn = get_db_connection()
+    if conn is None:
+        return jsonify({'success': False, 'error': 'Ошибка подключения к базе данных'}), 500
+    
+    try:
+        results, conflicts = scheduler.commit_schedule(conn, items)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except (Exception, Error) as error:
+        log_message(f"ERROR: Ошибка при записи расписания: {error}")
+        return jsonify({'success': False, 'error': str(error)}), 500
+    
+    if conflicts:
+        return jsonify({
+            'success': False,
+            'error': 'Расписание устарело: интервалы станков заняты, повторите предпросмотр',
+            'conflicts': conflicts
+        }), 409
+    
+    written = sum(1 for result in results if result['success'])
+    log_message(f"SUCCESS: Записано расписание: {written} батчей")
+    return jsonify({'success': written == len(results), 'written': written, 'results': results})
+
+@route('/logout')
 def logout():
     """Выход из системы"""
     username = session.get('username', 'Неизвестный пользователь')
@@ -1199,10 +1545,4 @@ def logout():
     return redirect(url_for('login'))
 
 if __name__ == '__main__':
-    log_message("INFO: Инициализация базы данных...")
-    if init_database():
-        log_message("INFO: База данных готова к работе")
-    else:
-        log_message("WARNING: Возникли проблемы с инициализацией базы данных")
-    
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    create_app({'DEBUG': True}).run(host='0.0.0.0', port=5000)
@@ -0,0 +1,194 @@
+"""
+Журнал приложения.
+
+log_message("УРОВЕНЬ: текст") только ставит запись в очередь; форматирование
+и вывод выполняет фоновый поток QueueListener, поэтому обработчик запроса
+не ждет вывода. Записи идут в stderr (LOG_STREAM=stdout - в stdout): stdout
+команд и дочерних процессов остается для их собственного вывода. Каждая запись - строка JSON с временем, уровнем,
+текстом, процессом и, внутри HTTP-запроса, идентификатором запроса, маршрутом,
+пользователем и временем от начала запроса. LOG_FORMAT=text возвращает
+прежний вид "[время] УРОВЕНЬ: текст" для разработки.
+
+Записи ниже LOG_LEVEL отбрасываются до постановки в очередь. Частые
+INFO-записи, отмеченные sampled=True (например, выдача соединения на каждый
+запрос), пишутся с вероятностью LOG_SAMPLE_RATE.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request, session
+
+SUCCESS = 25
+logging.addLevelName(SUCCESS, 'SUCCESS')
+
+LEVELS = {
+    'DEBUG': logging.DEBUG,
+    'INFO': logging.INFO,
+    'SUCCESS': SUCCESS,
+    'WARNING': logging.WARNING,
+    'ERROR': logging.ERROR,
+}
+
+# Идентификатор запроса от балансировщика принимается, если он похож на идентификатор
+_REQUEST_ID = re.compile(r"^[\w.\-]{1,64}$")
+
+logger = logging.getLogger('flask_blog')
+logger.propagate = False
+
+# Настройки процесса; init_app заменяет их настройками приложения
+_settings = {
+    'level': LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').upper(), logging.INFO),
+    'format': os.environ.get('LOG_FORMAT', 'json'),
+    'sample_rate': float(os.environ.get('LOG_SAMPLE_RATE', 0.01)),
+    'stream': os.environ.get('LOG_STREAM', 'stderr'),
+}
+
+STREAMS = ('stderr', 'stdout')
+logger.setLevel(_settings['level'])
+
+_listener_lock = threading.Lock()
+_listener = None
+_listener_pid = None
+
+
+def init_app(app):
+    """Настройки журнала и идентификатор запроса"""
+    app.config.setdefault('LOG_LEVEL', os.environ.get('LOG_LEVEL', 'INFO'))
+    app.config.setdefault('LOG_FORMAT', os.environ.get('LOG_FORMAT', 'json'))
+    # Доля записываемых частых INFO-сообщений (sampled=True)
+    app.config.setdefault('LOG_SAMPLE_RATE', float(os.environ.get('LOG_SAMPLE_RATE', 0.01)))
+    app.config.setdefault('LOG_STREAM', os.environ.get('LOG_STREAM', 'stderr'))
+
+    level = app.config['LOG_LEVEL'].upper()
+    if level not in LEVELS:
+        raise ValueError(f"LOG_LEVEL: неизвестный уровень {app.config['LOG_LEVEL']}")
+    if app.config['LOG_STREAM'] not in STREAMS:
+        raise ValueError(f"LOG_STREAM: ожидается stderr или stdout, получено {app.config['LOG_STREAM']}")
+    _settings['level'] = LEVELS[level]
+    _settings['format'] = app.config['LOG_FORMAT']
+    _settings['sample_rate'] = app.config['LOG_SAMPLE_RATE']
+    _settings['stream'] = app.config['LOG_STREAM']
+    logger.setLevel(_settings['level'])
+    if _listener_pid == os.getpid():
+        # Формат и поток меняются в уже запущенном потоке вывода
+        _listener.handlers[0].setFormatter(_formatter())
+        _listener.handlers[0].setStream(_stream())
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'pid': record.process,
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"[{datetime.fromtimestamp(record.created):%Y-%m-%d %H:%M:%S}] {record.levelname}: {record.getMessage()}"
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + json.dumps(fields, ensure_ascii=False, default=str)
+        return line
+
+
+def _formatter():
+    return TextFormatter() if _settings['format'] == 'text' else JsonFormatter()
+
+
+def _stream():
+    return sys.stdout if _settings['stream'] == 'stdout' else sys.stderr
+
+
+def _ensure_listener():
+    """Очередь и поток вывода текущего процесса; поток не переживает fork"""
+    global _listener, _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _listener_lock:
+        if _listener_pid == pid:
+            return
+        records = queue.SimpleQueue()
+        output = logging.StreamHandler(_stream())
+        output.setFormatter(_formatter())
+        _listener = QueueListener(records, output)
+        _listener.start()
+        logger.handlers = [QueueHandler(records)]
+        _listener_pid = pid
+
+
+def flush():
+    """Вывод записей из очереди и остановка потока (при завершении процесса)"""
+    global _listener_pid
+    with _listener_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            _listener.stop()
+            _listener_pid = None
+
+
+atexit.register(flush)
+
+
+def _request_fields():
+    fields = {
+        'request_id': g.get('request_id'),
+        'method': request.method,
+        'path': request.path,
+        'route': request.endpoint,
+        'user': session.get('username'),
+    }
+    started = g.get('log_started')
+    if started is not None:
+        fields['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return fields
+
+
+def log_message(message, sampled=False, **fields):
+    """
+    Запись в журнал. Уровень берется из префикса сообщения ("ERROR: ...");
+    fields - дополнительные поля записи.
+    """
+    name, separator, text = message.partition(': ')
+    level = LEVELS.get(name) if separator else None
+    if level is None:
+        level, text = logging.INFO, message
+    if level < _settings['level']:
+        return
+    if sampled and level <= logging.INFO and random.random() >= _settings['sample_rate']:
+        return
+
+    _ensure_listener()
+    if has_request_context():
+        fields = {**_request_fields(), **fields}
+    logger.log(level, text, extra={'fields': fields})
+
+
+def _start_request():
+    g.log_started = time.perf_counter()
+    request_id = request.headers.get('X-Request-ID', '')
+    g.request_id = request_id if _REQUEST_ID.match(request_id) else uuid.uuid4().hex
+
+
+def _finish_request(response):
+    if g.get('request_id'):
+        response.headers['X-Request-ID'] = g.request_id
+    return response
@@ -0,0 +1,16 @@
+"""
+Нагрузочное тестирование маршрутов приложения.
+
+    python -m bench                          # временная локальная PostgreSQL, все маршруты
+    python -m bench --database-url URL       # уже развернутая база
+    python -m bench --save-baseline main     # сохранить результат в bench/baselines/main.json
+    python -m bench --compare main           # сравнить с сохраненным результатом
+    python -m bench --startup-only --compare main   # только время запуска (CI без базы)
+    python -m bench --server gunicorn --profile gevent   # gunicorn.conf.py с профилем воркеров
+
+Приложение запускается отдельным процессом (flask или gunicorn) и получает
+строку подключения через DATABASE_URL; маршруты нагружаются настоящими
+HTTP-запросами из нескольких потоков, каждый маршрут - отдельной фазой.
+Время запуска измеряется дважды: import app + create_app() в новом
+интерпретаторе без доступной базы и время от старта сервера до первого ответа.
+"""
@@ -0,0 +1,206 @@
+"""
+Запуск нагрузочного теста: python -m bench --help
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from bench import load, pg
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_DIR = os.path.join(ROOT, 'bench', 'baselines')
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _app_env(dsn):
+    # Схему готовит prepare_database, приложению мигрировать не нужно;
+    # журнал уходит в stderr, stdout дочернего процесса - только для замеров
+    return dict(os.environ, DATABASE_URL=dsn, DB_AUTO_MIGRATE='0', LOG_STREAM='stderr',
+                SECRET_KEY=os.environ.get('SECRET_KEY', 'bench'))
+
+
+def measure_create_app(runs=5):
+    """
+    Медиана времени импорта app и create_app() в новом интерпретаторе, мс.
+    База недоступна: создание приложения не должно к ней обращаться.
+    """
+    code = ("import time; started = time.perf_counter(); import app; app.create_app(); "
+            "print('create_app_seconds', time.perf_counter() - started)")
+    env = _app_env('postgresql://127.0.0.1:9/unreachable')
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                                capture_output=True, text=True, check=True)
+        seconds = [line.split()[1] for line in result.stdout.splitlines()
+                   if line.startswith('create_app_seconds ')]
+        if not seconds:
+            raise RuntimeError(f'Замер create_app не вернул результат: {result.stdout[-500:]}')
+        timings.append(float(seconds[-1]) * 1000)
+    return round(sorted(timings)[len(timings) // 2], 1)
+
+
+@contextmanager
+def app_server(dsn, server, profile, workers=None, threads=None):
+    """Приложение в отдельном процессе; возвращает порт и время до первого ответа, мс"""
+    port = _free_port()
+    env = _app_env(dsn)
+    if server == 'gunicorn':
+        # Те же настройки, что в эксплуатации: gunicorn.conf.py и профиль воркеров
+        env.update(GUNICORN_PROFILE=profile, GUNICORN_ACCESSLOG='')
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}']
+        if workers:
+            command += ['--workers', str(workers)]
+        if threads:
+            command += ['--threads', str(threads)]
+    else:
+        command = [sys.executable, '-m', 'flask', '--app', 'app', 'run',
+                   '--port', str(port), '--with-threads', '--no-reload', '--no-debugger']
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f'Сервер приложения завершился с кодом {process.returncode}')
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1).read()
+                break
+            except (urllib.error.URLError, ConnectionError):
+                if time.monotonic() > deadline:
+                    raise RuntimeError('Сервер приложения не запустился за 30 секунд')
+                time.sleep(0.05)
+        yield port, round((time.perf_counter() - started) * 1000, 1)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _baseline_path(name):
+    if name.endswith('.json') or os.sep in name:
+        return name
+    return os.path.join(BASELINES_DIR, f'{name}.json')
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='python -m bench', description='Нагрузочный тест маршрутов приложения')
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL'),
+                        help='Существующая база; по умолчанию поднимается временная локальная PostgreSQL')
+    parser.add_argument('--skip-migrations', action='store_true',
+                        help='Не применять миграции (схема уже создана)')
+    parser.add_argument('--routes', default=','.join(load.SCENARIOS),
+                        help='Маршруты через запятую: ' + ', '.join(load.SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8, help='Число одновременных клиентов')
+    parser.add_argument('--duration', type=float, default=10, help='Длительность замера маршрута, секунды')
+    parser.add_argument('--warmup', type=float, default=2, help='Прогрев перед замером, секунды')
+    parser.add_argument('--plans', type=int, default=20000, help='Сколько батчей засеять в пустую базу')
+    parser.add_argument('--server', choices=('flask', 'gunicorn'), default='flask')
+    parser.add_argument('--profile', choices=('sync', 'gthread', 'gevent'), default='gthread',
+                        help='Профиль воркеров gunicorn.conf.py')
+    parser.add_argument('--workers', type=int, help='Воркеры gunicorn; по умолчанию - из профиля')
+    parser.add_argument('--threads', type=int, help='Потоки воркера gunicorn; по умолчанию - из профиля')
+    parser.add_argument('--startup-only', action='store_true',
+                        help='Только время запуска приложения, без базы и нагрузки')
+    parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора случайных чисел')
+    parser.add_argument('--output', help='Записать результат в JSON-файл')
+    parser.add_argument('--save-baseline', metavar='NAME', help='Сохранить результат как базовый прогон')
+    parser.add_argument('--compare', metavar='NAME', help='Сравнить с базовым прогоном')
+    parser.add_argument('--max-regression', type=float, default=20,
+                        help='Допустимый рост p95 / падение RPS при сравнении, проценты')
+    args = parser.parse_args(argv)
+
+    args.routes = [route.strip() for route in args.routes.split(',') if route.strip()]
+    unknown = [route for route in args.routes if route not in load.SCENARIOS]
+    if unknown:
+        parser.error(f"неизвестные маршруты: {', '.join(unknown)}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    results = {
+        'meta': {
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'server': args.server,
+            'profile': args.profile if args.server == 'gunicorn' else None,
+            'workers': args.workers,
+            'threads': args.threads,
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+        },
+        'startup': {'create_app_ms': measure_create_app()},
+        'routes': {},
+    }
+
+    if not args.startup_only:
+        database = nullcontext(args.database_url) if args.database_url else pg.local_postgres()
+        with database as dsn:
+            print('Подготовка базы...', flush=True)
+            context = pg.prepare_database(dsn, plans=args.plans, migrate=not args.skip_migrations)
+            results['meta']['plans'] = context['max_id'] - context['min_id'] + 1
+
+            server = app_server(dsn, args.server, args.profile, args.workers, args.threads)
+            with server as (port, first_response_ms):
+                results['startup']['first_response_ms'] = first_response_ms
+                for route in args.routes:
+                    print(f'  {route}...', flush=True)
+                    results['routes'][route] = load.run_route(
+                        '127.0.0.1', port, route, context, args.concurrency, args.duration,
+                        warmup=args.warmup, seed=args.seed
+                    )
+
+    print()
+    print(load.format_table(results))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        path = _baseline_path(args.save_baseline)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f'\nБазовый прогон сохранен: {path}')
+
+    if args.compare:
+        with open(_baseline_path(args.compare), encoding='utf-8') as f:
+            baseline = json.load(f)
+        lines, regressions = load.compare(results, baseline, args.max_regression)
+        print(f"\nСравнение с {args.compare} ({baseline['meta'].get('revision')}):")
+        print('\n'.join(lines))
+        if regressions:
+            print(f"\nРегрессия больше {args.max_regression}%: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
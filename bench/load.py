@@ -0,0 +1,306 @@
+"""
+Сценарии маршрутов, нагрузка из нескольких потоков и статистика задержек.
+"""
+import http.client
+import itertools
+import json
+import math
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+
+USERNAME = 'admin'
+PASSWORD = '1234'
+
+
+class Client:
+    """HTTP-клиент одного потока: постоянное соединение и cookie сессии"""
+
+    def __init__(self, host, port, timeout=30):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.cookie = None
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None, use_session=True):
+        headers = dict(headers or {})
+        if use_session and self.cookie:
+            headers['Cookie'] = self.cookie
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                # Сервер мог закрыть соединение после предыдущего ответа
+                self.close()
+                if attempt == 2:
+                    raise
+                continue
+            if response.getheader('Connection', '').lower() == 'close' or response.version == 10:
+                self.close()
+            set_cookie = response.getheader('Set-Cookie')
+            if use_session and set_cookie:
+                self.cookie = set_cookie.split(';', 1)[0]
+            return response.status, data
+
+    def post_form(self, path, fields, use_session=True):
+        return self.request('POST', path, urlencode(fields),
+                            {'Content-Type': 'application/x-www-form-urlencoded'}, use_session)
+
+    def post_json(self, path, payload):
+        return self.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+
+    def login(self):
+        status, _ = self.post_form('/', {'username': USERNAME, 'password': PASSWORD})
+        if status != 302 or not self.cookie:
+            raise RuntimeError(f'Не удалось войти в приложение: HTTP {status}')
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+_sequence = itertools.count()
+_sequence_lock = threading.Lock()
+
+
+def _next_sequence():
+    with _sequence_lock:
+        return next(_sequence)
+
+
+def _random_day(context, rng):
+    span = (context['last_day'] - context['first_day']).days
+    return context['first_day'] + timedelta(days=rng.randint(0, max(span - 7, 0)))
+
+
+def scenario_login(client, context, rng):
+    # Каждый вход - новая сессия, cookie потока не меняется
+    return client.post_form('/', {'username': USERNAME, 'password': PASSWORD}, use_session=False)
+
+
+def scenario_home(client, context, rng):
+    return client.request('GET', '/home')
+
+
+def scenario_get_data(client, context, rng):
+    return client.request('GET', '/get_data')
+
+
+def scenario_get_filtered_data(client, context, rng):
+    start = _random_day(context, rng)
+    query = urlencode({
+        'start_date': start.isoformat(),
+        'end_date': (start + timedelta(days=7)).isoformat(),
+        'include_total': 1,
+    })
+    return client.request('GET', f'/get_filtered_data?{query}')
+
+
+def scenario_save_data(client, context, rng):
+    # Новые батчи ставятся после засеянного периода, каждый в свой интервал
+    start = datetime.combine(context['last_day'], datetime.min.time()) + timedelta(days=30) \
+        + timedelta(hours=2 * _next_sequence())
+    return client.post_json('/save_data', {
+        'part_name': f'Деталь {rng.randint(1, 200)}',
+        'planned_quantity': rng.randint(50, 500),
+        'machine_number': rng.randint(1, context['machines']),
+        'start_time': start.strftime('%Y-%m-%dT%H:%M'),
+        'end_time': (start + timedelta(minutes=110)).strftime('%Y-%m-%dT%H:%M'),
+    })
+
+
+def scenario_save_event(client, context, rng):
+    # Уникальная минута для каждого события, чтобы не пересекаться с соседними
+    start = datetime(2040, 1, 1) + timedelta(minutes=2 * _next_sequence())
+    return client.post_json('/save_event', {
+        'batch_id': rng.randint(context['min_id'], context['max_id']),
+        'event_name': 'Простой',
+        'actual_start_time': start.strftime('%Y-%m-%dT%H:%M'),
+        'actual_end_time': (start + timedelta(minutes=1)).strftime('%Y-%m-%dT%H:%M'),
+        'time_group': 'Planned pause time',
+    })
+
+
+def scenario_save_production_report(client, context, rng):
+    order_id = rng.randint(context['min_id'], context['max_id'])
+    start = datetime.combine(context['first_day'], datetime.min.time())
+    return client.post_json('/save_production_report', {
+        'order_id': order_id,
+        'part_number': f'LOT-{order_id}',
+        'actual_quantity': rng.randint(50, 500),
+        'bubble_count': rng.randint(0, 3),
+        'underfill_count': rng.randint(0, 3),
+        'inclusion_count': 0,
+        'actual_start_time': start.strftime('%Y-%m-%dT%H:%M'),
+        'actual_end_time': (start + timedelta(hours=2)).strftime('%Y-%m-%dT%H:%M'),
+    })
+
+
+# Маршрут -> (сценарий, ожидаемый код ответа)
+SCENARIOS = {
+    'login': (scenario_login, 302),
+    'home': (scenario_home, 200),
+    'get_data': (scenario_get_data, 200),
+    'get_filtered_data': (scenario_get_filtered_data, 200),
+    'save_data': (scenario_save_data, 200),
+    'save_event': (scenario_save_event, 200),
+    'save_production_report': (scenario_save_production_report, 200),
+}
+
+
+def percentile(sorted_values, fraction):
+    """Процентиль методом ближайшего ранга"""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[rank]
+
+
+def summarize(latencies, errors, elapsed, statuses):
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        'requests': count,
+        'errors': errors,
+        'rps': round(count / elapsed, 1) if elapsed > 0 else 0.0,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'mean_ms': ms(sum(latencies) / count) if count else None,
+        'max_ms': ms(latencies[-1]) if count else None,
+        'statuses': {str(status): n for status, n in sorted(statuses.items(), key=lambda item: str(item[0]))},
+    }
+
+
+def run_route(host, port, route, context, concurrency, duration, warmup=1.0, seed=0):
+    """Нагрузка одного маршрута: concurrency потоков в течение duration секунд"""
+    scenario, expected_status = SCENARIOS[route]
+    results = []
+    results_lock = threading.Lock()
+    state = {}
+
+    def start_clock():
+        # Отсчет начинается, когда все потоки вошли в приложение
+        state['measure_from'] = time.perf_counter() + warmup
+        state['stop_at'] = state['measure_from'] + duration
+
+    start_barrier = threading.Barrier(concurrency, action=start_clock)
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        client = Client(host, port)
+        try:
+            client.login()
+            start_barrier.wait()
+        except threading.BrokenBarrierError:
+            return
+        except Exception as error:
+            state['error'] = error
+            start_barrier.abort()
+            return
+        latencies, statuses, errors = [], {}, 0
+        try:
+            while True:
+                began = time.perf_counter()
+                if began >= state['stop_at']:
+                    break
+                try:
+                    status, _ = scenario(client, context, rng)
+                except (OSError, http.client.HTTPException):
+                    status = 'error'
+                finished = time.perf_counter()
+                if began < state['measure_from']:
+                    continue
+                statuses[status] = statuses.get(status, 0) + 1
+                if status != expected_status:
+                    errors += 1
+                latencies.append(finished - began)
+        finally:
+            client.close()
+        with results_lock:
+            results.append((latencies, statuses, errors))
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if 'error' in state:
+        raise RuntimeError(f"Маршрут {route}: {state['error']}")
+
+    latencies, statuses, errors = [], {}, 0
+    for worker_latencies, worker_statuses, worker_errors in results:
+        latencies.extend(worker_latencies)
+        errors += worker_errors
+        for status, n in worker_statuses.items():
+            statuses[status] = statuses.get(status, 0) + n
+    return summarize(latencies, errors, duration, statuses)
+
+
+def compare(current, baseline, threshold):
+    """
+    Строки сравнения с базовым прогоном и список маршрутов, где p95 вырос
+    или RPS упал больше чем на threshold процентов.
+    """
+    lines = []
+    regressions = []
+    for key, value in current.get('startup', {}).items():
+        base = baseline.get('startup', {}).get(key)
+        if not base:
+            continue
+        change = (value - base) / base * 100
+        lines.append(f"{key:<24} {value:8.1f} мс {_fmt_delta(change)}")
+        if change > threshold:
+            regressions.append(f"startup {key}")
+    for route, stats in current['routes'].items():
+        base = baseline.get('routes', {}).get(route)
+        if not base:
+            lines.append(f"{route:<24} нет в базовом прогоне")
+            continue
+
+        def delta(key):
+            if not base.get(key) or stats.get(key) is None:
+                return None
+            return (stats[key] - base[key]) / base[key] * 100
+
+        p95_delta = delta('p95_ms')
+        rps_delta = delta('rps')
+        lines.append(
+            f"{route:<24} p50 {_fmt_delta(delta('p50_ms'))}  p95 {_fmt_delta(p95_delta)}  "
+            f"p99 {_fmt_delta(delta('p99_ms'))}  rps {_fmt_delta(rps_delta)}"
+        )
+        if (p95_delta is not None and p95_delta > threshold) or \
+                (rps_delta is not None and rps_delta < -threshold):
+            regressions.append(route)
+    return lines, regressions
+
+
+def _fmt_delta(value):
+    return '   n/a' if value is None else f"{value:+6.1f}%"
+
+
+def format_table(results):
+    lines = [f"{key:<24}{value:>9.1f} мс" for key, value in results.get('startup', {}).items()]
+    lines += [f"{'маршрут':<24}{'запросов':>9}{'ошибок':>8}{'rps':>9}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}"]
+    for route, stats in results['routes'].items():
+        lines.append(
+            f"{route:<24}{stats['requests']:>9}{stats['errors']:>8}{stats['rps']:>9}"
+            f"{_fmt_ms(stats['p50_ms']):>10}{_fmt_ms(stats['p95_ms']):>10}{_fmt_ms(stats['p99_ms']):>10}"
+        )
+    return '\n'.join(lines)
+
+
+def _fmt_ms(value):
+    return '-' if value is None else f"{value:.1f}"
@@ -0,0 +1,143 @@
+"""
+Временная локальная PostgreSQL и наполнение базы для нагрузочных тестов.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+from contextlib import contextmanager
+
+import psycopg2
+
+import migrations
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Расширения из contrib, которые создают миграции 5, 7 и 8
+REQUIRED_EXTENSIONS = ('pg_trgm', 'btree_gist')
+
+
+@contextmanager
+def local_postgres():
+    """
+    Строка подключения к временному серверу PostgreSQL, удаляемому по выходе.
+    Используются initdb и pg_ctl из PATH (серверная установка с contrib),
+    а без них - pgserver; в pgserver нет contrib-расширений, и схему на нем
+    prepare_database не построит.
+    """
+    data_dir = tempfile.mkdtemp(prefix='bench-pg-')
+    try:
+        initdb = shutil.which('initdb')
+        pg_ctl = shutil.which('pg_ctl')
+        if initdb and pg_ctl:
+            port = _free_port()
+            subprocess.run([initdb, '-D', data_dir, '-U', 'postgres', '-A', 'trust'],
+                           check=True, stdout=subprocess.DEVNULL)
+            subprocess.run([pg_ctl, '-D', data_dir, '-w', '-l', os.path.join(data_dir, 'server.log'),
+                            '-o', f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1", 'start'],
+                           check=True, stdout=subprocess.DEVNULL)
+            try:
+                yield f"postgresql://postgres@127.0.0.1:{port}/postgres"
+            finally:
+                subprocess.run([pg_ctl, '-D', data_dir, '-m', 'fast', 'stop'], stdout=subprocess.DEVNULL)
+            return
+
+        try:
+            import pgserver
+        except ImportError:
+            raise RuntimeError('Нужны initdb/pg_ctl в PATH, пакет pgserver, либо --database-url')
+
+        server = pgserver.get_server(data_dir, cleanup_mode='stop')
+        try:
+            yield server.get_uri()
+        finally:
+            server.cleanup()
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def check_extensions(conn):
+    """
+    Останавливает стенд до миграций, если на сервере нет нужных расширений.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT name FROM pg_available_extensions WHERE name = ANY(%s);",
+                       (list(REQUIRED_EXTENSIONS),))
+        available = {row[0] for row in cursor.fetchall()}
+    conn.commit()
+    missing = [name for name in REQUIRED_EXTENSIONS if name not in available]
+    if missing:
+        raise RuntimeError(
+            f"На сервере нет расширений {', '.join(missing)}, без них миграции не пройдут: "
+            f"нужен PostgreSQL с contrib (initdb/pg_ctl в PATH) или --database-url"
+        )
+
+
+SEED_STATEMENTS = [
+    """
+    INSERT INTO parts ("Наименование детали")
+    SELECT 'Деталь ' || g FROM generate_series(1, %(parts)s) g;
+    """,
+    # Батчи по два часа подряд на каждом станке начиная с %(start)s
+    """
+    INSERT INTO production_plan (part_name, planned_quantity, machine_number, start_time, end_time)
+    SELECT 'Деталь ' || (1 + g %% %(parts)s),
+           100 + g %% 400,
+           1 + g %% %(machines)s,
+           %(start)s::timestamp + (g / %(machines)s) * interval '2 hour',
+           %(start)s::timestamp + (g / %(machines)s) * interval '2 hour' + interval '110 minute'
+    FROM generate_series(0, %(plans)s - 1) g;
+    """,
+    """
+    INSERT INTO production (order_id, actual_quantity, bubble_count, underfill_count, inclusion_count,
+                            defect_count, actual_start_time, actual_end_time)
+    SELECT id, planned_quantity - id %% 20, id %% 3, id %% 2, 0, id %% 3 + id %% 2, start_time, end_time
+    FROM production_plan
+    WHERE id %% 10 < 7;
+    """,
+    """
+    INSERT INTO events (event_name, batch, "Фактические время начала события",
+                        "Фактические время конца события", "Time_group")
+    SELECT 'Работа', id, start_time, end_time - interval '10 minute', 'Utilization hours'
+    FROM production_plan
+    WHERE id %% 10 < 6;
+    """,
+    "ANALYZE;",
+]
+
+
+def prepare_database(dsn, plans=20000, machines=20, parts=200, migrate=True):
+    """
+    Схема и тестовые данные. Возвращает контекст для сценариев:
+    диапазон id батчей и период, который они покрывают.
+    """
+    conn = psycopg2.connect(dsn)
+    try:
+        if migrate:
+            check_extensions(conn)
+            migrations.upgrade(conn)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM production_plan;")
+            if cursor.fetchone()[0] == 0:
+                params = {'plans': plans, 'machines': machines, 'parts': parts, 'start': '2025-01-01'}
+                for statement in SEED_STATEMENTS:
+                    cursor.execute(statement, params)
+            conn.commit()
+            cursor.execute("SELECT MIN(id), MAX(id), MIN(start_time), MAX(start_time) FROM production_plan;")
+            min_id, max_id, first_start, last_start = cursor.fetchone()
+            conn.commit()
+    finally:
+        conn.close()
+    return {
+        'min_id': min_id,
+        'max_id': max_id,
+        'first_day': first_start.date(),
+        'last_day': last_start.date(),
+        'machines': machines,
+    }
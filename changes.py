@@ -0,0 +1,446 @@
+"""
+Журнал изменений батчей и поток событий для открытых страниц.
+
+Триггеры на production_plan, production и events (миграция 9) записывают
+в plan_changes номер транзакции и id затронутого батча и отправляют
+уведомление в канал plan_changes. Позиция читателя - граница txid: все
+транзакции с номером меньше xmin снимка завершены, поэтому изменения
+между двумя границами уже не меняются и не теряются при фиксации
+транзакций не в порядке их начала.
+
+В каждом процессе один фоновый поток слушает канал, читает изменения
+между границами и раздает готовые пачки всем подключенным клиентам
+/stream/plans; клиент, отставший больше чем на буфер пачек (например,
+после переподключения с Last-Event-ID), догоняет отдельным запросом.
+
+Открытый поток занимает поток воркера (gthread) на все время, пока открыта
+вкладка, поэтому их число в процессе ограничено STREAM_MAX_CLIENTS; сверх
+него клиент получает 503 и опрашивает /api/plans/changes.
+"""
+import json
+import os
+import select
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+from psycopg2 import Error
+
+import db
+import plans
+from app_logging import log_message
+
+CHANGES_CHANNEL = 'plan_changes'
+
+HORIZON_QUERY = """
+SELECT txid_snapshot_xmin(txid_current_snapshot()), pruned_before
+FROM plan_changes_state;
+"""
+
+CHANGED_IDS_QUERY = """
+SELECT DISTINCT plan_id
+FROM plan_changes
+WHERE xid >= %s AND xid < %s AND plan_id > %s
+ORDER BY plan_id
+LIMIT %s;
+"""
+
+PLAN_STATE_QUERY = """
+SELECT
+    ids.plan_id,
+    pp.part_name,
+    pp.planned_quantity,
+    pp.machine_number,
+    pp.start_time,
+    pp.end_time,
+    EXISTS (
+        SELECT 1 FROM production p WHERE p.order_id = pp.id
+    ) AS has_report,
+    EXISTS (
+        SELECT 1 FROM events e
+        WHERE e.batch = pp.id AND e."Time_group" = 'Utilization hours'
+    ) AS has_utilization_event
+FROM unnest(%s::integer[]) AS ids (plan_id)
+LEFT JOIN production_plan pp ON pp.id = ids.plan_id
+ORDER BY ids.plan_id;
+"""
+
+# Отпечаток видимого состояния журнала (всего или одного батча) одним запросом:
+# изменения до границы xmin неизменны и описываются максимальным txid, после
+# границы могут добавляться только новые строки, поэтому достаточно их числа
+FINGERPRINT_QUERY = """
+WITH horizon AS (
+    SELECT txid_snapshot_xmin(txid_current_snapshot()) AS xmin
+)
+SELECT s.pruned_before,
+       (SELECT MAX(c.xid) FROM plan_changes c, horizon h WHERE c.xid < h.xmin {plan_filter}),
+       (SELECT COUNT(*) FROM plan_changes c, horizon h WHERE c.xid >= h.xmin {plan_filter})
+FROM plan_changes_state s;
+"""
+
+PENDING_QUERY = "SELECT EXISTS (SELECT 1 FROM plan_changes WHERE xid >= %s);"
+
+PRUNE_QUERY = """
+WITH pruned AS (
+    DELETE FROM plan_changes
+    WHERE changed_at < CURRENT_TIMESTAMP - make_interval(days => %s)
+    RETURNING xid
+)
+UPDATE plan_changes_state
+SET pruned_before = GREATEST(pruned_before, (SELECT MAX(xid) + 1 FROM pruned))
+WHERE EXISTS (SELECT 1 FROM pruned);
+"""
+
+_feed_lock = threading.Lock()
+_feed_changed = threading.Condition(_feed_lock)
+# horizon - последняя граница, до которой изменения разосланы;
+# batches - последние пачки (since, until, items), items None означает сброс
+_feed = {'horizon': None, 'batches': deque()}
+
+_listener_lock = threading.Lock()
+_listener_pid = None
+
+_stream_lock = threading.Lock()
+_stream_clients = 0
+
+
+def init_app(app):
+    """Настройки журнала изменений и потока /stream/plans"""
+    # Как часто отправлять клиенту комментарий-пинг, чтобы прокси не закрывали соединение
+    app.config.setdefault('STREAM_HEARTBEAT_SECONDS', float(os.environ.get('STREAM_HEARTBEAT_SECONDS', 15)))
+    # Через сколько миллисекунд браузер переподключается после обрыва
+    app.config.setdefault('STREAM_RETRY_MS', int(os.environ.get('STREAM_RETRY_MS', 3000)))
+    # Если между границами изменилось больше батчей, клиенту отправляется сброс
+    app.config.setdefault('STREAM_MAX_CHANGES', int(os.environ.get('STREAM_MAX_CHANGES', 500)))
+    # Сколько последних пачек держать в памяти для клиентов, которые немного отстали
+    app.config.setdefault('STREAM_BUFFER_BATCHES', int(os.environ.get('STREAM_BUFFER_BATCHES', 256)))
+    # Сколько потоков /stream/plans может быть открыто в одном процессе; 0 - поток отключен
+    app.config.setdefault('STREAM_MAX_CLIENTS', int(os.environ.get('STREAM_MAX_CLIENTS', 50)))
+    app.config.setdefault('PLAN_CHANGES_RETENTION_DAYS', int(os.environ.get('PLAN_CHANGES_RETENTION_DAYS', 7)))
+    # Входит во все ETag: после обновления шаблонов или кода старые ETag не совпадут
+    app.config.setdefault('ETAG_VERSION', os.environ.get('ETAG_VERSION') or _deploy_version(app))
+
+
+def _deploy_version(app):
+    """Время последнего изменения кода и шаблонов приложения"""
+    paths = [os.path.join(app.root_path, name) for name in os.listdir(app.root_path) if name.endswith('.py')]
+    templates = os.path.join(app.root_path, app.template_folder or 'templates')
+    if os.path.isdir(templates):
+        paths.extend(os.path.join(templates, name) for name in os.listdir(templates))
+    return str(int(max((os.path.getmtime(path) for path in paths), default=0)))
+
+
+def _plan_states(cursor, plan_ids):
+    """Текущее состояние батчей; удаленные батчи возвращаются как {'id', 'deleted': True}"""
+    cursor.execute(PLAN_STATE_QUERY, (plan_ids,))
+    items = []
+    for record in cursor.fetchall():
+        if record[1] is None:
+            items.append({'id': record[0], 'deleted': True})
+            continue
+        item = plans.plan_to_dict(record[0], {
+            'part_name': record[1],
+            'planned_quantity': record[2],
+            'machine_number': record[3],
+            'start_time': record[4],
+            'end_time': record[5],
+        })
+        item['has_report'] = record[6]
+        item['has_utilization_event'] = record[7]
+        item['deleted'] = False
+        items.append(item)
+    return items
+
+
+def fetch_changes(cursor, since, until=None, limit=500):
+    """
+    Изменения батчей между границами [since, until).
+    Возвращает (until, items); items - список состояний батчей
+    ({'id', ..., 'deleted'}) или None, если изменений больше limit или
+    журнал за этот период уже очищен и клиенту нужно перезагрузить данные.
+    """
+    cursor.execute(HORIZON_QUERY)
+    horizon, pruned_before = cursor.fetchone()
+    if until is None:
+        until = horizon
+    if until <= since:
+        return since, []
+    if since < pruned_before:
+        return until, None
+
+    cursor.execute(CHANGED_IDS_QUERY, (since, until, 0, limit + 1))
+    plan_ids = [row[0] for row in cursor.fetchall()]
+    if len(plan_ids) > limit:
+        return until, None
+    if not plan_ids:
+        return until, []
+    return until, _plan_states(cursor, plan_ids)
+
+
+def encode_sync_token(since, until=None, after_id=None):
+    """
+    Токен синхронизации: граница журнала, а при постраничной выдаче одного
+    отрезка - еще его конец и последний выданный id батча
+    """
+    if until is None:
+        return str(since)
+    return f"{since}-{until}-{after_id}"
+
+
+def decode_sync_token(token):
+    """(since, until, after_id) из токена; ValueError при неверном токене"""
+    try:
+        parts = [int(part) for part in token.split('-')]
+    except ValueError:
+        raise ValueError('Неверный токен синхронизации')
+    if len(parts) == 1 and parts[0] >= 0:
+        return parts[0], None, 0
+    if len(parts) == 3 and 0 <= parts[0] <= parts[1] and parts[2] >= 0:
+        return parts[0], parts[1], parts[2]
+    raise ValueError('Неверный токен синхронизации')
+
+
+def fetch_changes_page(cursor, token, limit):
+    """
+    Страница изменений батчей после токена для /api/plans/changes.
+    Возвращает {'changes', 'next_token', 'has_more'} или None, если журнал
+    за период токена уже очищен и нужна полная синхронизация.
+    """
+    since, until, after_id = decode_sync_token(token)
+    cursor.execute(HORIZON_QUERY)
+    horizon, pruned_before = cursor.fetchone()
+    if since < pruned_before:
+        return None
+    if until is None:
+        until = max(horizon, since)
+
+    cursor.execute(CHANGED_IDS_QUERY, (since, until, after_id, limit + 1))
+    plan_ids = [row[0] for row in cursor.fetchall()]
+    has_more = len(plan_ids) > limit
+    plan_ids = plan_ids[:limit]
+    items = _plan_states(cursor, plan_ids) if plan_ids else []
+
+    if has_more:
+        next_token = encode_sync_token(since, until, plan_ids[-1])
+    else:
+        next_token = encode_sync_token(until)
+    return {'changes': items, 'next_token': next_token, 'has_more': has_more}
+
+
+def data_fingerprint(cursor, plan_id=None):
+    """
+    Дешевый отпечаток данных батчей для ETag: меняется при любом изменении
+    production_plan, production и events (или только данного батча).
+    Должен вычисляться до чтения самих данных, тогда ETag не опережает ответ.
+    """
+    if plan_id is None:
+        cursor.execute(FINGERPRINT_QUERY.format(plan_filter=''))
+    else:
+        cursor.execute(FINGERPRINT_QUERY.format(plan_filter='AND c.plan_id = %(plan_id)s'),
+                       {'plan_id': plan_id})
+    pruned_before, applied, pending = cursor.fetchone()
+    return pruned_before, applied or 0, pending
+
+
+def current_horizon(cursor):
+    """Текущая граница журнала: все изменения до нее уже зафиксированы"""
+    cursor.execute(HORIZON_QUERY)
+    return cursor.fetchone()[0]
+
+
+def _publish(since, until, items, buffer_size):
+    with _feed_changed:
+        if since is not None and until > since:
+            _feed['batches'].append((since, until, items))
+            while len(_feed['batches']) > buffer_size:
+                _feed['batches'].popleft()
+        _feed['horizon'] = until
+        _feed_changed.notify_all()
+
+
+def _ensure_listener():
+    """Запуск фонового слушателя канала plan_changes в текущем процессе"""
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _listener_lock:
+        if _listener_pid == pid:
+            return
+        settings = {key: current_app.config[key] for key in (
+            'STREAM_HEARTBEAT_SECONDS', 'STREAM_MAX_CHANGES', 'STREAM_BUFFER_BATCHES',
+            'PLAN_CHANGES_RETENTION_DAYS'
+        )}
+        with _feed_changed:
+            # Состояние, унаследованное от родителя после fork, не обновляется
+            _feed['horizon'] = None
+            _feed['batches'] = deque()
+        thread = threading.Thread(target=_listen_forever, args=(settings,),
+                                  name='plan-changes-listener', daemon=True)
+        thread.start()
+        _listener_pid = pid
+
+
+def _listen_forever(settings):
+    delay = 1
+    horizon = None
+    last_prune = 0.0
+    while True:
+        conn = None
+        try:
+            conn = db.connect_direct()
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANGES_CHANNEL};")
+                if horizon is None:
+                    horizon = current_horizon(cursor)
+                    _publish(None, horizon, [], settings['STREAM_BUFFER_BATCHES'])
+                delay = 1
+                # Пока слушатель не работал, уведомления могли потеряться,
+                # поэтому после подключения изменения читаются сразу
+                check = True
+                while True:
+                    if check:
+                        horizon_before = horizon
+                        horizon, items = fetch_changes(cursor, horizon, limit=settings['STREAM_MAX_CHANGES'])
+                        if horizon > horizon_before:
+                            _publish(horizon_before, horizon, items, settings['STREAM_BUFFER_BATCHES'])
+                        # Изменения незавершенных транзакций за границей ждут их окончания
+                        cursor.execute(PENDING_QUERY, (horizon,))
+                        pending = cursor.fetchone()[0]
+                    if time.monotonic() - last_prune > 3600:
+                        cursor.execute(PRUNE_QUERY, (settings['PLAN_CHANGES_RETENTION_DAYS'],))
+                        last_prune = time.monotonic()
+
+                    timeout = 1 if pending else settings['STREAM_HEARTBEAT_SECONDS']
+                    check = pending
+                    if select.select([conn], [], [], timeout) != ([], [], []):
+                        conn.poll()
+                        if conn.notifies:
+                            conn.notifies.clear()
+                            check = True
+        except (Exception, Error) as error:
+            log_message(f"ERROR: Слушатель журнала изменений остановлен: {error}. Повтор через {delay} с")
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Error:
+                    pass
+
+
+def _format_event(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return "\n".join(lines) + "\n\n"
+
+
+def _format_batch(until, items):
+    """SSE-сообщения одной пачки; id ставится только на последнее сообщение"""
+    if items is None:
+        return _format_event('reset', {}, until)
+    if not items:
+        # Сообщение без данных только сдвигает Last-Event-ID клиента
+        return f"id: {until}\n\n"
+    messages = [_format_event('plan', item) for item in items[:-1]]
+    messages.append(_format_event('plan', items[-1], until))
+    return ''.join(messages)
+
+
+def _catch_up(app, since, until, limit):
+    """Изменения для отставшего клиента через соединение из пула"""
+    with app.app_context():
+        conn = db.checkout_connection()
+        if conn is None:
+            raise Error('нет соединения с базой данных')
+        try:
+            with conn.cursor() as cursor:
+                return fetch_changes(cursor, since, until, limit)
+        finally:
+            db.return_connection(conn)
+
+
+def acquire_stream_slot():
+    """Место для еще одного потока /stream/plans в процессе; False, если мест нет"""
+    global _stream_clients
+    with _stream_lock:
+        if _stream_clients >= current_app.config['STREAM_MAX_CLIENTS']:
+            return False
+        _stream_clients += 1
+        return True
+
+
+def release_stream_slot():
+    global _stream_clients
+    with _stream_lock:
+        _stream_clients = max(_stream_clients - 1, 0)
+
+
+def stream_plan_changes(since=None):
+    """
+    Генератор текста SSE для /stream/plans начиная с границы since
+    (Last-Event-ID) или с текущего момента.
+    """
+    _ensure_listener()
+    app = current_app._get_current_object()
+    heartbeat = app.config['STREAM_HEARTBEAT_SECONDS']
+    limit = app.config['STREAM_MAX_CHANGES']
+    retry = app.config['STREAM_RETRY_MS']
+
+    # Ответ к этому моменту уже начат: при недоступном журнале клиент получает
+    # reset (перезагрузка данных), а поток закрывается без ошибки сервера
+    def generate():
+        position = since
+        with _feed_changed:
+            if _feed['horizon'] is None:
+                _feed_changed.wait(heartbeat)
+            horizon = _feed['horizon']
+        if horizon is None:
+            log_message("WARNING: Поток изменений закрыт: журнал изменений недоступен")
+            yield f"retry: {retry}\n\n" + _format_event('reset', {})
+            return
+        if position is None:
+            position = horizon
+        yield f"retry: {retry}\n\n" + _format_event('ready', {}, position)
+
+        while True:
+            with _feed_changed:
+                if _feed['horizon'] is not None and _feed['horizon'] <= position:
+                    _feed_changed.wait(heartbeat)
+                horizon = _feed['horizon']
+                chain = []
+                expected = position
+                for batch_since, batch_until, items in _feed['batches']:
+                    if batch_since == expected:
+                        chain.append((batch_until, items))
+                        expected = batch_until
+
+            if horizon is None:
+                log_message("WARNING: Поток изменений закрыт: журнал изменений недоступен")
+                yield _format_event('reset', {})
+                return
+            if horizon <= position:
+                yield ": ping\n\n"
+                continue
+
+            if chain:
+                for until, items in chain:
+                    yield _format_batch(until, items)
+                position = chain[-1][0]
+            else:
+                # Нужной пачки нет в буфере - читаем изменения до текущей границы сами
+                try:
+                    until, items = _catch_up(app, position, horizon, limit)
+                except (Exception, Error) as error:
+                    log_message(f"WARNING: Поток изменений закрыт: {error}")
+                    yield _format_event('reset', {})
+                    return
+                yield _format_batch(until, items)
+                position = until
+
+    return generate()
@@ -0,0 +1,22 @@
+"""
+Пример файла настроек: скопируйте, заполните и укажите путь в
+APP_CONFIG_FILE. Любую настройку можно задать и переменной окружения
+с тем же именем; значения из файла имеют приоритет.
+"""
+import os
+
+SECRET_KEY = os.environ.get('SECRET_KEY')
+
+DB_HOST = 'rc1b-31bfnlmu4csa6hn5.mdb.yandexcloud.net'
+DB_PORT = 6432
+DB_NAME = 'db1'
+DB_USER = 'user1'
+# Пароль лучше передавать через DB_PASSWORD, PGPASSWORD или ~/.pgpass
+DB_PASSWORD = os.environ.get('DB_PASSWORD', '')
+DB_SSLMODE = 'verify-full'
+DB_SSLROOTCERT = '/home/yc-user/.postgrsql/root.crt'
+
+DB_POOL_MAX_SIZE = 10
+# Миграции применяет шаг развертывания: flask --app app db upgrade
+DB_AUTO_MIGRATE = False
+PLAN_CONFLICT_MODE = 'warn'
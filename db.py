@@ -0,0 +1,265 @@
+"""
+Пул соединений с PostgreSQL.
+
+Каждый процесс (воркер gunicorn) создает собственный пул при первом обращении
+после fork. Соединение выдается из пула один раз на контекст приложения
+Flask и возвращается в пул в teardown_appcontext.
+
+Миграции применяются при развертывании (flask db upgrade). С
+DB_AUTO_MIGRATE=1 процесс применяет их сам при обращении к базе - для
+разработки и одиночного экземпляра.
+"""
+import os
+import threading
+import time
+
+import psycopg2
+from psycopg2 import Error, extensions, pool
+from flask import current_app, g
+
+import metrics
+import query_stats
+from app_logging import log_message
+
+# Параметры psycopg2.connect процесса; заполняются в init_app из настроек
+# приложения. Пустые параметры libpq берет из PGHOST, PGPASSWORD, ~/.pgpass
+DB_CONNECT_PARAMS = {}
+
+# Настройка приложения -> параметр psycopg2.connect
+CONNECT_SETTINGS = (
+    ('DB_HOST', 'host'),
+    ('DB_PORT', 'port'),
+    ('DB_NAME', 'dbname'),
+    ('DB_USER', 'user'),
+    ('DB_PASSWORD', 'password'),
+    ('DB_SSLMODE', 'sslmode'),
+    ('DB_SSLROOTCERT', 'sslrootcert'),
+)
+
+_pool = None
+_pool_pid = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_last_used = {}
+_schema_pid = None
+_schema_lock = threading.Lock()
+_schema_retry_at = 0.0
+
+# Пауза перед повтором миграций после ошибки, секунды
+MIGRATE_RETRY_INTERVAL = 60
+
+
+def init_app(app):
+    """Регистрация настроек пула и возврата соединения в пул для приложения"""
+    app.config.setdefault('DB_POOL_MIN_SIZE', int(os.environ.get('DB_POOL_MIN_SIZE', 1)))
+    app.config.setdefault('DB_POOL_MAX_SIZE', int(os.environ.get('DB_POOL_MAX_SIZE', 10)))
+    # Сколько секунд ждать свободного соединения, если пул исчерпан
+    app.config.setdefault('DB_POOL_TIMEOUT', float(os.environ.get('DB_POOL_TIMEOUT', 10)))
+    # Соединения, простаивавшие дольше этого интервала, проверяются SELECT 1
+    app.config.setdefault('DB_POOL_CHECK_INTERVAL', float(os.environ.get('DB_POOL_CHECK_INTERVAL', 30)))
+    # Применять непримененные миграции при обращении процесса к базе; в
+    # эксплуатации миграции применяет шаг развертывания: flask db upgrade
+    app.config.setdefault('DB_AUTO_MIGRATE', os.environ.get('DB_AUTO_MIGRATE', '0') == '1')
+    # Строка подключения целиком или отдельные параметры DB_*
+    app.config.setdefault('DATABASE_URL', os.environ.get('DATABASE_URL', ''))
+    for key, _ in CONNECT_SETTINGS:
+        app.config.setdefault(key, os.environ.get(key, ''))
+
+    global DB_CONNECT_PARAMS
+    DB_CONNECT_PARAMS = connect_params(app.config)
+    app.teardown_appcontext(release_db_connection)
+
+
+def connect_params(config):
+    """Параметры psycopg2.connect из настроек приложения"""
+    params = {}
+    if config.get('DATABASE_URL'):
+        params['dsn'] = config['DATABASE_URL']
+    for key, name in CONNECT_SETTINGS:
+        if config.get(key):
+            params[name] = config[key]
+    return params
+
+
+def _ensure_schema():
+    """
+    Миграции при обращении процесса к базе (DB_AUTO_MIGRATE). Их применяет
+    один поток; остальные запросы не ждут его и работают со старой схемой.
+    После ошибки попытка повторяется не чаще раза в MIGRATE_RETRY_INTERVAL.
+    """
+    global _schema_pid, _schema_retry_at
+    pid = os.getpid()
+    if _schema_pid == pid or not current_app.config['DB_AUTO_MIGRATE']:
+        return
+    if time.monotonic() < _schema_retry_at or not _schema_lock.acquire(blocking=False):
+        return
+    # migrations импортирует этот модуль
+    import migrations
+
+    try:
+        if _schema_pid == pid:
+            return
+        conn = connect_direct()
+        try:
+            applied = migrations.upgrade(conn)
+        finally:
+            conn.close()
+        _schema_pid = pid
+        if applied:
+            log_message(f"SUCCESS: Применены миграции: {', '.join(str(v) for v in applied)}")
+    except (Exception, Error) as error:
+        _schema_retry_at = time.monotonic() + MIGRATE_RETRY_INTERVAL
+        log_message(f"ERROR: Ошибка при применении миграций: {error}")
+    finally:
+        _schema_lock.release()
+
+
+def _get_pool():
+    """Пул текущего процесса; после fork создается заново"""
+    global _pool, _pool_pid, _pool_slots
+    pid = os.getpid()
+    _ensure_schema()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != pid:
+            # Соединения, унаследованные от родителя, не закрываем: закрытие
+            # отправило бы Terminate по общему сокету и оборвало бы их у родителя
+            minconn = current_app.config['DB_POOL_MIN_SIZE']
+            maxconn = current_app.config['DB_POOL_MAX_SIZE']
+            _pool = pool.ThreadedConnectionPool(
+                minconn, maxconn, cursor_factory=query_stats.InstrumentedCursor, **DB_CONNECT_PARAMS
+            )
+            _pool_slots = threading.BoundedSemaphore(maxconn)
+            metrics.set_pool_size(maxconn)
+            _pool_pid = pid
+            _last_used.clear()
+            log_message(f"INFO: Создан пул соединений ({minconn}-{maxconn}) для процесса {pid}")
+    return _pool
+
+
+def reset_pool():
+    """Сброс пула процесса, например в post_fork хуке gunicorn"""
+    global _pool, _pool_pid, _pool_slots
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+        _pool_pid = None
+        _pool_slots = None
+        _last_used.clear()
+
+
+def _is_healthy(conn):
+    """Проверка соединения при выдаче из пула"""
+    if conn.closed:
+        return False
+    if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < current_app.config['DB_POOL_CHECK_INTERVAL']:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+        conn.rollback()
+        return True
+    except Error:
+        return False
+
+
+def _checkout():
+    started = time.perf_counter()
+    db_pool = _get_pool()
+    if not _pool_slots.acquire(timeout=current_app.config['DB_POOL_TIMEOUT']):
+        metrics.observe_db_checkout(time.perf_counter() - started, success=False)
+        raise pool.PoolError("истекло время ожидания свободного соединения")
+    try:
+        # Битые соединения отбрасываем и берем следующее
+        for _ in range(current_app.config['DB_POOL_MAX_SIZE'] + 1):
+            conn = db_pool.getconn()
+            if _is_healthy(conn):
+                metrics.observe_db_checkout(time.perf_counter() - started)
+                return conn
+            log_message("WARNING: Соединение из пула не прошло проверку и будет пересоздано")
+            _last_used.pop(id(conn), None)
+            db_pool.putconn(conn, close=True)
+        raise pool.PoolError("не удалось получить рабочее соединение из пула")
+    except Exception:
+        _pool_slots.release()
+        metrics.observe_db_checkout(time.perf_counter() - started, success=False)
+        raise
+
+
+def connect_direct():
+    """
+    Отдельное соединение вне пула - для CLI-команд и фоновых задач,
+    которым нужен autocommit или долгоживущая сессия.
+    """
+    return psycopg2.connect(**DB_CONNECT_PARAMS)
+
+
+def get_db_connection():
+    """
+    Соединение для текущего контекста приложения.
+    Повторные вызовы в рамках одного запроса возвращают то же соединение.
+    """
+    conn = g.get('db_conn')
+    if conn is not None:
+        return conn
+    try:
+        conn = _checkout()
+    except (Exception, Error) as e:
+        log_message(f"ERROR: Ошибка при подключении к базе данных: {e}")
+        return None
+    g.db_conn = conn
+    g.db_conn_pid = os.getpid()
+    # Пишется на каждый запрос, поэтому в журнал попадает только выборка
+    log_message("INFO: Подключение к базе данных установлено.", sampled=True)
+    return conn
+
+
+def checkout_connection():
+    """
+    Соединение из пула, не привязанное к контексту приложения, - для
+    потоковых ответов, которые читают из базы после завершения обработчика.
+    Вызывающий обязан вернуть его через return_connection; None при ошибке.
+    """
+    try:
+        conn = _checkout()
+    except (Exception, Error) as e:
+        log_message(f"ERROR: Ошибка при подключении к базе данных: {e}")
+        return None
+    return conn
+
+
+def return_connection(conn, pid=None):
+    """Возврат соединения в пул с откатом незавершенной транзакции"""
+    if pid is None:
+        pid = os.getpid()
+    if conn is None or pid != os.getpid() or _pool_pid != pid:
+        return
+    broken = bool(conn.closed)
+    if not broken and conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+        # Незавершенная транзакция не должна попасть к следующему запросу
+        try:
+            conn.rollback()
+        except Error:
+            broken = True
+    if broken:
+        _last_used.pop(id(conn), None)
+    else:
+        _last_used[id(conn)] = time.monotonic()
+    try:
+        _pool.putconn(conn, close=broken)
+    finally:
+        _pool_slots.release()
+        metrics.observe_db_return()
+
+
+def release_db_connection(exception=None):
+    """Возврат соединения в пул по окончании контекста приложения"""
+    conn = g.pop('db_conn', None)
+    pid = g.pop('db_conn_pid', None)
+    if conn is not None:
+        return_connection(conn, pid)
@@ -0,0 +1,143 @@
+"""
+Потоковая выгрузка планов, отчетов и событий в CSV или NDJSON.
+
+Строки читаются серверным (именованным) курсором порциями по
+EXPORT_ITERSIZE и сразу отдаются клиенту, поэтому расход памяти не
+зависит от размера периода. Сжатие gzip выполняется тем же потоком.
+"""
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import current_app
+from psycopg2 import Error
+
+EXPORTS = {
+    'plans': {
+        'columns': ('id', 'part_name', 'planned_quantity', 'machine_number', 'start_time', 'end_time'),
+        'query': """
+        SELECT id, part_name, planned_quantity, machine_number, start_time, end_time
+        FROM production_plan
+        WHERE start_time >= %s AND start_time < %s
+        ORDER BY start_time, id;
+        """,
+    },
+    'reports': {
+        'columns': ('id', 'order_id', 'part_name', 'machine_number', 'part_number', 'actual_quantity',
+                    'bubble_count', 'underfill_count', 'inclusion_count', 'defect_count',
+                    'actual_start_time', 'actual_end_time', 'created_at'),
+        'query': """
+        SELECT p.id, p.order_id, pp.part_name, pp.machine_number, p.part_number, p.actual_quantity,
+               p.bubble_count, p.underfill_count, p.inclusion_count, p.defect_count,
+               p.actual_start_time, p.actual_end_time, p.created_at
+        FROM production p
+        JOIN production_plan pp ON pp.id = p.order_id
+        WHERE p.actual_start_time >= %s AND p.actual_start_time < %s
+        ORDER BY p.actual_start_time, p.id;
+        """,
+    },
+    'events': {
+        'columns': ('event_id', 'event_name', 'batch', 'machine_number', 'start_time', 'end_time', 'time_group'),
+        'query': """
+        SELECT e.event_id, e.event_name, e.batch, pp.machine_number,
+               e."Фактические время начала события", e."Фактические время конца события", e."Time_group"
+        FROM events e
+        JOIN production_plan pp ON pp.id = e.batch
+        WHERE e."Фактические время начала события" >= %s AND e."Фактические время начала события" < %s
+        ORDER BY e."Фактические время начала события", e.event_id;
+        """,
+    },
+}
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def init_app(app):
+    """Настройки выгрузки"""
+    # Сколько строк серверный курсор передает за один сетевой обмен
+    app.config.setdefault('EXPORT_ITERSIZE', int(os.environ.get('EXPORT_ITERSIZE', 5000)))
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Тип {type(value).__name__} не сериализуется в JSON")
+
+
+def _format_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if columns:
+        writer.writerow(columns)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def _format_ndjson(columns, rows):
+    return ''.join(
+        json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_json_default) + '\n'
+        for row in rows
+    )
+
+
+def iter_export(conn, name, date_from, date_to, export_format):
+    """
+    Генератор байтовых фрагментов выгрузки name за [date_from, date_to).
+    Запрос выполняется сразу (ошибки SQL возникают до начала ответа),
+    строки читаются при итерации. Транзакцию завершает вызывающий.
+    """
+    spec = EXPORTS[name]
+    columns = spec['columns']
+    itersize = current_app.config['EXPORT_ITERSIZE']
+
+    cursor = conn.cursor(name=f'export_{name}')
+    try:
+        cursor.execute(spec['query'], (date_from, date_to))
+    except Exception:
+        cursor.close()
+        raise
+
+    def generate():
+        try:
+            if export_format == 'csv':
+                # Заголовок отдается до первой порции, чтобы клиент сразу получил ответ
+                yield _format_csv(columns, []).encode('utf-8')
+            while True:
+                rows = cursor.fetchmany(itersize)
+                if not rows:
+                    break
+                if export_format == 'csv':
+                    yield _format_csv(None, rows).encode('utf-8')
+                else:
+                    yield _format_ndjson(columns, rows).encode('utf-8')
+        finally:
+            if not conn.closed:
+                try:
+                    cursor.close()
+                except Error:
+                    pass
+
+    return generate()
+
+
+def gzip_stream(chunks, level=6):
+    """Сжатие потока фрагментов в формат gzip без накопления в памяти"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
@@ -0,0 +1,157 @@
+"""
+Настройки gunicorn: gunicorn -c gunicorn.conf.py
+
+Профиль воркеров выбирается переменной GUNICORN_PROFILE:
+
+    gthread (по умолчанию) - процессы по числу CPU, в каждом потоки. Запросы
+        приложения почти целиком ждут PostgreSQL (psycopg2 отпускает GIL на
+        время запроса), поэтому потоки дают основной прирост. Открытый поток
+        /stream/plans занимает поток воркера, поэтому под них отдается не
+        больше половины потоков; остальные вкладки опрашивают
+        /api/plans/changes.
+    gevent - процессы по числу CPU, в каждом сотни гринлетов; psycopg2
+        переводится в неблокирующий режим (psycogreen). Подходит, когда
+        открыто много вкладок с /stream/plans: потоку достаточно гринлета.
+        Одновременные запросы к базе ограничены пулом DB_POOL_MAX_SIZE,
+        остальные ждут до DB_POOL_TIMEOUT. Приложение загружается в каждом
+        воркере после monkey patching, без preload.
+    sync - 2 * CPU + 1 однопоточных процессов без keep-alive. Только для
+        проверки; /stream/plans отключен, страницы опрашивают
+        /api/plans/changes.
+
+Число процессов и потоков можно переопределить через GUNICORN_WORKERS и
+GUNICORN_THREADS, адрес - через GUNICORN_BIND; прочие параметры gunicorn -
+аргументами командной строки. Соединений с базой на один экземпляр:
+workers * DB_POOL_MAX_SIZE.
+
+Замеры python -m bench --server gunicorn --profile <профиль> --concurrency 16
+(1 CPU, PostgreSQL на той же машине, 20 000 батчей, 10 с на маршрут),
+запросов в секунду / p95, мс:
+
+    маршрут                 sync (3x1)     gthread (2x8)  gevent (1x200)
+    login                   464 / 45       587 / 46       465 / 164
+    home                    507 / 46       538 / 49       541 / 154
+    get_data                 57 / 328       47 / 516       43 / 556
+    get_filtered_data        52 / 436       63 / 362       50 / 520
+    save_data               129 / 139      102 / 236       82 / 317
+    save_event              194 / 129      166 / 153       91 / 223
+    save_production_report  243 / 93       162 / 151       86 / 267
+
+На одном CPU, который делят приложение и PostgreSQL, ожидания базы почти нет
+и профили упираются в процессор, поэтому sync не уступает остальным. С
+удаленной базой (сеть, pgbouncer) запрос большую часть времени ждет ответа, и
+потоки или гринлеты обслуживают больше запросов при том же числе процессов;
+перед сменой профиля повторите замер на целевой машине.
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+PROFILES = ('sync', 'gthread', 'gevent')
+
+profile = os.environ.get('GUNICORN_PROFILE', 'gthread')
+if profile not in PROFILES:
+    raise RuntimeError(f"GUNICORN_PROFILE: ожидается одно из {', '.join(PROFILES)}, получено {profile!r}")
+
+cpu_count = multiprocessing.cpu_count()
+
+wsgi_app = 'wsgi:app'
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+worker_class = profile
+
+if profile == 'sync':
+    workers = 2 * cpu_count + 1
+    threads = 1
+    preload_app = True
+    timeout = 30
+elif profile == 'gthread':
+    workers = max(2, cpu_count)
+    threads = 8
+    preload_app = True
+    timeout = 60
+else:
+    workers = cpu_count
+    threads = 1
+    # Модули приложения создают блокировки при импорте: импорт до monkey
+    # patching в мастере оставил бы их настоящими и блокировал бы гринлеты
+    preload_app = False
+    timeout = 60
+    # Одновременные соединения воркера, включая простаивающие keep-alive и потоки SSE
+    worker_connections = 200
+
+workers = int(os.environ.get('GUNICORN_WORKERS', workers))
+threads = int(os.environ.get('GUNICORN_THREADS', threads))
+
+# Пул воркера: по соединению на поток; гринлетам - ограниченный пул
+os.environ.setdefault('DB_POOL_MAX_SIZE', str(threads if profile != 'gevent' else 20))
+
+# Открытые потоки /stream/plans воркера: каждый держит поток (gthread) или
+# процесс (sync) на все время, пока открыта вкладка
+if profile == 'gevent':
+    os.environ.setdefault('STREAM_MAX_CLIENTS', str(worker_connections // 2))
+else:
+    os.environ.setdefault('STREAM_MAX_CLIENTS', str(threads // 2))
+
+if profile == 'gthread':
+    # Простаивающие keep-alive соединения ждут в селекторе и не занимают
+    # поток; их число ограничено worker_connections
+    worker_connections = threads * 25
+# За балансировщиком соединение держится дольше, чем между кликами пользователя
+keepalive = 5
+graceful_timeout = 30
+
+# Перезапуск воркера после max_requests запросов ограничивает рост памяти;
+# разброс не дает всем воркерам перезапуститься одновременно
+max_requests = 1000
+max_requests_jitter = 100
+
+# Файл heartbeat воркеров в памяти: запись на диск под нагрузкой не вызывает таймаутов
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+# Пустое значение отключает журнал запросов
+accesslog = os.environ.get('GUNICORN_ACCESSLOG', '-') or None
+
+# Метрики всех воркеров собираются через общий каталог; переменная должна быть
+# задана до импорта prometheus_client в мастере и воркерах
+if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = os.path.join(tempfile.gettempdir(), f'flask_blog-metrics-{os.getpid()}')
+    _own_multiproc_dir = True
+else:
+    _own_multiproc_dir = False
+
+
+def on_starting(server):
+    """Очистка значений метрик от предыдущего запуска"""
+    multiproc_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    os.makedirs(multiproc_dir, exist_ok=True)
+    for name in os.listdir(multiproc_dir):
+        if name.endswith('.db'):
+            os.remove(os.path.join(multiproc_dir, name))
+
+
+def on_exit(server):
+    if _own_multiproc_dir:
+        shutil.rmtree(os.environ['PROMETHEUS_MULTIPROC_DIR'], ignore_errors=True)
+
+
+def post_fork(server, worker):
+    """Пул соединений, унаследованный от мастера при preload, воркеру не нужен"""
+    db = sys.modules.get('db')
+    if db is not None:
+        db.reset_pool()
+
+
+def post_worker_init(worker):
+    """gevent: после monkey patching psycopg2 ждет ответа базы, переключая гринлеты"""
+    if profile == 'gevent':
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+
+
+def child_exit(server, worker):
+    """Удаление значений метрик завершившегося воркера"""
+    import metrics
+    metrics.mark_process_dead(worker.pid)
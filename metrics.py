@@ -0,0 +1,146 @@
+"""
+Метрики Prometheus: /metrics.
+
+Счетчики и гистограммы запросов по имени endpoint Flask, время получения
+соединения из пула, занятость пула и попадания в кэш деталей. Под gunicorn
+с несколькими воркерами значения пишутся в общий каталог
+PROMETHEUS_MULTIPROC_DIR (файлы mmap) и суммируются при каждом обращении
+к /metrics; сам обработчик к базе данных не обращается.
+
+Пакет prometheus_client необязателен: без него функции учета ничего не
+делают, а /metrics отвечает 501.
+"""
+import os
+import time
+
+from flask import Response, g, request
+
+from app_logging import log_message
+
+_metrics = {}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def init_app(app):
+    """Регистрация метрик, обработчиков запроса и маршрута /metrics"""
+    app.config.setdefault('METRICS_ENABLED', os.environ.get('METRICS_ENABLED', '1') == '1')
+    # Каталог для значений метрик всех воркеров; его нужно очищать перед запуском сервера
+    app.config.setdefault('METRICS_MULTIPROC_DIR', os.environ.get('PROMETHEUS_MULTIPROC_DIR', ''))
+
+    if app.config['METRICS_ENABLED']:
+        multiproc_dir = app.config['METRICS_MULTIPROC_DIR']
+        if multiproc_dir:
+            # prometheus_client выбирает хранилище значений по переменной окружения при импорте
+            os.makedirs(multiproc_dir, exist_ok=True)
+            os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', multiproc_dir)
+        try:
+            _register()
+        except ImportError:
+            log_message("WARNING: Пакет prometheus_client не установлен, метрики отключены")
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+def _register():
+    if _metrics:
+        return
+    from prometheus_client import Counter, Gauge, Histogram
+
+    _metrics['requests'] = Counter(
+        'http_requests_total', 'HTTP-запросы по endpoint, методу и коду ответа',
+        ['endpoint', 'method', 'status']
+    )
+    _metrics['latency'] = Histogram(
+        'http_request_duration_seconds', 'Время обработки HTTP-запроса',
+        ['endpoint', 'method'], buckets=LATENCY_BUCKETS
+    )
+    _metrics['errors'] = Counter(
+        'http_request_errors_total', 'Ответы с кодом 5xx по endpoint', ['endpoint']
+    )
+    _metrics['db_checkout'] = Histogram(
+        'db_pool_checkout_seconds', 'Время получения соединения из пула (ожидание и подключение)',
+        buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+    )
+    _metrics['db_checkout_errors'] = Counter(
+        'db_pool_checkout_errors_total', 'Неудачные попытки получить соединение из пула'
+    )
+    _metrics['pool_in_use'] = Gauge(
+        'db_pool_connections_in_use', 'Выданные соединения пула', multiprocess_mode='livesum'
+    )
+    _metrics['pool_size'] = Gauge(
+        'db_pool_connections_max', 'Максимальный размер пула', multiprocess_mode='livesum'
+    )
+    _metrics['parts_cache'] = Counter(
+        'parts_cache_requests_total', 'Обращения к кэшу справочника деталей', ['result']
+    )
+
+
+def observe_db_checkout(seconds, success=True):
+    if not _metrics:
+        return
+    if success:
+        _metrics['db_checkout'].observe(seconds)
+        _metrics['pool_in_use'].inc()
+    else:
+        _metrics['db_checkout_errors'].inc()
+
+
+def observe_db_return():
+    if _metrics:
+        _metrics['pool_in_use'].dec()
+
+
+def set_pool_size(size):
+    if _metrics:
+        _metrics['pool_size'].set(size)
+
+
+def observe_parts_cache(hit):
+    if _metrics:
+        _metrics['parts_cache'].labels('hit' if hit else 'miss').inc()
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+
+
+def _finish_request(response):
+    started = g.get('metrics_started')
+    if not _metrics or started is None:
+        return response
+    # Неизвестные адреса (404) сводятся к одной метке, чтобы не плодить ряды
+    endpoint = request.endpoint or 'unknown'
+    _metrics['latency'].labels(endpoint, request.method).observe(time.perf_counter() - started)
+    _metrics['requests'].labels(endpoint, request.method, str(response.status_code)).inc()
+    if response.status_code >= 500:
+        _metrics['errors'].labels(endpoint).inc()
+    return response
+
+
+def metrics_view():
+    """Текущие значения метрик в текстовом формате Prometheus"""
+    if not _metrics:
+        return Response('metrics are disabled\n', status=501, mimetype='text/plain')
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def mark_process_dead(pid):
+    """Удаление значений завершившегося воркера (хук child_exit gunicorn)"""
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    multiprocess.mark_process_dead(pid)
@@ -0,0 +1,678 @@
+"""
+Версионированные миграции схемы базы данных.
+
+Миграции применяются строго по возрастанию номера версии, номер каждой
+примененной миграции записывается в таблицу schema_version. Миграции с
+transactional=False выполняются в режиме autocommit - это нужно для
+CREATE INDEX CONCURRENTLY, который нельзя запускать внутри транзакции.
+"""
+from collections import namedtuple
+
+import click
+from flask.cli import AppGroup
+from psycopg2 import Error
+
+import db
+from app_logging import log_message
+
+Migration = namedtuple('Migration', ['version', 'description', 'statements', 'transactional', 'indexes'])
+Migration.__new__.__defaults__ = (True, ())
+
+# Ключ advisory lock, чтобы несколько воркеров не накатывали миграции одновременно
+MIGRATION_LOCK_KEY = 7345001
+
+MIGRATIONS = [
+    Migration(
+        version=1,
+        description='Базовые таблицы production_plan, production и events',
+        statements=[
+            """
+            CREATE TABLE IF NOT EXISTS production_plan (
+                id SERIAL PRIMARY KEY,
+                part_name VARCHAR(255) NOT NULL,
+                planned_quantity INTEGER NOT NULL,
+                machine_number INTEGER NOT NULL,
+                start_time TIMESTAMP NOT NULL,
+                end_time TIMESTAMP NOT NULL
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS production (
+                id SERIAL PRIMARY KEY,
+                order_id INTEGER NOT NULL REFERENCES production_plan(id),
+                part_number VARCHAR(255),
+                actual_quantity INTEGER NOT NULL,
+                bubble_count INTEGER DEFAULT 0,
+                underfill_count INTEGER DEFAULT 0,
+                inclusion_count INTEGER DEFAULT 0,
+                defect_count INTEGER DEFAULT 0,
+                actual_start_time TIMESTAMP NOT NULL,
+                actual_end_time TIMESTAMP NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(order_id)
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                event_id SERIAL PRIMARY KEY,
+                event_name VARCHAR(255) NOT NULL,
+                batch INTEGER NOT NULL REFERENCES production_plan(id),
+                "Фактические время начала события" TIMESTAMP NOT NULL,
+                "Фактические время конца события" TIMESTAMP NOT NULL,
+                "Time_group" VARCHAR(50) NOT NULL CHECK ("Time_group" IN ('Planned pause time', 'Utilization hours', 'Breakdown time'))
+            );
+            """,
+        ],
+    ),
+    Migration(
+        version=2,
+        description='Индексы для списка батчей и страницы событий',
+        statements=[
+            # Флаг has_utilization_event и удаление событий батча
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_events_batch_time_group
+            ON events (batch, "Time_group");
+            """,
+            # Список событий батча, отсортированный по времени начала
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_events_batch_start
+            ON events (batch, "Фактические время начала события");
+            """,
+            # Keyset-пагинация по (start_time DESC, id DESC)
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_production_plan_start_time_id
+            ON production_plan (start_time, id);
+            """,
+        ],
+        transactional=False,
+        indexes=('idx_events_batch_time_group', 'idx_events_batch_start', 'idx_production_plan_start_time_id'),
+    ),
+    Migration(
+        version=3,
+        description='Столбцы responsible и comments в events',
+        statements=[
+            """
+            ALTER TABLE events
+                ADD COLUMN IF NOT EXISTS responsible VARCHAR(50),
+                ADD COLUMN IF NOT EXISTS comments TEXT;
+            """,
+        ],
+    ),
+    Migration(
+        version=4,
+        description='Уведомления parts_changed при изменении справочника деталей',
+        statements=[
+            """
+            CREATE TABLE IF NOT EXISTS parts (
+                "Наименование детали" VARCHAR(255) NOT NULL
+            );
+            """,
+            """
+            CREATE OR REPLACE FUNCTION notify_parts_changed() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('parts_changed', TG_OP);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS parts_changed ON parts;",
+            """
+            CREATE TRIGGER parts_changed
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON parts
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_parts_changed();
+            """,
+        ],
+    ),
+    Migration(
+        version=5,
+        description='Триграммный индекс для поиска деталей',
+        statements=[
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_parts_name_trgm
+            ON parts USING gin ("Наименование детали" gin_trgm_ops);
+            """,
+        ],
+        transactional=False,
+        indexes=('idx_parts_name_trgm',),
+    ),
+    Migration(
+        version=6,
+        description='Сводная таблица production_rollup по станку, детали, дню и смене',
+        statements=[
+            """
+            CREATE TABLE IF NOT EXISTS rollup_settings (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                shift_start_hour INTEGER NOT NULL DEFAULT 8,
+                shift_hours INTEGER NOT NULL DEFAULT 12 CHECK (shift_hours > 0)
+            );
+            """,
+            "INSERT INTO rollup_settings (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;",
+            """
+            CREATE TABLE IF NOT EXISTS production_rollup (
+                day DATE NOT NULL,
+                shift INTEGER NOT NULL,
+                machine_number INTEGER NOT NULL,
+                part_name VARCHAR(255) NOT NULL,
+                batches INTEGER NOT NULL DEFAULT 0,
+                planned_quantity BIGINT NOT NULL DEFAULT 0,
+                planned_minutes NUMERIC NOT NULL DEFAULT 0,
+                reported_batches INTEGER NOT NULL DEFAULT 0,
+                actual_quantity BIGINT NOT NULL DEFAULT 0,
+                bubble_count BIGINT NOT NULL DEFAULT 0,
+                underfill_count BIGINT NOT NULL DEFAULT 0,
+                inclusion_count BIGINT NOT NULL DEFAULT 0,
+                defect_count BIGINT NOT NULL DEFAULT 0,
+                utilization_minutes NUMERIC NOT NULL DEFAULT 0,
+                breakdown_minutes NUMERIC NOT NULL DEFAULT 0,
+                planned_pause_minutes NUMERIC NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, shift, machine_number, part_name)
+            );
+            """,
+            # День и номер смены батча по времени его начала
+            """
+            CREATE OR REPLACE FUNCTION production_shift_key(ts TIMESTAMP, OUT day DATE, OUT shift INTEGER) AS $$
+                SELECT (ts - make_interval(hours => s.shift_start_hour))::date,
+                       FLOOR(EXTRACT(HOUR FROM ts - make_interval(hours => s.shift_start_hour))
+                             / s.shift_hours)::integer + 1
+                FROM rollup_settings s;
+            $$ LANGUAGE sql STABLE;
+            """,
+            # Прибавление вклада (или его вычитание с отрицательными значениями) к строке сводки
+            """
+            CREATE OR REPLACE FUNCTION production_rollup_apply(
+                p_machine INTEGER, p_part VARCHAR, p_start TIMESTAMP,
+                d_batches INTEGER, d_planned_quantity BIGINT, d_planned_minutes NUMERIC,
+                d_reported INTEGER, d_actual BIGINT, d_bubble BIGINT, d_underfill BIGINT,
+                d_inclusion BIGINT, d_defect BIGINT,
+                d_utilization NUMERIC, d_breakdown NUMERIC, d_pause NUMERIC
+            ) RETURNS void AS $$
+            DECLARE
+                k RECORD;
+            BEGIN
+                SELECT * INTO k FROM production_shift_key(p_start);
+                INSERT INTO production_rollup AS r (
+                    day, shift, machine_number, part_name, batches, planned_quantity, planned_minutes,
+                    reported_batches, actual_quantity, bubble_count, underfill_count, inclusion_count,
+                    defect_count, utilization_minutes, breakdown_minutes, planned_pause_minutes
+                ) VALUES (
+                    k.day, k.shift, p_machine, p_part, d_batches, d_planned_quantity, d_planned_minutes,
+                    d_reported, d_actual, d_bubble, d_underfill, d_inclusion,
+                    d_defect, d_utilization, d_breakdown, d_pause
+                )
+                ON CONFLICT (day, shift, machine_number, part_name) DO UPDATE SET
+                    batches = r.batches + EXCLUDED.batches,
+                    planned_quantity = r.planned_quantity + EXCLUDED.planned_quantity,
+                    planned_minutes = r.planned_minutes + EXCLUDED.planned_minutes,
+                    reported_batches = r.reported_batches + EXCLUDED.reported_batches,
+                    actual_quantity = r.actual_quantity + EXCLUDED.actual_quantity,
+                    bubble_count = r.bubble_count + EXCLUDED.bubble_count,
+                    underfill_count = r.underfill_count + EXCLUDED.underfill_count,
+                    inclusion_count = r.inclusion_count + EXCLUDED.inclusion_count,
+                    defect_count = r.defect_count + EXCLUDED.defect_count,
+                    utilization_minutes = r.utilization_minutes + EXCLUDED.utilization_minutes,
+                    breakdown_minutes = r.breakdown_minutes + EXCLUDED.breakdown_minutes,
+                    planned_pause_minutes = r.planned_pause_minutes + EXCLUDED.planned_pause_minutes;
+
+                DELETE FROM production_rollup
+                WHERE day = k.day AND shift = k.shift AND machine_number = p_machine
+                  AND part_name = p_part AND batches <= 0;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            # Полный вклад батча (план, отчет, события) со знаком sign
+            """
+            CREATE OR REPLACE FUNCTION production_rollup_apply_batch(
+                p_id INTEGER, p_machine INTEGER, p_part VARCHAR, p_start TIMESTAMP, p_end TIMESTAMP,
+                p_quantity INTEGER, sign INTEGER
+            ) RETURNS void AS $$
+            DECLARE
+                rep RECORD;
+                ev RECORD;
+            BEGIN
+                SELECT COUNT(*)::integer AS reported,
+                       COALESCE(SUM(actual_quantity), 0) AS actual,
+                       COALESCE(SUM(bubble_count), 0) AS bubble,
+                       COALESCE(SUM(underfill_count), 0) AS underfill,
+                       COALESCE(SUM(inclusion_count), 0) AS inclusion,
+                       COALESCE(SUM(defect_count), 0) AS defect
+                INTO rep FROM production WHERE order_id = p_id;
+
+                SELECT COALESCE(SUM(EXTRACT(EPOCH FROM "Фактические время конца события" - "Фактические время начала события") / 60)
+                           FILTER (WHERE "Time_group" = 'Utilization hours'), 0) AS utilization,
+                       COALESCE(SUM(EXTRACT(EPOCH FROM "Фактические время конца события" - "Фактические время начала события") / 60)
+                           FILTER (WHERE "Time_group" = 'Breakdown time'), 0) AS breakdown,
+                       COALESCE(SUM(EXTRACT(EPOCH FROM "Фактические время конца события" - "Фактические время начала события") / 60)
+                           FILTER (WHERE "Time_group" = 'Planned pause time'), 0) AS pause
+                INTO ev FROM events WHERE batch = p_id;
+
+                PERFORM production_rollup_apply(
+                    p_machine, p_part, p_start,
+                    sign, sign * p_quantity, sign * EXTRACT(EPOCH FROM p_end - p_start) / 60,
+                    sign * rep.reported, sign * rep.actual, sign * rep.bubble, sign * rep.underfill,
+                    sign * rep.inclusion, sign * rep.defect,
+                    sign * ev.utilization, sign * ev.breakdown, sign * ev.pause
+                );
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            """
+            CREATE OR REPLACE FUNCTION production_rollup_plan_trigger() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    PERFORM production_rollup_apply(
+                        NEW.machine_number, NEW.part_name, NEW.start_time,
+                        1, NEW.planned_quantity, EXTRACT(EPOCH FROM NEW.end_time - NEW.start_time) / 60,
+                        0, 0, 0, 0, 0, 0, 0, 0, 0);
+                ELSIF TG_OP = 'DELETE' THEN
+                    -- Отчет и события удаляются раньше плана и вычитаются своими триггерами
+                    PERFORM production_rollup_apply(
+                        OLD.machine_number, OLD.part_name, OLD.start_time,
+                        -1, -OLD.planned_quantity, -EXTRACT(EPOCH FROM OLD.end_time - OLD.start_time) / 60,
+                        0, 0, 0, 0, 0, 0, 0, 0, 0);
+                ELSIF (OLD.machine_number, OLD.part_name, OLD.start_time, OLD.end_time, OLD.planned_quantity)
+                      IS DISTINCT FROM
+                      (NEW.machine_number, NEW.part_name, NEW.start_time, NEW.end_time, NEW.planned_quantity) THEN
+                    -- Батч целиком переносится в новую строку сводки
+                    PERFORM production_rollup_apply_batch(
+                        OLD.id, OLD.machine_number, OLD.part_name, OLD.start_time, OLD.end_time,
+                        OLD.planned_quantity, -1);
+                    PERFORM production_rollup_apply_batch(
+                        NEW.id, NEW.machine_number, NEW.part_name, NEW.start_time, NEW.end_time,
+                        NEW.planned_quantity, 1);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            """
+            CREATE OR REPLACE FUNCTION production_rollup_report_trigger() RETURNS trigger AS $$
+            DECLARE
+                pp RECORD;
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    SELECT machine_number, part_name, start_time INTO pp
+                    FROM production_plan WHERE id = OLD.order_id;
+                    IF FOUND THEN
+                        PERFORM production_rollup_apply(
+                            pp.machine_number, pp.part_name, pp.start_time, 0, 0, 0,
+                            -1, -OLD.actual_quantity, -COALESCE(OLD.bubble_count, 0),
+                            -COALESCE(OLD.underfill_count, 0), -COALESCE(OLD.inclusion_count, 0),
+                            -COALESCE(OLD.defect_count, 0), 0, 0, 0);
+                    END IF;
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    SELECT machine_number, part_name, start_time INTO pp
+                    FROM production_plan WHERE id = NEW.order_id;
+                    IF FOUND THEN
+                        PERFORM production_rollup_apply(
+                            pp.machine_number, pp.part_name, pp.start_time, 0, 0, 0,
+                            1, NEW.actual_quantity, COALESCE(NEW.bubble_count, 0),
+                            COALESCE(NEW.underfill_count, 0), COALESCE(NEW.inclusion_count, 0),
+                            COALESCE(NEW.defect_count, 0), 0, 0, 0);
+                    END IF;
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            """
+            CREATE OR REPLACE FUNCTION production_rollup_event_trigger() RETURNS trigger AS $$
+            DECLARE
+                pp RECORD;
+                minutes NUMERIC;
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    SELECT machine_number, part_name, start_time INTO pp
+                    FROM production_plan WHERE id = OLD.batch;
+                    IF FOUND THEN
+                        minutes := EXTRACT(EPOCH FROM OLD."Фактические время конца события" - OLD."Фактические время начала события") / 60;
+                        PERFORM production_rollup_apply(
+                            pp.machine_number, pp.part_name, pp.start_time, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                            CASE WHEN OLD."Time_group" = 'Utilization hours' THEN -minutes ELSE 0 END,
+                            CASE WHEN OLD."Time_group" = 'Breakdown time' THEN -minutes ELSE 0 END,
+                            CASE WHEN OLD."Time_group" = 'Planned pause time' THEN -minutes ELSE 0 END);
+                    END IF;
+                END IF;
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    SELECT machine_number, part_name, start_time INTO pp
+                    FROM production_plan WHERE id = NEW.batch;
+                    IF FOUND THEN
+                        minutes := EXTRACT(EPOCH FROM NEW."Фактические время конца события" - NEW."Фактические время начала события") / 60;
+                        PERFORM production_rollup_apply(
+                            pp.machine_number, pp.part_name, pp.start_time, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+                            CASE WHEN NEW."Time_group" = 'Utilization hours' THEN minutes ELSE 0 END,
+                            CASE WHEN NEW."Time_group" = 'Breakdown time' THEN minutes ELSE 0 END,
+                            CASE WHEN NEW."Time_group" = 'Planned pause time' THEN minutes ELSE 0 END);
+                    END IF;
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS production_rollup ON production_plan;",
+            """
+            CREATE TRIGGER production_rollup
+            AFTER INSERT OR UPDATE OR DELETE ON production_plan
+            FOR EACH ROW EXECUTE FUNCTION production_rollup_plan_trigger();
+            """,
+            "DROP TRIGGER IF EXISTS production_rollup ON production;",
+            """
+            CREATE TRIGGER production_rollup
+            AFTER INSERT OR UPDATE OR DELETE ON production
+            FOR EACH ROW EXECUTE FUNCTION production_rollup_report_trigger();
+            """,
+            "DROP TRIGGER IF EXISTS production_rollup ON events;",
+            """
+            CREATE TRIGGER production_rollup
+            AFTER INSERT OR UPDATE OR DELETE ON events
+            FOR EACH ROW EXECUTE FUNCTION production_rollup_event_trigger();
+            """,
+            # Заполнение сводки существующими данными. CREATE TRIGGER уже
+            # заблокировал запись в исходные таблицы до конца транзакции,
+            # поэтому изменения после миграции учтут триггеры
+            "TRUNCATE production_rollup;",
+            """
+            WITH plans AS (
+                SELECT pp.id, pp.machine_number, pp.part_name, pp.planned_quantity,
+                       pp.start_time, pp.end_time, k.day, k.shift
+                FROM production_plan pp
+                CROSS JOIN LATERAL production_shift_key(pp.start_time) k
+            ),
+            event_minutes AS (
+                SELECT e.batch,
+                       SUM(EXTRACT(EPOCH FROM e."Фактические время конца события" - e."Фактические время начала события") / 60)
+                           FILTER (WHERE e."Time_group" = 'Utilization hours') AS utilization,
+                       SUM(EXTRACT(EPOCH FROM e."Фактические время конца события" - e."Фактические время начала события") / 60)
+                           FILTER (WHERE e."Time_group" = 'Breakdown time') AS breakdown,
+                       SUM(EXTRACT(EPOCH FROM e."Фактические время конца события" - e."Фактические время начала события") / 60)
+                           FILTER (WHERE e."Time_group" = 'Planned pause time') AS planned_pause
+                FROM events e
+                GROUP BY e.batch
+            )
+            INSERT INTO production_rollup (
+                day, shift, machine_number, part_name, batches, planned_quantity,
+                planned_minutes, reported_batches, actual_quantity, bubble_count,
+                underfill_count, inclusion_count, defect_count, utilization_minutes,
+                breakdown_minutes, planned_pause_minutes
+            )
+            SELECT plans.day, plans.shift, plans.machine_number, plans.part_name,
+                   COUNT(*),
+                   SUM(plans.planned_quantity),
+                   SUM(EXTRACT(EPOCH FROM plans.end_time - plans.start_time) / 60),
+                   COUNT(p.id),
+                   COALESCE(SUM(p.actual_quantity), 0),
+                   COALESCE(SUM(p.bubble_count), 0),
+                   COALESCE(SUM(p.underfill_count), 0),
+                   COALESCE(SUM(p.inclusion_count), 0),
+                   COALESCE(SUM(p.defect_count), 0),
+                   COALESCE(SUM(em.utilization), 0),
+                   COALESCE(SUM(em.breakdown), 0),
+                   COALESCE(SUM(em.planned_pause), 0)
+            FROM plans
+            LEFT JOIN production p ON p.order_id = plans.id
+            LEFT JOIN event_minutes em ON em.batch = plans.id
+            GROUP BY plans.day, plans.shift, plans.machine_number, plans.part_name;
+            """,
+        ],
+    ),
+    Migration(
+        version=7,
+        description='Запрет пересечения событий одного батча (exclusion constraint)',
+        statements=[
+            "CREATE EXTENSION IF NOT EXISTS btree_gist;",
+            # Существующие пересечения нужно разобрать вручную до применения миграции
+            """
+            DO $$
+            DECLARE
+                conflict RECORD;
+            BEGIN
+                SELECT a.event_id AS first_id, b.event_id AS second_id, a.batch INTO conflict
+                FROM events a
+                JOIN events b ON b.batch = a.batch AND b.event_id > a.event_id
+                 AND tsrange(a."Фактические время начала события", a."Фактические время конца события", '[)')
+                  && tsrange(b."Фактические время начала события", b."Фактические время конца события", '[)')
+                LIMIT 1;
+                IF FOUND THEN
+                    RAISE EXCEPTION 'События % и % батча % пересекаются по времени; исправьте данные и повторите миграцию',
+                        conflict.first_id, conflict.second_id, conflict.batch;
+                END IF;
+            END;
+            $$;
+            """,
+            """
+            ALTER TABLE events
+            ADD CONSTRAINT events_no_overlap
+            EXCLUDE USING gist (
+                batch WITH =,
+                tsrange("Фактические время начала события", "Фактические время конца события", '[)') WITH &&
+            );
+            """,
+        ],
+    ),
+    Migration(
+        version=8,
+        description='GiST-индекс расписания станков (станок, интервал батча)',
+        statements=[
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_production_plan_machine_period
+            ON production_plan USING gist (machine_number, tsrange(start_time, end_time, '[)'));
+            """,
+        ],
+        transactional=False,
+        indexes=('idx_production_plan_machine_period',),
+    ),
+    Migration(
+        version=9,
+        description='Журнал изменений батчей plan_changes и уведомления plan_changes',
+        statements=[
+            # Позиция в журнале - номер транзакции (txid): все транзакции с номером
+            # меньше xmin текущего снимка завершены, поэтому читатель, идущий по
+            # границе xmin, не пропускает изменения, зафиксированные не по порядку
+            """
+            CREATE TABLE IF NOT EXISTS plan_changes (
+                xid BIGINT NOT NULL DEFAULT txid_current(),
+                plan_id INTEGER NOT NULL,
+                changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (xid, plan_id)
+            );
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_plan_changes_changed_at ON plan_changes (changed_at);",
+            # Граница, до которой журнал очищен: читатель с более старой позицией
+            # должен перезагрузить данные целиком
+            """
+            CREATE TABLE IF NOT EXISTS plan_changes_state (
+                id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                pruned_before BIGINT NOT NULL DEFAULT 0
+            );
+            """,
+            "INSERT INTO plan_changes_state (id) VALUES (TRUE) ON CONFLICT (id) DO NOTHING;",
+            """
+            CREATE OR REPLACE FUNCTION log_plan_change() RETURNS trigger AS $$
+            DECLARE
+                old_id INTEGER;
+                new_id INTEGER;
+            BEGIN
+                IF TG_TABLE_NAME = 'production_plan' THEN
+                    IF TG_OP <> 'INSERT' THEN old_id := OLD.id; END IF;
+                    IF TG_OP <> 'DELETE' THEN new_id := NEW.id; END IF;
+                ELSIF TG_TABLE_NAME = 'production' THEN
+                    IF TG_OP <> 'INSERT' THEN old_id := OLD.order_id; END IF;
+                    IF TG_OP <> 'DELETE' THEN new_id := NEW.order_id; END IF;
+                ELSE
+                    IF TG_OP <> 'INSERT' THEN old_id := OLD.batch; END IF;
+                    IF TG_OP <> 'DELETE' THEN new_id := NEW.batch; END IF;
+                END IF;
+
+                INSERT INTO plan_changes (plan_id)
+                SELECT DISTINCT plan_id FROM (VALUES (old_id), (new_id)) AS ids (plan_id)
+                WHERE plan_id IS NOT NULL
+                ON CONFLICT DO NOTHING;
+                -- Одинаковые уведомления в одной транзакции PostgreSQL объединяет
+                PERFORM pg_notify('plan_changes', '');
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """,
+            "DROP TRIGGER IF EXISTS plan_changes ON production_plan;",
+            """
+            CREATE TRIGGER plan_changes
+            AFTER INSERT OR UPDATE OR DELETE ON production_plan
+            FOR EACH ROW EXECUTE FUNCTION log_plan_change();
+            """,
+            "DROP TRIGGER IF EXISTS plan_changes ON production;",
+            """
+            CREATE TRIGGER plan_changes
+            AFTER INSERT OR UPDATE OR DELETE ON production
+            FOR EACH ROW EXECUTE FUNCTION log_plan_change();
+            """,
+            "DROP TRIGGER IF EXISTS plan_changes ON events;",
+            """
+            CREATE TRIGGER plan_changes
+            AFTER INSERT OR UPDATE OR DELETE ON events
+            FOR EACH ROW EXECUTE FUNCTION log_plan_change();
+            """,
+        ],
+    ),
+    Migration(
+        version=10,
+        description='Индекс журнала изменений по батчу для ETag страниц батча',
+        statements=[
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_plan_changes_plan_xid
+            ON plan_changes (plan_id, xid);
+            """,
+        ],
+        transactional=False,
+        indexes=('idx_plan_changes_plan_xid',),
+    ),
+]
+
+
+def _ensure_version_table(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        """)
+
+
+def get_applied_versions(conn):
+    """Множество номеров уже примененных миграций"""
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT version FROM schema_version;")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def _drop_invalid_indexes(cursor, names):
+    """Удаление индексов, оставшихся INVALID после прерванного CREATE INDEX CONCURRENTLY"""
+    cursor.execute("""
+    SELECT c.relname
+    FROM pg_index i
+    JOIN pg_class c ON c.oid = i.indexrelid
+    WHERE NOT i.indisvalid AND c.relname = ANY(%s);
+    """, (list(names),))
+    for (name,) in cursor.fetchall():
+        log_message(f"WARNING: Удаление невалидного индекса {name}")
+        cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{name}";')
+
+
+def _apply(conn, migration):
+    if migration.transactional:
+        with conn.cursor() as cursor:
+            for statement in migration.statements:
+                cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s);",
+                (migration.version, migration.description)
+            )
+        conn.commit()
+        return
+
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            if migration.indexes:
+                _drop_invalid_indexes(cursor, migration.indexes)
+            for statement in migration.statements:
+                cursor.execute(statement)
+            cursor.execute(
+                "INSERT INTO schema_version (version, description) VALUES (%s, %s);",
+                (migration.version, migration.description)
+            )
+    finally:
+        conn.autocommit = False
+
+
+def upgrade(conn, target=None):
+    """
+    Применение всех непримененных миграций до версии target включительно.
+    Возвращает список примененных версий.
+    """
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK_KEY,))
+    conn.autocommit = False
+    try:
+        _ensure_version_table(conn)
+        conn.commit()
+        applied = get_applied_versions(conn)
+        conn.commit()
+
+        done = []
+        for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+            if target is not None and migration.version > target:
+                break
+            if migration.version in applied:
+                continue
+            log_message(f"INFO: Применение миграции {migration.version}: {migration.description}")
+            try:
+                _apply(conn, migration)
+            except Error:
+                conn.rollback()
+                raise
+            done.append(migration.version)
+        return done
+    finally:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK_KEY,))
+        conn.autocommit = False
+
+
+db_cli = AppGroup('db', help='Управление схемой базы данных')
+
+
+@db_cli.command('upgrade')
+@click.option('--target', type=int, default=None, help='Применить миграции до этой версии включительно')
+def upgrade_command(target):
+    """Применить непримененные миграции"""
+    conn = db.connect_direct()
+    try:
+        done = upgrade(conn, target)
+    except Error as e:
+        raise click.ClickException(f"Ошибка при применении миграций: {e}")
+    finally:
+        conn.close()
+    if done:
+        click.echo(f"Применены миграции: {', '.join(str(v) for v in done)}")
+    else:
+        click.echo("Схема уже актуальна")
+
+
+@db_cli.command('status')
+def status_command():
+    """Показать примененные и ожидающие миграции"""
+    conn = db.connect_direct()
+    try:
+        _ensure_version_table(conn)
+        conn.commit()
+        applied = get_applied_versions(conn)
+    finally:
+        conn.close()
+    for migration in sorted(MIGRATIONS, key=lambda m: m.version):
+        mark = 'x' if migration.version in applied else ' '
+        click.echo(f"[{mark}] {migration.version:04d} {migration.description}")
@@ -0,0 +1,198 @@
+"""
+Расчет OEE (Overall Equipment Effectiveness) по событиям и отчетам производства.
+
+Время батча делится событиями на группы 'Planned pause time',
+'Utilization hours' и 'Breakdown time':
+
+    Availability = Utilization / (Utilization + Breakdown)
+    Performance  = Actual quantity / (Planned quantity * Utilization / Plan duration)
+    Quality      = (Actual quantity - Defects) / Actual quantity
+    OEE          = Availability * Performance * Quality
+
+Все суммирование выполняется одним запросом на стороне PostgreSQL
+(GROUP BY по выбранным измерениям); в Python считаются только отношения
+для уже агрегированных групп. Границы смен задает таблица rollup_settings
+(функция production_shift_key), та же, что у сводки production_rollup.
+"""
+from datetime import datetime, timedelta
+
+# Измерение -> выражения группировки над batch_stats
+DIMENSIONS = {
+    'machine': ('machine_number',),
+    'part': ('part_name',),
+    'batch': ('batch_id',),
+    'day': ('day',),
+    'shift': ('day', 'shift'),
+}
+
+OEE_QUERY = """
+WITH plans AS (
+    SELECT pp.id, pp.part_name, pp.planned_quantity, pp.machine_number,
+           pp.start_time, pp.end_time
+    FROM production_plan pp
+    WHERE pp.start_time >= %(date_from)s AND pp.start_time < %(date_to)s
+      {machine_filter}
+),
+event_minutes AS (
+    SELECT e.batch,
+           SUM(EXTRACT(EPOCH FROM e."Фактические время конца события" - e."Фактические время начала события") / 60)
+               FILTER (WHERE e."Time_group" = 'Utilization hours') AS utilization,
+           SUM(EXTRACT(EPOCH FROM e."Фактические время конца события" - e."Фактические время начала события") / 60)
+               FILTER (WHERE e."Time_group" = 'Breakdown time') AS breakdown,
+           SUM(EXTRACT(EPOCH FROM e."Фактические время конца события" - e."Фактические время начала события") / 60)
+               FILTER (WHERE e."Time_group" = 'Planned pause time') AS planned_pause
+    FROM events e
+    JOIN plans ON plans.id = e.batch
+    GROUP BY e.batch
+),
+batch_stats AS (
+    SELECT plans.id AS batch_id,
+           plans.machine_number,
+           plans.part_name,
+           k.day,
+           k.shift,
+           plans.planned_quantity,
+           EXTRACT(EPOCH FROM plans.end_time - plans.start_time) / 60 AS plan_minutes,
+           COALESCE(em.utilization, 0) AS utilization,
+           COALESCE(em.breakdown, 0) AS breakdown,
+           COALESCE(em.planned_pause, 0) AS planned_pause,
+           COALESCE(p.actual_quantity, 0) AS actual_quantity,
+           COALESCE(p.defect_count, 0) AS defect_count,
+           (p.id IS NOT NULL) AS has_report
+    FROM plans
+    CROSS JOIN LATERAL production_shift_key(plans.start_time) k
+    LEFT JOIN event_minutes em ON em.batch = plans.id
+    LEFT JOIN production p ON p.order_id = plans.id
+)
+SELECT {select_keys}
+       COUNT(*) AS batches,
+       COUNT(*) FILTER (WHERE has_report) AS reported_batches,
+       SUM(utilization) AS utilization,
+       SUM(breakdown) AS breakdown,
+       SUM(planned_pause) AS planned_pause,
+       SUM(actual_quantity) AS actual_quantity,
+       SUM(defect_count) AS defect_count,
+       SUM(planned_quantity * utilization / NULLIF(plan_minutes, 0))
+           FILTER (WHERE has_report) AS expected_quantity
+FROM batch_stats
+{group_by}
+{order_by};
+"""
+
+SUM_FIELDS = ('batches', 'reported_batches', 'utilization', 'breakdown', 'planned_pause',
+              'actual_quantity', 'defect_count', 'expected_quantity')
+
+
+def parse_dimensions(value):
+    """Список измерений группировки из строки 'machine,day'; ValueError при неизвестном"""
+    if not value:
+        return []
+    dimensions = []
+    for name in value.split(','):
+        name = name.strip().lower()
+        if not name:
+            continue
+        if name not in DIMENSIONS:
+            raise ValueError(f"Неизвестное измерение группировки: {name}")
+        if name not in dimensions:
+            dimensions.append(name)
+    return dimensions
+
+
+def _ratio(numerator, denominator):
+    if not denominator:
+        return None
+    return round(float(numerator) / float(denominator), 4)
+
+
+def _metrics(row):
+    utilization = float(row['utilization'] or 0)
+    breakdown = float(row['breakdown'] or 0)
+    actual = float(row['actual_quantity'] or 0)
+    defects = float(row['defect_count'] or 0)
+    expected = float(row['expected_quantity'] or 0)
+
+    availability = _ratio(utilization, utilization + breakdown)
+    performance = _ratio(actual, expected)
+    quality = _ratio(actual - defects, actual)
+    oee = None
+    if availability is not None and performance is not None and quality is not None:
+        oee = round(availability * performance * quality, 4)
+
+    return {
+        'availability': availability,
+        'performance': performance,
+        'quality': quality,
+        'oee': oee,
+        'batches': int(row['batches'] or 0),
+        'reported_batches': int(row['reported_batches'] or 0),
+        'utilization_minutes': round(utilization, 1),
+        'breakdown_minutes': round(breakdown, 1),
+        'planned_pause_minutes': round(float(row['planned_pause'] or 0), 1),
+        'actual_quantity': int(actual),
+        'defect_count': int(defects),
+        'expected_quantity': round(expected, 1)
+    }
+
+
+def compute_oee(conn, date_from, date_to, dimensions, machines=None):
+    """
+    OEE за период [date_from, date_to) по батчам, начавшимся в этом периоде.
+    Возвращает {'groups': [...], 'total': {...}}; каждая группа содержит
+    значения измерений и метрики.
+    """
+    keys = []
+    for name in dimensions:
+        for column in DIMENSIONS[name]:
+            if column not in keys:
+                keys.append(column)
+
+    params = {
+        'date_from': date_from,
+        'date_to': date_to,
+    }
+    machine_filter = ''
+    if machines:
+        machine_filter = 'AND pp.machine_number = ANY(%(machines)s)'
+        params['machines'] = list(machines)
+
+    query = OEE_QUERY.format(
+        machine_filter=machine_filter,
+        select_keys=''.join(f'{key}, ' for key in keys),
+        group_by=f"GROUP BY {', '.join(keys)}" if keys else '',
+        order_by=f"ORDER BY {', '.join(keys)}" if keys else ''
+    )
+
+    with conn.cursor() as cursor:
+        cursor.execute(query, params)
+        columns = [column.name for column in cursor.description]
+        rows = [dict(zip(columns, record)) for record in cursor.fetchall()]
+
+    groups = []
+    totals = dict.fromkeys(SUM_FIELDS, 0)
+    for row in rows:
+        for field in SUM_FIELDS:
+            totals[field] += row[field] or 0
+        group = {key: row[key] for key in keys}
+        if 'day' in group:
+            group['day'] = group['day'].isoformat()
+        group.update(_metrics(row))
+        groups.append(group)
+
+    # Без измерений запрос возвращает одну строку - она же итог
+    if not keys:
+        groups = []
+    return {'groups': groups, 'total': _metrics(totals)}
+
+
+def parse_period(date_from, date_to, default_days=30):
+    """Границы периода из дат YYYY-MM-DD; конечная дата включается целиком"""
+    try:
+        end = datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to \
+            else datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        start = datetime.strptime(date_from, '%Y-%m-%d') if date_from else end - timedelta(days=default_days)
+    except ValueError:
+        raise ValueError('Неверный формат даты. Используйте YYYY-MM-DD')
+    if end <= start:
+        raise ValueError('Дата окончания должна быть не раньше даты начала')
+    return start, end
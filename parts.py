@@ -0,0 +1,226 @@
+"""
+Кэш справочника деталей.
+
+Список деталей хранится в памяти процесса с ограниченным временем жизни.
+Каждый процесс держит фоновый поток с отдельным соединением, который слушает
+канал parts_changed (LISTEN/NOTIFY): триггер на таблице parts отправляет
+уведомление при любом изменении, и все воркеры сбрасывают свою копию.
+"""
+import os
+import select
+import threading
+import time
+
+from flask import current_app
+from psycopg2 import Error
+
+import db
+import metrics
+from app_logging import log_message
+
+PARTS_CHANNEL = 'parts_changed'
+
+_cache_lock = threading.Lock()
+_cache = {'parts': None, 'names': None, 'loaded_at': 0.0, 'pid': None, 'generation': 0}
+
+_listener_lock = threading.Lock()
+_listener_pid = None
+
+
+def init_app(app):
+    """Настройки кэша справочника деталей"""
+    app.config.setdefault('PARTS_CACHE_TTL', float(os.environ.get('PARTS_CACHE_TTL', 300)))
+    app.config.setdefault('PARTS_LISTENER_ENABLED', os.environ.get('PARTS_LISTENER_ENABLED', '1') == '1')
+    # Время кэширования ответов /api/parts в браузере, секунды
+    app.config.setdefault('PARTS_SEARCH_MAX_AGE', int(os.environ.get('PARTS_SEARCH_MAX_AGE', 60)))
+
+
+def invalidate_parts_cache():
+    """Сброс кэша деталей в текущем процессе"""
+    with _cache_lock:
+        _cache['parts'] = None
+        _cache['names'] = None
+        _cache['loaded_at'] = 0.0
+        _cache['generation'] += 1
+
+
+def _load_parts():
+    conn = db.get_db_connection()
+    if conn is None:
+        return None
+
+    cursor = None
+    try:
+        cursor = conn.cursor()
+
+        select_query = """
+        SELECT "Наименование детали"
+        FROM parts
+        ORDER BY "Наименование детали";
+        """
+
+        cursor.execute(select_query)
+        parts = cursor.fetchall()
+
+        # Преобразуем список кортежей в список строк
+        parts_list = [part[0] for part in parts]
+
+        log_message(f"INFO: Получено {len(parts_list)} деталей из БД")
+        return parts_list
+
+    except (Exception, Error) as error:
+        log_message(f"ERROR: Ошибка при получении списка деталей: {error}")
+        return None
+
+    finally:
+        if cursor:
+            cursor.close()
+
+
+def get_parts_list():
+    """Получение списка деталей из таблицы parts (с кэшированием)"""
+    parts_list = _get_cached_parts()
+    return [] if parts_list is None else parts_list
+
+
+def _get_cached_parts():
+    """Список деталей из кэша или базы; None, если загрузить не удалось"""
+    if current_app.config['PARTS_LISTENER_ENABLED']:
+        _ensure_listener()
+
+    ttl = current_app.config['PARTS_CACHE_TTL']
+    pid = os.getpid()
+    with _cache_lock:
+        # Кэш, унаследованный от родителя после fork, не защищен слушателем
+        if _cache['pid'] == pid and _cache['parts'] is not None \
+                and time.monotonic() - _cache['loaded_at'] < ttl:
+            metrics.observe_parts_cache(hit=True)
+            return _cache['parts']
+        generation = _cache['generation']
+    metrics.observe_parts_cache(hit=False)
+
+    loaded_at = time.monotonic()
+    parts_list = _load_parts()
+    if parts_list is None:
+        return None
+
+    with _cache_lock:
+        # Если во время загрузки пришло уведомление, результат не сохраняем
+        if _cache['generation'] == generation:
+            _cache['parts'] = parts_list
+            _cache['loaded_at'] = loaded_at
+            _cache['pid'] = pid
+    return parts_list
+
+
+def get_part_names():
+    """
+    Множество наименований деталей для проверки записей; строится один раз
+    на загрузку кэша. Если справочник не загрузился, бросает Error: пустой
+    список здесь отклонил бы любую запись как деталь не из справочника.
+    """
+    parts_list = _get_cached_parts()
+    if parts_list is None:
+        raise Error('справочник деталей недоступен')
+    with _cache_lock:
+        cached = _cache['names']
+        if cached is not None and cached[0] is parts_list:
+            return cached[1]
+    names = frozenset(parts_list)
+    with _cache_lock:
+        if _cache['parts'] is parts_list:
+            _cache['names'] = (parts_list, names)
+    return names
+
+
+def _ensure_listener():
+    """Запуск фонового слушателя уведомлений в текущем процессе"""
+    global _listener_pid
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _listener_lock:
+        if _listener_pid == pid:
+            return
+        thread = threading.Thread(target=_listen_forever, name='parts-listener', daemon=True)
+        thread.start()
+        _listener_pid = pid
+
+
+def _listen_forever():
+    delay = 1
+    while True:
+        conn = None
+        try:
+            conn = db.connect_direct()
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {PARTS_CHANNEL};")
+            # Пока слушатель не работал, уведомления могли потеряться
+            invalidate_parts_cache()
+            delay = 1
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    conn.notifies.clear()
+                    invalidate_parts_cache()
+                    log_message("INFO: Справочник деталей изменен, кэш сброшен")
+        except (Exception, Error) as error:
+            log_message(f"WARNING: Слушатель изменений деталей остановлен: {error}")
+            invalidate_parts_cache()
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Error:
+                    pass
+        time.sleep(delay)
+        delay = min(delay * 2, 60)
+
+
+def _escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_parts(query, limit):
+    """
+    Поиск деталей по началу названия и по триграммному сходству.
+    Совпадения по префиксу идут первыми, затем по убыванию сходства.
+    Возвращает None при ошибке подключения.
+    """
+    query = query.strip()
+    if not query:
+        return get_parts_list()[:limit]
+
+    conn = db.get_db_connection()
+    if conn is None:
+        return None
+
+    cursor = None
+    try:
+        cursor = conn.cursor()
+
+        # ILIKE и оператор % обслуживаются GIN-индексом idx_parts_name_trgm
+        search_query = """
+        SELECT "Наименование детали"
+        FROM parts
+        WHERE "Наименование детали" ILIKE %(prefix)s
+           OR "Наименование детали" %% %(query)s
+        ORDER BY "Наименование детали" ILIKE %(prefix)s DESC,
+                 similarity("Наименование детали", %(query)s) DESC,
+                 "Наименование детали"
+        LIMIT %(limit)s;
+        """
+
+        cursor.execute(search_query, {
+            'prefix': _escape_like(query) + '%',
+            'query': query,
+            'limit': limit
+        })
+        return [row[0] for row in cursor.fetchall()]
+
+    finally:
+        if cursor:
+            cursor.close()
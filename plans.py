@@ -0,0 +1,660 @@
+"""
+Производственный план: проверка записей, пакетное создание/обновление
+и массовый импорт из CSV/XLSX.
+
+Импорт читает файл построчно, проверяет каждую строку теми же правилами,
+что и /save_data, и загружает корректные строки пачками через COPY во
+временную таблицу, откуда они одной командой переносятся в production_plan.
+"""
+import csv
+import io
+import itertools
+import json
+import os
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from psycopg2 import Error
+from psycopg2.extras import execute_values
+
+import db
+import parts
+from app_logging import log_message
+
+PLAN_TIME_FORMATS = ('%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S')
+
+IMPORT_CHUNK_ROWS = 5000
+# Максимальное количество записей в одном запросе /api/plans/batch
+BATCH_MAX_ITEMS = 5000
+
+# Сколько ошибок по строкам возвращать в отчете; остальные только считаются
+IMPORT_MAX_ERRORS = 1000
+
+
+def _parse_plan_time(value):
+    if isinstance(value, datetime):
+        return value.replace(second=0, microsecond=0)
+    for time_format in PLAN_TIME_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), time_format)
+        except ValueError:
+            continue
+    raise ValueError(value)
+
+
+def validate_plan(data):
+    """
+    Проверка полей записи плана; деталь должна быть в справочнике parts.
+    Возвращает словарь с приведенными значениями или бросает ValueError
+    с сообщением для пользователя.
+    """
+    part_name = data.get('part_name')
+    planned_quantity = data.get('planned_quantity')
+    machine_number = data.get('machine_number')
+    start_time = data.get('start_time')
+    end_time = data.get('end_time')
+
+    if not part_name or not str(part_name).strip():
+        raise ValueError('Part name не может быть пустым')
+    part_name = str(part_name).strip()
+
+    if not planned_quantity:
+        raise ValueError('Planned quantity не может быть пустым')
+
+    if not machine_number:
+        raise ValueError('Machine number не может быть пустым')
+
+    if not start_time:
+        raise ValueError('Start time не может быть пустым')
+
+    if not end_time:
+        raise ValueError('End time не может быть пустым')
+
+    try:
+        planned_quantity_int = int(planned_quantity)
+    except (ValueError, TypeError):
+        raise ValueError('Planned quantity должен быть числом')
+    if planned_quantity_int <= 0:
+        raise ValueError('Planned quantity должен быть положительным числом')
+
+    try:
+        machine_number_int = int(machine_number)
+    except (ValueError, TypeError):
+        raise ValueError('Machine number должен быть числом')
+    if machine_number_int <= 0:
+        raise ValueError('Machine number должен быть положительным числом')
+
+    try:
+        start_time_dt = _parse_plan_time(start_time)
+        end_time_dt = _parse_plan_time(end_time)
+    except (ValueError, AttributeError):
+        raise ValueError('Неверный формат времени. Используйте YYYY-MM-DDTHH:MM')
+
+    if end_time_dt <= start_time_dt:
+        raise ValueError('End time должен быть позже start time')
+
+    if part_name not in parts.get_part_names():
+        raise ValueError(f'Деталь "{part_name}" отсутствует в справочнике деталей')
+
+    return {
+        'part_name': part_name,
+        'planned_quantity': planned_quantity_int,
+        'machine_number': machine_number_int,
+        'start_time': start_time_dt,
+        'end_time': end_time_dt
+    }
+
+
+def plan_to_dict(plan_id, plan):
+    """Представление записи плана в ответах API"""
+    return {
+        'id': plan_id,
+        'part_name': plan['part_name'],
+        'planned_quantity': plan['planned_quantity'],
+        'machine_number': plan['machine_number'],
+        'start_time': plan['start_time'].strftime('%Y-%m-%d %H:%M'),
+        'end_time': plan['end_time'].strftime('%Y-%m-%d %H:%M')
+    }
+
+
+CONFLICT_MODES = ('strict', 'warn')
+
+
+def init_app(app):
+    """Режим проверки пересечений расписания станков по умолчанию"""
+    # strict - отклонять пересекающиеся батчи, warn - сохранять и возвращать список пересечений
+    app.config.setdefault('PLAN_CONFLICT_MODE', os.environ.get('PLAN_CONFLICT_MODE', 'warn'))
+
+
+def lock_machine_schedule(cursor, machine_number):
+    """
+    Блокировка расписания станка до конца транзакции: два одновременных
+    сохранения на один станок не пропустят пересечения друг друга.
+    """
+    cursor.execute("SELECT pg_advisory_xact_lock(hashtext('production_plan.machine'), %s);", (machine_number,))
+
+
+def find_schedule_conflicts(cursor, machine_number, start_time, end_time, exclude_id=None):
+    """ID батчей станка, пересекающихся с интервалом [start_time, end_time)"""
+    cursor.execute("""
+    SELECT id
+    FROM production_plan
+    WHERE machine_number = %s
+      AND tsrange(start_time, end_time, '[)') && tsrange(%s, %s, '[)')
+      AND id IS DISTINCT FROM %s
+    ORDER BY start_time, id;
+    """, (machine_number, start_time, end_time, exclude_id))
+    return [row[0] for row in cursor.fetchall()]
+
+
+# Пересечения записей пакета (source - VALUES или выборка из промежуточной
+# таблицы) с батчами базы и между собой. Батчи, которые пакет сам обновляет,
+# не учитываются: их прежнее время заменяется. Внутри пакета запись
+# пересекается с начавшимися раньше записями того же станка; оконный
+# максимум окончаний находит их без попарного сравнения всего пакета.
+BULK_CONFLICTS_QUERY = """
+WITH v (key, id, machine_number, start_time, end_time) AS (
+    {source}
+),
+ordered AS (
+    SELECT v.*, MAX(end_time) OVER (
+        PARTITION BY machine_number ORDER BY start_time, key
+        ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+    ) AS previous_end
+    FROM v
+)
+SELECT v.key, v.machine_number, pp.id, NULL::integer
+FROM v
+JOIN production_plan pp
+  ON pp.machine_number = v.machine_number
+ AND tsrange(pp.start_time, pp.end_time, '[)') && tsrange(v.start_time, v.end_time, '[)')
+WHERE NOT EXISTS (SELECT 1 FROM v moved WHERE moved.id = pp.id)
+UNION ALL
+SELECT a.key, a.machine_number, NULL, b.key
+FROM ordered a
+JOIN v b
+  ON b.machine_number = a.machine_number
+ AND (b.start_time, b.key) < (a.start_time, a.key)
+ AND b.end_time > a.start_time
+WHERE a.start_time < a.previous_end
+ORDER BY 1, 3, 4;
+"""
+
+
+def _group_bulk_conflicts(rows):
+    """{ключ записи: {'machine_number', 'plan_ids', 'keys'}} из строк BULK_CONFLICTS_QUERY"""
+    conflicts = {}
+    for key, machine_number, plan_id, other_key in rows:
+        entry = conflicts.setdefault(key, {'machine_number': machine_number, 'plan_ids': [], 'keys': []})
+        if plan_id is not None:
+            entry['plan_ids'].append(plan_id)
+        else:
+            entry['keys'].append(other_key)
+    return conflicts
+
+
+def find_bulk_conflicts(cursor, entries, conflict_mode):
+    """
+    Пересечения расписания для записей пакета: entries - список
+    (ключ, id или None, plan). В режиме strict расписания станков
+    блокируются до конца транзакции (в порядке номеров станков).
+    """
+    if conflict_mode == 'strict':
+        _lock_machine_schedules(cursor, {plan['machine_number'] for _, _, plan in entries})
+    rows = execute_values(
+        cursor, BULK_CONFLICTS_QUERY.format(source='VALUES %s'),
+        [(key, plan_id, plan['machine_number'], plan['start_time'], plan['end_time'])
+         for key, plan_id, plan in entries],
+        template="(%s::integer, %s::integer, %s::integer, %s::timestamp, %s::timestamp)",
+        page_size=len(entries), fetch=True
+    )
+    return _group_bulk_conflicts(rows)
+
+
+def _lock_machine_schedules(cursor, machines):
+    # Блокировки берутся в порядке номеров станков, чтобы не было взаимоблокировок
+    for machine_number in sorted(machines):
+        lock_machine_schedule(cursor, machine_number)
+
+
+def _conflict_message(conflict, keys_label):
+    messages = []
+    if conflict['plan_ids']:
+        ids = ', '.join(str(plan_id) for plan_id in conflict['plan_ids'])
+        messages.append(f"Станок {conflict['machine_number']} в это время занят батчами: {ids}")
+    if conflict['keys']:
+        keys = ', '.join(str(key) for key in conflict['keys'])
+        messages.append(f"{keys_label}: {keys}")
+    return '. '.join(messages)
+
+
+def find_conflicts_in_range(conn, date_from, date_to, machines=None):
+    """
+    Все пары пересекающихся батчей на одном станке среди батчей,
+    затрагивающих период [date_from, date_to). Один запрос: для каждого
+    батча периода пересечения ищутся по GiST-индексу (станок, интервал).
+    """
+    conditions = ["a.start_time < %s", "a.end_time > %s"]
+    params = [date_to, date_from]
+    if machines:
+        conditions.append("a.machine_number = ANY(%s)")
+        params.append(list(machines))
+
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+        SELECT a.machine_number, a.id, a.start_time, a.end_time, b.id, b.start_time, b.end_time
+        FROM production_plan a
+        JOIN production_plan b
+          ON b.machine_number = a.machine_number
+         AND tsrange(b.start_time, b.end_time, '[)') && tsrange(a.start_time, a.end_time, '[)')
+         AND b.id <> a.id
+        WHERE {' AND '.join(conditions)}
+          AND (a.id < b.id OR NOT (b.start_time < %s AND b.end_time > %s))
+        ORDER BY a.machine_number, a.start_time, a.id, b.id;
+        """, params + [date_to, date_from])
+        conflicts = []
+        for machine_number, a_id, a_start, a_end, b_id, b_start, b_end in cursor.fetchall():
+            conflicts.append({
+                'machine_number': machine_number,
+                'plans': [
+                    {'id': a_id, 'start_time': a_start.strftime('%Y-%m-%d %H:%M'),
+                     'end_time': a_end.strftime('%Y-%m-%d %H:%M')},
+                    {'id': b_id, 'start_time': b_start.strftime('%Y-%m-%d %H:%M'),
+                     'end_time': b_end.strftime('%Y-%m-%d %H:%M')}
+                ]
+            })
+        return conflicts
+
+
+def iter_ndjson_items(stream):
+    """Записи из тела NDJSON по одной на строку; пустые строки пропускаются"""
+    for raw_line in stream:
+        line = raw_line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def apply_plan_batch(conn, items, atomic=False, conflict_mode='warn'):
+    """
+    Пакетное создание и обновление записей плана.
+    Сначала проверяются все записи, затем корректные записываются двумя
+    командами execute_values в одной транзакции. Запись с полем id обновляет
+    существующую, без id - создает новую. Возвращает результаты в порядке
+    записей: {'index', 'success', 'id' | 'error', 'action'}; при пересечениях
+    расписания - также 'conflicts' (id батчей) и 'conflicts_with_index'.
+    В режиме strict пересекающиеся записи отклоняются, как в save_data.
+    Повтор id в пакете отклоняется со ссылкой на первую запись с этим id.
+    При atomic=True любая ошибка отменяет запись всего пакета.
+    """
+    results = []
+    creates = []
+    updates = []
+    # Первая запись пакета с каждым id; повтор сделал бы UPDATE ... FROM неоднозначным
+    id_indexes = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            results.append({'index': index, 'success': False, 'error': 'Запись должна быть JSON-объектом'})
+            continue
+        try:
+            plan = validate_plan(item)
+            plan_id = item.get('id')
+            if plan_id is not None:
+                plan_id = int(plan_id)
+                if plan_id <= 0:
+                    raise ValueError
+        except ValueError as e:
+            results.append({'index': index, 'success': False, 'error': str(e) or 'Неверный ID записи'})
+            continue
+        except TypeError:
+            results.append({'index': index, 'success': False, 'error': 'Неверный ID записи'})
+            continue
+        if plan_id:
+            first_index = id_indexes.setdefault(plan_id, index)
+            if first_index != index:
+                results.append({'index': index, 'success': False,
+                                'error': f'ID {plan_id} уже встречается в записи {first_index}'})
+                continue
+        result = {'index': index, 'success': True, 'action': 'updated' if plan_id else 'created'}
+        results.append(result)
+        if plan_id:
+            updates.append((result, plan_id, plan))
+        else:
+            creates.append((result, plan))
+
+    has_errors = any(not result['success'] for result in results)
+    if atomic and has_errors:
+        for result in results:
+            if result['success']:
+                result.update({'success': False, 'error': 'Пакет отклонен из-за ошибок в других записях'})
+                result.pop('action', None)
+        return results
+
+    cursor = conn.cursor()
+    try:
+        entries = [(result['index'], plan_id, plan) for result, plan_id, plan in updates]
+        entries += [(result['index'], None, plan) for result, plan in creates]
+        conflicts = find_bulk_conflicts(cursor, entries, conflict_mode) if entries else {}
+        for index, conflict in conflicts.items():
+            result = results[index]
+            if conflict_mode == 'strict':
+                result.update({'success': False, 'error': _conflict_message(conflict, 'Пересекается с записями пакета')})
+                result.pop('action', None)
+            result['conflicts'] = conflict['plan_ids']
+            result['conflicts_with_index'] = conflict['keys']
+        if conflict_mode == 'strict' and conflicts:
+            creates = [(result, plan) for result, plan in creates if result['success']]
+            updates = [(result, plan_id, plan) for result, plan_id, plan in updates if result['success']]
+
+        if creates:
+            # Порядок RETURNING совпадает с порядком строк в VALUES
+            inserted = execute_values(cursor, """
+            INSERT INTO production_plan (part_name, planned_quantity, machine_number, start_time, end_time)
+            VALUES %s
+            RETURNING id;
+            """, [
+                (plan['part_name'], plan['planned_quantity'], plan['machine_number'],
+                 plan['start_time'], plan['end_time'])
+                for _, plan in creates
+            ], page_size=len(creates), fetch=True)
+            for (result, _), (new_id,) in zip(creates, inserted):
+                result['id'] = new_id
+
+        if updates:
+            updated = execute_values(cursor, """
+            UPDATE production_plan pp
+            SET part_name = v.part_name,
+                planned_quantity = v.planned_quantity,
+                machine_number = v.machine_number,
+                start_time = v.start_time,
+                end_time = v.end_time
+            FROM (VALUES %s) AS v (id, part_name, planned_quantity, machine_number, start_time, end_time)
+            WHERE pp.id = v.id
+            RETURNING pp.id;
+            """, [
+                (plan_id, plan['part_name'], plan['planned_quantity'], plan['machine_number'],
+                 plan['start_time'], plan['end_time'])
+                for _, plan_id, plan in updates
+            ], template="(%s::integer, %s::varchar, %s::integer, %s::integer, %s::timestamp, %s::timestamp)",
+                page_size=len(updates), fetch=True)
+            updated_ids = {row[0] for row in updated}
+            for result, plan_id, _ in updates:
+                if plan_id in updated_ids:
+                    result['id'] = plan_id
+                else:
+                    result.update({'success': False, 'error': f'Запись с ID {plan_id} не найдена'})
+                    result.pop('action', None)
+
+        if atomic and any(not result['success'] for result in results):
+            conn.rollback()
+            for result in results:
+                if result['success']:
+                    result.update({'success': False, 'error': 'Пакет отклонен из-за ошибок в других записях'})
+                    result.pop('action', None)
+                    result.pop('id', None)
+            return results
+
+        conn.commit()
+    except (Exception, Error):
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    return results
+
+
+def _iter_csv_rows(stream):
+    """
+    Строки CSV-файла: (номер строки файла, словарь); разделитель ',' или ';'
+    определяется по заголовку. Пустые строки пропускаются, но учитываются в номерах.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    header_line = text.readline()
+    delimiter = ';' if header_line.count(';') > header_line.count(',') else ','
+    reader = csv.DictReader(itertools.chain([header_line], text), delimiter=delimiter)
+    for row in reader:
+        yield reader.line_num, {key.strip().lower(): value for key, value in row.items() if key}
+
+
+def _iter_xlsx_rows(stream):
+    """
+    Строки первого листа XLSX: (номер строки листа, словарь); файл читается
+    в потоковом режиме. Пустые строки пропускаются, но учитываются в номерах.
+    """
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError('Для импорта XLSX требуется пакет openpyxl')
+
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        keys = [str(cell).strip().lower() if cell is not None else '' for cell in header]
+        # Строка 1 - заголовок
+        for line_no, values in enumerate(rows, start=2):
+            if values is None or all(value is None for value in values):
+                continue
+            yield line_no, {key: value for key, value in zip(keys, values) if key}
+    finally:
+        workbook.close()
+
+
+def iter_plan_rows(stream, file_format):
+    if file_format == 'csv':
+        return _iter_csv_rows(stream)
+    if file_format == 'xlsx':
+        return _iter_xlsx_rows(stream)
+    raise ValueError(f'Неподдерживаемый формат файла: {file_format}')
+
+
+def detect_format(filename):
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension in ('.csv', '.txt'):
+        return 'csv'
+    if extension in ('.xlsx', '.xlsm'):
+        return 'xlsx'
+    raise ValueError('Поддерживаются только файлы CSV и XLSX')
+
+
+def _copy_chunk(cursor, chunk):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for line_no, plan_id, plan in chunk:
+        writer.writerow([
+            line_no,
+            plan_id if plan_id is not None else '',
+            plan['part_name'],
+            plan['planned_quantity'],
+            plan['machine_number'],
+            plan['start_time'].isoformat(),
+            plan['end_time'].isoformat()
+        ])
+    buffer.seek(0)
+    cursor.copy_expert(
+        "COPY plan_import_staging (line_no, id, part_name, planned_quantity, machine_number, "
+        "start_time, end_time) FROM STDIN WITH (FORMAT csv)",
+        buffer
+    )
+
+
+def _parse_import_id(value):
+    """id записи из ячейки файла: пусто - новая запись"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError('ID должен быть целым числом')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError('ID должен быть целым числом')
+
+
+def import_plans(conn, rows, conflict_mode='warn'):
+    """
+    Загрузка записей плана из пар (номер строки, словарь), см. iter_plan_rows.
+    Строки с id обновляют существующие записи, остальные добавляются.
+    Некорректные строки и повторы id пропускаются и попадают в отчет об
+    ошибках; корректные загружаются одной транзакцией. Строки, пересекающиеся
+    с расписанием станка или друг с другом, в режиме strict тоже считаются
+    ошибками, в режиме warn загружаются и перечисляются в conflicts.
+    """
+    report = {
+        'rows': 0, 'inserted': 0, 'updated': 0, 'error_count': 0, 'errors': [],
+        'conflict_count': 0, 'conflicts': []
+    }
+
+    def add_error(line_no, message):
+        report['error_count'] += 1
+        if len(report['errors']) < IMPORT_MAX_ERRORS:
+            report['errors'].append({'line': line_no, 'error': message})
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+        CREATE TEMP TABLE plan_import_staging (
+            line_no INTEGER NOT NULL,
+            id INTEGER,
+            part_name VARCHAR(255) NOT NULL,
+            planned_quantity INTEGER NOT NULL,
+            machine_number INTEGER NOT NULL,
+            start_time TIMESTAMP NOT NULL,
+            end_time TIMESTAMP NOT NULL
+        ) ON COMMIT DROP;
+        """)
+
+        chunk = []
+        # Первая строка файла с каждым id; повтор сделал бы UPDATE ... FROM неоднозначным
+        id_lines = {}
+        for line_no, row in rows:
+            report['rows'] += 1
+            try:
+                plan = validate_plan(row)
+                plan_id = _parse_import_id(row.get('id'))
+            except ValueError as e:
+                add_error(line_no, str(e))
+                continue
+            if plan_id is not None:
+                first_line = id_lines.setdefault(plan_id, line_no)
+                if first_line != line_no:
+                    add_error(line_no, f'ID {plan_id} уже встречается в строке {first_line}')
+                    continue
+            chunk.append((line_no, plan_id, plan))
+            if len(chunk) >= IMPORT_CHUNK_ROWS:
+                _copy_chunk(cursor, chunk)
+                chunk = []
+        if chunk:
+            _copy_chunk(cursor, chunk)
+
+        cursor.execute("""
+        SELECT s.line_no, s.id
+        FROM plan_import_staging s
+        WHERE s.id IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM production_plan pp WHERE pp.id = s.id)
+        ORDER BY s.line_no;
+        """)
+        for line_no, plan_id in cursor.fetchall():
+            add_error(line_no, f'Запись с ID {plan_id} не найдена')
+
+        if conflict_mode == 'strict':
+            cursor.execute("SELECT DISTINCT machine_number FROM plan_import_staging;")
+            _lock_machine_schedules(cursor, [row[0] for row in cursor.fetchall()])
+        cursor.execute(BULK_CONFLICTS_QUERY.format(
+            source="SELECT line_no, id, machine_number, start_time, end_time FROM plan_import_staging"
+        ))
+        conflicts = _group_bulk_conflicts(cursor.fetchall())
+        for line_no, conflict in conflicts.items():
+            if conflict_mode == 'strict':
+                add_error(line_no, _conflict_message(conflict, 'Пересекается со строками файла'))
+                continue
+            report['conflict_count'] += 1
+            if len(report['conflicts']) < IMPORT_MAX_ERRORS:
+                report['conflicts'].append({
+                    'line': line_no,
+                    'plan_ids': conflict['plan_ids'],
+                    'conflicts_with_lines': conflict['keys']
+                })
+        if conflict_mode == 'strict' and conflicts:
+            cursor.execute("DELETE FROM plan_import_staging WHERE line_no = ANY(%s);", (list(conflicts),))
+
+        cursor.execute("""
+        UPDATE production_plan pp
+        SET part_name = s.part_name,
+            planned_quantity = s.planned_quantity,
+            machine_number = s.machine_number,
+            start_time = s.start_time,
+            end_time = s.end_time
+        FROM plan_import_staging s
+        WHERE s.id IS NOT NULL AND pp.id = s.id;
+        """)
+        report['updated'] = cursor.rowcount
+
+        cursor.execute("""
+        INSERT INTO production_plan (part_name, planned_quantity, machine_number, start_time, end_time)
+        SELECT part_name, planned_quantity, machine_number, start_time, end_time
+        FROM plan_import_staging
+        WHERE id IS NULL
+        ORDER BY line_no;
+        """)
+        report['inserted'] = cursor.rowcount
+
+        conn.commit()
+    except (Exception, Error):
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    log_message(
+        f"SUCCESS: Импорт плана: строк {report['rows']}, добавлено {report['inserted']}, "
+        f"обновлено {report['updated']}, ошибок {report['error_count']}, пересечений {report['conflict_count']}"
+    )
+    return report
+
+
+plans_cli = AppGroup('plans', help='Операции с производственным планом')
+
+
+@plans_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'xlsx']), default=None,
+              help='Формат файла; по умолчанию определяется по расширению')
+@click.option('--conflict-mode', type=click.Choice(CONFLICT_MODES), default=None,
+              help='Пересечения расписания: strict - отклонять строки, warn - сообщать; по умолчанию PLAN_CONFLICT_MODE')
+def import_command(path, file_format, conflict_mode):
+    """Импортировать записи плана из CSV или XLSX файла"""
+    try:
+        file_format = file_format or detect_format(path)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    conflict_mode = conflict_mode or current_app.config['PLAN_CONFLICT_MODE']
+
+    conn = db.connect_direct()
+    try:
+        with open(path, 'rb') as stream:
+            report = import_plans(conn, iter_plan_rows(stream, file_format), conflict_mode)
+    except (ValueError, Error) as e:
+        raise click.ClickException(f"Ошибка импорта: {e}")
+    finally:
+        conn.close()
+
+    click.echo(
+        f"Строк: {report['rows']}, добавлено: {report['inserted']}, "
+        f"обновлено: {report['updated']}, ошибок: {report['error_count']}"
+    )
+    for error in report['errors']:
+        click.echo(f"  строка {error['line']}: {error['error']}", err=True)
+    if report['conflict_count']:
+        click.echo(f"Пересечений расписания: {report['conflict_count']}", err=True)
+        for conflict in report['conflicts']:
+            targets = [f"батч {plan_id}" for plan_id in conflict['plan_ids']]
+            targets += [f"строка {line}" for line in conflict['conflicts_with_lines']]
+            click.echo(f"  строка {conflict['line']}: {', '.join(targets)}", err=True)
@@ -0,0 +1,131 @@
+"""
+Учет SQL-запросов в рамках HTTP-запроса.
+
+Соединения пула создаются с курсором InstrumentedCursor, который замеряет
+каждый execute/executemany/copy_expert и накапливает в g количество
+запросов, суммарное время в базе и самый медленный запрос. По окончании
+запроса итоги отдаются в заголовке Server-Timing; запросы дольше
+SQL_SLOW_QUERY_MS пишутся в журнал с нормализованным текстом (значения
+параметров и литералы в журнал не попадают) и полями запроса.
+"""
+import os
+import re
+import time
+
+from flask import current_app, g, has_app_context, request
+from psycopg2 import extensions
+from psycopg2.sql import Composable
+
+from app_logging import log_message
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w\"$])\d+(?:\.\d+)?\b")
+_VALUE = r"\?(?:::\w+)?"
+_ROW = rf"\(\s*{_VALUE}(?:\s*,\s*{_VALUE})*\s*\)"
+_VALUES_LIST = re.compile(rf"{_ROW}(?:\s*,\s*{_ROW})+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def init_app(app):
+    """Настройки учета SQL-запросов и обработчики начала/конца запроса"""
+    # Порог записи запроса в журнал медленных запросов, миллисекунды
+    app.config.setdefault('SQL_SLOW_QUERY_MS', float(os.environ.get('SQL_SLOW_QUERY_MS', 200)))
+    # В режиме отладки предупреждать о запросах, выполнивших больше N SQL-команд
+    app.config.setdefault('SQL_QUERY_COUNT_WARNING', int(os.environ.get('SQL_QUERY_COUNT_WARNING', 30)))
+    app.config.setdefault('SQL_SERVER_TIMING', os.environ.get('SQL_SERVER_TIMING', '1') == '1')
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def normalize_sql(query):
+    """Текст запроса без параметров и литералов, в одну строку"""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    query = _STRING_LITERAL.sub('?', query)
+    query = _NUMBER_LITERAL.sub('?', query)
+    query = query.replace('%s', '?')
+    query = re.sub(r"%\(\w+\)s", '?', query)
+    # Многострочные VALUES (execute_values) сворачиваются в одну строку
+    query = _VALUES_LIST.sub('(?), ...', query)
+    return _WHITESPACE.sub(' ', query).strip()
+
+
+def _query_text(cursor, query):
+    if isinstance(query, Composable):
+        return query.as_string(cursor)
+    return query
+
+
+def _record(cursor, query, started):
+    duration = (time.perf_counter() - started) * 1000
+    if not has_app_context():
+        return
+    stats = g.get('sql_stats')
+    if stats is None:
+        return
+    stats['count'] += 1
+    stats['total_ms'] += duration
+    if duration > stats['slowest_ms']:
+        stats['slowest_ms'] = duration
+        stats['slowest_query'] = _query_text(cursor, query)
+
+    if duration >= current_app.config['SQL_SLOW_QUERY_MS']:
+        log_message(
+            "WARNING: Медленный SQL-запрос",
+            query_ms=round(duration, 1),
+            rowcount=cursor.rowcount,
+            query=normalize_sql(_query_text(cursor, query)),
+        )
+
+
+class InstrumentedCursor(extensions.cursor):
+    """Курсор, замеряющий время выполнения команд для текущего запроса"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            _record(self, query, started)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            _record(self, query, started)
+
+    def copy_expert(self, sql, file, size=8192):
+        started = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            _record(self, sql, started)
+
+
+def _start_request():
+    g.sql_stats = {'count': 0, 'total_ms': 0.0, 'slowest_ms': 0.0, 'slowest_query': None}
+    g.request_started = time.perf_counter()
+
+
+def _finish_request(response):
+    stats = g.get('sql_stats')
+    if stats is None:
+        return response
+    total_ms = (time.perf_counter() - g.request_started) * 1000
+
+    if current_app.config['SQL_SERVER_TIMING']:
+        metrics = [
+            f'db;desc="SQL x{stats["count"]}";dur={stats["total_ms"]:.1f}',
+            f'app;dur={max(total_ms - stats["total_ms"], 0):.1f}',
+        ]
+        if stats['slowest_query'] is not None:
+            metrics.append(f'db-slowest;dur={stats["slowest_ms"]:.1f}')
+        response.headers.add('Server-Timing', ', '.join(metrics))
+
+    if current_app.debug and stats['count'] > current_app.config['SQL_QUERY_COUNT_WARNING']:
+        log_message(
+            f"WARNING: {request.method} {request.path} выполнил {stats['count']} SQL-запросов "
+            f"за {stats['total_ms']:.1f} мс; самый медленный: {normalize_sql(stats['slowest_query'])}"
+        )
+    return response
@@ -0,0 +1,208 @@
+"""
+Сводная таблица production_rollup.
+
+Строка сводки соответствует ключу (день, смена, станок, деталь) и хранит
+плановое и фактическое количество, дефекты по типам и минуты по группам
+времени событий. Сводка поддерживается триггерами на production_plan,
+production и events в той же транзакции, что и изменение данных;
+миграция 6 заполняет ее существующими данными. Полная или частичная
+перестройка нужна только после записи в обход триггеров (flask seed).
+
+Границы смен хранятся в таблице rollup_settings - единственном источнике
+и для сводки, и для расчета OEE. Они меняются командой flask rollups
+shifts, которая в той же транзакции перестраивает сводку целиком.
+"""
+import click
+from flask.cli import AppGroup
+from psycopg2 import Error
+
+import db
+from app_logging import log_message
+
+ROLLUP_COLUMNS = (
+    'day', 'shift', 'machine_number', 'part_name', 'batches', 'planned_quantity',
+    'planned_minutes', 'reported_batches', 'actual_quantity', 'bubble_count',
+    'underfill_count', 'inclusion_count', 'defect_count', 'utilization_minutes',
+    'breakdown_minutes', 'planned_pause_minutes'
+)
+
+REBUILD_QUERY = """
+WITH plans AS (
+    SELECT pp.id, pp.machine_number, pp.part_name, pp.planned_quantity,
+           pp.start_time, pp.end_time, k.day, k.shift
+    FROM production_plan pp
+    CROSS JOIN LATERAL production_shift_key(pp.start_time) k
+    {plan_filter}
+),
+event_minutes AS (
+    SELECT e.batch,
+           SUM(EXTRACT(EPOCH FROM e."Фактические время конца события" - e."Фактические время начала события") / 60)
+               FILTER (WHERE e."Time_group" = 'Utilization hours') AS utilization,
+           SUM(EXTRACT(EPOCH FROM e."Фактические время конца события" - e."Фактические время начала события") / 60)
+               FILTER (WHERE e."Time_group" = 'Breakdown time') AS breakdown,
+           SUM(EXTRACT(EPOCH FROM e."Фактические время конца события" - e."Фактические время начала события") / 60)
+               FILTER (WHERE e."Time_group" = 'Planned pause time') AS planned_pause
+    FROM events e
+    JOIN plans ON plans.id = e.batch
+    GROUP BY e.batch
+)
+INSERT INTO production_rollup ({columns})
+SELECT plans.day, plans.shift, plans.machine_number, plans.part_name,
+       COUNT(*),
+       SUM(plans.planned_quantity),
+       SUM(EXTRACT(EPOCH FROM plans.end_time - plans.start_time) / 60),
+       COUNT(p.id),
+       COALESCE(SUM(p.actual_quantity), 0),
+       COALESCE(SUM(p.bubble_count), 0),
+       COALESCE(SUM(p.underfill_count), 0),
+       COALESCE(SUM(p.inclusion_count), 0),
+       COALESCE(SUM(p.defect_count), 0),
+       COALESCE(SUM(em.utilization), 0),
+       COALESCE(SUM(em.breakdown), 0),
+       COALESCE(SUM(em.planned_pause), 0)
+FROM plans
+LEFT JOIN production p ON p.order_id = plans.id
+LEFT JOIN event_minutes em ON em.batch = plans.id
+GROUP BY plans.day, plans.shift, plans.machine_number, plans.part_name;
+"""
+
+
+def get_shift_settings(cursor):
+    """Час начала первой смены и длительность смены, часы"""
+    cursor.execute("SELECT shift_start_hour, shift_hours FROM rollup_settings;")
+    return cursor.fetchone()
+
+
+def rebuild_rollups(conn, day_from=None, day_to=None, shift_settings=None):
+    """
+    Перестройка сводки по исходным таблицам за дни [day_from, day_to]
+    (включительно) или целиком. На время перестройки запись в исходные
+    таблицы блокируется, чтобы триггеры не разошлись с пересчетом.
+    shift_settings - новые (час начала, длительность) смен; если они
+    отличаются от текущих, сводка перестраивается целиком.
+    Возвращает количество записанных строк сводки.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("LOCK TABLE production_plan, production, events IN SHARE MODE;")
+
+        if shift_settings is not None:
+            cursor.execute("""
+            UPDATE rollup_settings
+            SET shift_start_hour = %s, shift_hours = %s
+            WHERE (shift_start_hour, shift_hours) IS DISTINCT FROM (%s, %s);
+            """, (*shift_settings, *shift_settings))
+            if cursor.rowcount and (day_from or day_to):
+                # Со сменой границ смен меняются ключи всех строк
+                day_from = day_to = None
+                log_message("WARNING: Настройки смен изменились, сводка будет перестроена целиком")
+
+        conditions = []
+        params = []
+        if day_from:
+            # Условие по start_time с запасом в сутки позволяет использовать индекс
+            conditions.append("pp.start_time >= %s::date - 1 AND k.day >= %s")
+            params.extend([day_from, day_from])
+        if day_to:
+            conditions.append("pp.start_time < %s::date + 2 AND k.day <= %s")
+            params.extend([day_to, day_to])
+
+        delete_conditions = []
+        delete_params = []
+        if day_from:
+            delete_conditions.append("day >= %s")
+            delete_params.append(day_from)
+        if day_to:
+            delete_conditions.append("day <= %s")
+            delete_params.append(day_to)
+
+        if delete_conditions:
+            cursor.execute("DELETE FROM production_rollup WHERE " + " AND ".join(delete_conditions), delete_params)
+        else:
+            cursor.execute("TRUNCATE production_rollup;")
+
+        cursor.execute(REBUILD_QUERY.format(
+            plan_filter="WHERE " + " AND ".join(conditions) if conditions else '',
+            columns=', '.join(ROLLUP_COLUMNS)
+        ), params)
+        written = cursor.rowcount
+        conn.commit()
+    except (Exception, Error):
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    log_message(f"SUCCESS: Сводка production_rollup перестроена, строк: {written}")
+    return written
+
+
+def query_rollups(conn, day_from, day_to, machines=None):
+    """Строки сводки за дни [day_from, day_to] включительно"""
+    conditions = ["day BETWEEN %s AND %s"]
+    params = [day_from, day_to]
+    if machines:
+        conditions.append("machine_number = ANY(%s)")
+        params.append(list(machines))
+
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {', '.join(ROLLUP_COLUMNS)} FROM production_rollup "
+            f"WHERE {' AND '.join(conditions)} "
+            "ORDER BY day, shift, machine_number, part_name;",
+            params
+        )
+        rows = []
+        for record in cursor.fetchall():
+            row = dict(zip(ROLLUP_COLUMNS, record))
+            row['day'] = row['day'].isoformat()
+            for key in ('planned_minutes', 'utilization_minutes', 'breakdown_minutes', 'planned_pause_minutes'):
+                row[key] = round(float(row[key]), 1)
+            rows.append(row)
+        return rows
+
+
+rollups_cli = AppGroup('rollups', help='Сводные таблицы для отчетов')
+
+
+@rollups_cli.command('rebuild')
+@click.option('--from', 'day_from', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Первый день перестройки (YYYY-MM-DD)')
+@click.option('--to', 'day_to', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help='Последний день перестройки (YYYY-MM-DD)')
+def rebuild_command(day_from, day_to):
+    """Перестроить сводку production_rollup по исходным данным"""
+    conn = db.connect_direct()
+    try:
+        written = rebuild_rollups(
+            conn,
+            day_from.date() if day_from else None,
+            day_to.date() if day_to else None
+        )
+    except Error as e:
+        raise click.ClickException(f"Ошибка перестройки сводки: {e}")
+    finally:
+        conn.close()
+    click.echo(f"Строк сводки записано: {written}")
+
+
+@rollups_cli.command('shifts')
+@click.option('--start-hour', type=click.IntRange(0, 23), default=None, help='Час начала первой смены')
+@click.option('--hours', type=click.IntRange(1, 24), default=None, help='Длительность смены, часы')
+def shifts_command(start_hour, hours):
+    """Показать или изменить границы смен (для сводки и OEE)"""
+    conn = db.connect_direct()
+    try:
+        with conn.cursor() as cursor:
+            current = get_shift_settings(cursor)
+        conn.rollback()
+        if start_hour is None and hours is None:
+            click.echo(f"Начало первой смены: {current[0]}:00, длительность смены: {current[1]} ч")
+            return
+        settings = (current[0] if start_hour is None else start_hour, current[1] if hours is None else hours)
+        written = rebuild_rollups(conn, shift_settings=settings)
+    except Error as e:
+        raise click.ClickException(f"Ошибка изменения смен: {e}")
+    finally:
+        conn.close()
+    click.echo(f"Смены: начало {settings[0]}:00, длительность {settings[1]} ч; строк сводки записано: {written}")
@@ -0,0 +1,384 @@
+"""
+Автоматическое планирование батчей по станкам.
+
+Производительность (штук в минуту) по паре деталь/станок берется из истории
+отчетов production; если по паре истории нет, используется средняя по
+детали, а затем плановая производительность из production_plan.
+
+Планировщик списочный: батчи извлекаются из очереди с приоритетом
+(приоритет, затем самые длинные первыми) и ставятся на тот станок, где
+они закончатся раньше всего. Существующие батчи production_plan занимают
+станок целиком, плановые паузы батч "перешагивает" - его окончание
+сдвигается на длительность паузы.
+"""
+import heapq
+import math
+import os
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+import plans
+
+RATES_QUERY = """
+SELECT pp.part_name, pp.machine_number,
+       SUM(pr.actual_quantity) AS quantity,
+       SUM(EXTRACT(EPOCH FROM pr.actual_end_time - pr.actual_start_time) / 60) AS minutes
+FROM production pr
+JOIN production_plan pp ON pp.id = pr.order_id
+WHERE pr.actual_end_time > pr.actual_start_time
+  AND pr.actual_start_time >= %s
+GROUP BY pp.part_name, pp.machine_number;
+"""
+
+PLANNED_RATES_QUERY = """
+SELECT part_name, machine_number,
+       SUM(planned_quantity) AS quantity,
+       SUM(EXTRACT(EPOCH FROM end_time - start_time) / 60) AS minutes
+FROM production_plan
+WHERE start_time >= %s
+GROUP BY part_name, machine_number;
+"""
+
+BOOKINGS_QUERY = """
+SELECT machine_number, start_time, end_time
+FROM production_plan
+WHERE end_time > %s AND start_time < %s
+  {machine_filter}
+ORDER BY machine_number, start_time;
+"""
+
+PAUSES_QUERY = """
+SELECT pp.machine_number, e."Фактические время начала события", e."Фактические время конца события"
+FROM events e
+JOIN production_plan pp ON pp.id = e.batch
+WHERE e."Time_group" = 'Planned pause time'
+  AND e."Фактические время конца события" > %s
+  AND e."Фактические время начала события" < %s
+  {machine_filter};
+"""
+
+
+def init_app(app):
+    """Настройки планировщика"""
+    # За сколько дней истории считать производительность станков
+    app.config.setdefault('SCHEDULER_RATE_LOOKBACK_DAYS', int(os.environ.get('SCHEDULER_RATE_LOOKBACK_DAYS', 180)))
+    # Горизонт планирования; батчи, не помещающиеся в него, не планируются
+    app.config.setdefault('SCHEDULER_HORIZON_DAYS', int(os.environ.get('SCHEDULER_HORIZON_DAYS', 60)))
+    # Ежедневные плановые паузы, например "12:00-12:30,00:00-00:30"
+    app.config.setdefault('SCHEDULER_DAILY_PAUSES', os.environ.get('SCHEDULER_DAILY_PAUSES', ''))
+
+
+def _merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class MachineTimeline:
+    """Занятость одного станка: батчи (непрерываемые) и плановые паузы"""
+
+    def __init__(self, machine_number, bookings, pauses):
+        self.machine_number = machine_number
+        merged = _merge(bookings)
+        self.busy_starts = [start for start, _ in merged]
+        self.busy_ends = [end for _, end in merged]
+        merged_pauses = _merge(pauses)
+        self.pause_starts = [start for start, _ in merged_pauses]
+        self.pause_ends = [end for _, end in merged_pauses]
+        self.booked_minutes = 0
+
+    def _skip_pause(self, moment):
+        index = bisect_right(self.pause_starts, moment) - 1
+        if index >= 0 and self.pause_ends[index] > moment:
+            return self.pause_ends[index]
+        return moment
+
+    def _advance(self, moment, minutes):
+        """Момент окончания работы длительностью minutes с учетом пауз"""
+        remaining = timedelta(minutes=minutes)
+        current = moment
+        index = bisect_right(self.pause_ends, current)
+        while index < len(self.pause_starts) and self.pause_starts[index] < current + remaining:
+            if self.pause_starts[index] > current:
+                remaining -= self.pause_starts[index] - current
+            current = max(current, self.pause_ends[index])
+            index += 1
+        return current + remaining
+
+    def first_free(self, not_before):
+        """Первый момент не раньше not_before, когда станок не занят батчем или паузой"""
+        moment = not_before
+        index = bisect_right(self.busy_ends, moment)
+        if index < len(self.busy_starts) and self.busy_starts[index] <= moment:
+            moment = self.busy_ends[index]
+        return self._skip_pause(moment)
+
+    def earliest_slot(self, not_before, minutes, horizon_end):
+        """Самый ранний интервал (начало, конец) для батча, либо None за горизонтом"""
+        moment = not_before
+        index = bisect_right(self.busy_ends, moment)
+        while moment < horizon_end:
+            moment = self._skip_pause(moment)
+            if index < len(self.busy_starts) and self.busy_starts[index] <= moment:
+                moment = max(moment, self.busy_ends[index])
+                index += 1
+                continue
+            end = self._advance(moment, minutes)
+            if index >= len(self.busy_starts) or end <= self.busy_starts[index]:
+                return (moment, end) if end <= horizon_end else None
+            moment = self.busy_ends[index]
+            index += 1
+        return None
+
+    def book(self, start, end):
+        """
+        Занятие интервала. Батч, примыкающий к соседнему занятому интервалу
+        (или отделенный от него только паузой), сливается с ним: батчи
+        ставятся в самое раннее время, поэтому список занятости не растет, и
+        earliest_slot не перебирает уже заполненное начало горизонта.
+        """
+        self.booked_minutes += (end - start).total_seconds() / 60
+        index = bisect_right(self.busy_starts, start)
+        if index > 0 and self._skip_pause(self.busy_ends[index - 1]) >= start:
+            index -= 1
+            start = self.busy_starts.pop(index)
+            end = max(end, self.busy_ends.pop(index))
+        if index < len(self.busy_starts) and self._skip_pause(end) >= self.busy_starts[index]:
+            self.busy_starts.pop(index)
+            end = max(end, self.busy_ends.pop(index))
+        self.busy_starts.insert(index, start)
+        self.busy_ends.insert(index, end)
+
+
+def _daily_pauses(spec, horizon_start, horizon_end):
+    """Интервалы ежедневных пауз вида '12:00-12:30' на горизонте планирования"""
+    intervals = []
+    if not spec:
+        return intervals
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            start_text, end_text = item.split('-')
+            start = datetime.strptime(start_text.strip(), '%H:%M').time()
+            end = datetime.strptime(end_text.strip(), '%H:%M').time()
+        except ValueError:
+            raise ValueError(f"Неверный формат ежедневной паузы: {item}. Используйте HH:MM-HH:MM")
+        day = horizon_start.date() - timedelta(days=1)
+        while datetime.combine(day, start) < horizon_end:
+            pause_start = datetime.combine(day, start)
+            pause_end = datetime.combine(day, end)
+            if pause_end <= pause_start:
+                pause_end += timedelta(days=1)
+            intervals.append((pause_start, pause_end))
+            day += timedelta(days=1)
+    return intervals
+
+
+def load_rates(conn, since):
+    """
+    Производительность, шт/мин: {(деталь, станок): rate} и {деталь: rate}.
+    Фактические данные имеют приоритет над плановыми.
+    """
+    pair_rates = {}
+    part_totals = {}
+    with conn.cursor() as cursor:
+        for query, source in ((PLANNED_RATES_QUERY, 'plan'), (RATES_QUERY, 'actual')):
+            cursor.execute(query, (since,))
+            source_totals = {}
+            for part_name, machine_number, quantity, minutes in cursor.fetchall():
+                if not quantity or not minutes or minutes <= 0:
+                    continue
+                # Фактическая производительность перезаписывает плановую
+                pair_rates[(part_name, machine_number)] = float(quantity) / float(minutes)
+                totals = source_totals.setdefault(part_name, [0.0, 0.0])
+                totals[0] += float(quantity)
+                totals[1] += float(minutes)
+            part_totals.update(source_totals)
+    part_rates = {part: quantity / minutes for part, (quantity, minutes) in part_totals.items()}
+    return pair_rates, part_rates
+
+
+def _load_timelines(conn, machines, horizon_start, horizon_end, extra_pauses, daily_pauses):
+    machine_filter = 'AND machine_number = ANY(%s)'
+    bookings = {machine: [] for machine in machines}
+    pauses = {machine: list(daily_pauses) for machine in machines}
+    with conn.cursor() as cursor:
+        cursor.execute(BOOKINGS_QUERY.format(machine_filter=machine_filter),
+                       (horizon_start, horizon_end, list(machines)))
+        for machine_number, start, end in cursor.fetchall():
+            bookings[machine_number].append((start, end))
+        cursor.execute(PAUSES_QUERY.format(machine_filter='AND pp.machine_number = ANY(%s)'),
+                       (horizon_start, horizon_end, list(machines)))
+        for machine_number, start, end in cursor.fetchall():
+            pauses[machine_number].append((start, end))
+    for pause in extra_pauses:
+        targets = [pause['machine_number']] if pause.get('machine_number') else machines
+        for machine in targets:
+            if machine in pauses:
+                pauses[machine].append((pause['start'], pause['end']))
+    return {machine: MachineTimeline(machine, bookings[machine], pauses[machine]) for machine in machines}
+
+
+def _parse_time(value, field):
+    try:
+        return datetime.strptime(value, '%Y-%m-%dT%H:%M')
+    except (TypeError, ValueError):
+        raise ValueError(f"Неверный формат {field}. Используйте YYYY-MM-DDTHH:MM")
+
+
+def parse_request(data):
+    """Проверка тела запроса планировщика; ValueError с сообщением для пользователя"""
+    if not isinstance(data, dict):
+        raise ValueError('Ожидается JSON-объект')
+    batches = data.get('batches')
+    if not isinstance(batches, list) or not batches:
+        raise ValueError('Список batches не может быть пустым')
+
+    parsed = []
+    for index, batch in enumerate(batches):
+        if not isinstance(batch, dict):
+            raise ValueError(f'Батч {index}: ожидается JSON-объект')
+        part_name = str(batch.get('part_name') or '').strip()
+        if not part_name:
+            raise ValueError(f'Батч {index}: Part name не может быть пустым')
+        try:
+            quantity = int(batch.get('quantity'))
+            priority = int(batch.get('priority', 0))
+        except (TypeError, ValueError):
+            raise ValueError(f'Батч {index}: quantity и priority должны быть числами')
+        if quantity <= 0:
+            raise ValueError(f'Батч {index}: quantity должен быть положительным числом')
+        parsed.append({'index': index, 'part_name': part_name, 'quantity': quantity, 'priority': priority})
+
+    if data.get('start'):
+        start = _parse_time(data['start'], 'start')
+    else:
+        start = datetime.now()
+    # Планы хранятся с точностью до минуты
+    if start.second or start.microsecond:
+        start = start.replace(second=0, microsecond=0) + timedelta(minutes=1)
+
+    machines = data.get('machines') or []
+    try:
+        machines = sorted({int(machine) for machine in machines})
+    except (TypeError, ValueError):
+        raise ValueError('machines должен быть списком номеров станков')
+
+    pauses = []
+    for pause in data.get('pauses') or []:
+        pause_start = _parse_time(pause.get('start'), 'start паузы')
+        pause_end = _parse_time(pause.get('end'), 'end паузы')
+        if pause_end <= pause_start:
+            raise ValueError('Окончание паузы должно быть позже начала')
+        pauses.append({'machine_number': pause.get('machine_number'), 'start': pause_start, 'end': pause_end})
+
+    return parsed, start, machines, pauses
+
+
+def build_schedule(conn, batches, start, machines=None, pauses=()):
+    """
+    Расчет расписания без записи в базу. Батчи с меньшим значением
+    priority планируются раньше; при равном приоритете - более длинные.
+    Возвращает {'plans': [...], 'unscheduled': [...], 'machines': [...]}.
+    """
+    config = current_app.config
+    horizon_end = start + timedelta(days=config['SCHEDULER_HORIZON_DAYS'])
+    since = start - timedelta(days=config['SCHEDULER_RATE_LOOKBACK_DAYS'])
+    pair_rates, part_rates = load_rates(conn, since)
+
+    if not machines:
+        machines = sorted({machine for _, machine in pair_rates})
+    daily = _daily_pauses(config['SCHEDULER_DAILY_PAUSES'], start, horizon_end)
+    timelines = _load_timelines(conn, machines, start, horizon_end, pauses, daily)
+
+    def rate_for(part_name, machine):
+        return pair_rates.get((part_name, machine)) or part_rates.get(part_name)
+
+    queue = []
+    unscheduled = []
+    for batch in batches:
+        rates = [rate for rate in (rate_for(batch['part_name'], m) for m in machines) if rate]
+        if not rates:
+            unscheduled.append({**batch, 'reason': 'Нет данных о производительности для детали'})
+            continue
+        longest = batch['quantity'] / min(rates)
+        heapq.heappush(queue, (batch['priority'], -longest, batch['index'], batch))
+
+    planned = []
+    while queue:
+        _, _, _, batch = heapq.heappop(queue)
+        # Окончание не раньше первого свободного момента плюс длительность:
+        # станки перебираются по этой оценке, и перебор останавливается,
+        # когда оценка становится позже лучшего найденного окончания
+        candidates = []
+        for order, machine in enumerate(machines):
+            rate = rate_for(batch['part_name'], machine)
+            if not rate:
+                continue
+            minutes = math.ceil(batch['quantity'] / rate)
+            bound = timelines[machine].first_free(start) + timedelta(minutes=minutes)
+            candidates.append((bound, order, machine, minutes))
+        candidates.sort()
+
+        best = None
+        for bound, order, machine, minutes in candidates:
+            if best is not None and bound > best[0][0]:
+                break
+            slot = timelines[machine].earliest_slot(start, minutes, horizon_end)
+            # При равном окончании выбирается станок, идущий раньше в списке
+            if slot is not None and (best is None or (slot[1], order) < best[0]):
+                best = ((slot[1], order), machine, slot)
+        if best is None:
+            unscheduled.append({**batch, 'reason': 'Батч не помещается в горизонт планирования'})
+            continue
+        _, machine, (slot_start, slot_end) = best
+        timelines[machine].book(slot_start, slot_end)
+        planned.append({
+            'index': batch['index'],
+            'part_name': batch['part_name'],
+            'planned_quantity': batch['quantity'],
+            'machine_number': machine,
+            'start_time': slot_start.strftime('%Y-%m-%dT%H:%M'),
+            'end_time': slot_end.strftime('%Y-%m-%dT%H:%M')
+        })
+
+    planned.sort(key=lambda plan: (plan['start_time'], plan['machine_number']))
+    unscheduled.sort(key=lambda batch: batch['index'])
+    machine_summary = [
+        {'machine_number': machine, 'scheduled_minutes': round(timelines[machine].booked_minutes)}
+        for machine in machines
+    ]
+    return {'plans': planned, 'unscheduled': unscheduled, 'machines': machine_summary}
+
+
+def commit_schedule(conn, items):
+    """
+    Запись предварительно рассчитанного расписания в production_plan.
+    Расписание станков блокируется, и если за время после предпросмотра
+    кто-то занял интервалы, ничего не записывается.
+    Возвращает (results, conflicts); при конфликтах results пуст.
+    """
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise ValueError(f'Запись {index} должна быть JSON-объектом')
+        plans.validate_plan(item)
+
+    # Пересечения с базой и внутри пакета проверяются одним запросом под блокировками станков
+    results = plans.apply_plan_batch(conn, items, atomic=True, conflict_mode='strict')
+    conflicts = [
+        {'index': result['index'], 'plan_ids': result['conflicts'],
+         'conflicts_with_index': result['conflicts_with_index']}
+        for result in results if 'conflicts' in result
+    ]
+    if conflicts:
+        return [], conflicts
+    return results, []
@@ -0,0 +1,369 @@
+"""
+Генератор синтетических данных завода для нагрузочных тестов: flask seed.
+
+Данные строятся по производственным суткам (от начала первой смены до
+начала первой смены следующего дня): для каждого станка - цепочка
+батчей без пересечений с заданной плотностью загрузки, для большинства
+батчей - отчет о производстве с правдоподобным распределением дефектов
+и последовательность непересекающихся событий (работа, плановые паузы,
+поломки) внутри фактического интервала батча.
+
+Генерация детерминирована: содержимое суток зависит только от seed и
+номера суток, поэтому результат не зависит от числа процессов. Запись
+идет в два прохода: сначала процессы считают строки каждых суток, чтобы
+заранее раздать плотные диапазоны id по порядку времени, затем каждые
+сутки записываются командой COPY отдельной транзакцией.
+
+Транзакции записи идут с session_replication_role = replica: триггеры
+сводки и журнала изменений (и проверки внешних ключей - id раздаются
+согласованно) пропускаются только в сессиях генератора, записи
+приложения в это время обрабатываются как обычно. Нужны права
+суперпользователя или SET на этот параметр. Сводка production_rollup
+перестраивается по итогам, а журнал plan_changes объявляется очищенным,
+чтобы клиенты синхронизации перезагрузили данные целиком.
+"""
+import io
+import math
+import multiprocessing
+import os
+import random
+from datetime import datetime, time, timedelta
+
+import click
+import psycopg2
+from psycopg2 import Error
+
+import db
+import rollups
+from app_logging import log_message
+
+PLAN_COLUMNS = ('id', 'part_name', 'planned_quantity', 'machine_number', 'start_time', 'end_time')
+REPORT_COLUMNS = (
+    'id', 'order_id', 'part_number', 'actual_quantity', 'bubble_count', 'underfill_count',
+    'inclusion_count', 'defect_count', 'actual_start_time', 'actual_end_time'
+)
+EVENT_COLUMNS = (
+    'event_id', 'event_name', 'batch', '"Фактические время начала события"',
+    '"Фактические время конца события"', '"Time_group"', 'responsible'
+)
+
+BREAKDOWNS = (
+    ('Поломка пресс-формы', 'DMNTC'),
+    ('Отказ термопластавтомата', 'FMNTC'),
+    ('Отказ робота-съемника', 'FMNTC'),
+    ('Нет сырья', 'Production'),
+    ('Корректировка техпроцесса', 'Engineering'),
+)
+PAUSES = ('Переналадка', 'Обед', 'Плановое ТО', 'Замена сырья')
+
+MIN_BATCH_MINUTES = 30
+MAX_BATCH_MINUTES = 8 * 60
+
+
+def part_name(number):
+    return f"Деталь {number:04d}"
+
+
+def _part_profile(settings, number):
+    """Время цикла, средняя доля брака и веса типов дефектов детали"""
+    rng = random.Random(f"{settings['seed']}:part:{number}")
+    return {
+        'cycle_seconds': rng.uniform(15, 120),
+        'defect_rate': min(rng.lognormvariate(math.log(0.02), 0.6), 0.2),
+        'defect_weights': (rng.uniform(0.5, 3), rng.uniform(0.5, 3), rng.uniform(0.2, 1.5)),
+    }
+
+
+def _machine_parts(settings, machine):
+    """Номенклатура станка: несколько деталей, между которыми он переналаживается"""
+    rng = random.Random(f"{settings['seed']}:machine:{machine}")
+    count = min(settings['parts'], rng.randint(3, 8))
+    return rng.sample(range(1, settings['parts'] + 1), count)
+
+
+def _minutes(value):
+    return timedelta(minutes=max(1, round(value)))
+
+
+def _events(rng, start, end):
+    """Непересекающиеся события фактического интервала: работа, чередующаяся с паузами и поломками"""
+    events = []
+    cursor = start
+    while cursor < end:
+        finish = min(cursor + _minutes(rng.expovariate(1 / 90)), end)
+        events.append(('Работа', cursor, finish, 'Utilization hours', None))
+        cursor = finish
+        if cursor >= end:
+            break
+        if rng.random() < 0.15:
+            name, responsible = rng.choice(BREAKDOWNS)
+            finish = min(cursor + _minutes(rng.lognormvariate(math.log(20), 0.7)), end)
+            events.append((name, cursor, finish, 'Breakdown time', responsible))
+        else:
+            finish = min(cursor + _minutes(rng.uniform(5, 30)), end)
+            events.append((rng.choice(PAUSES), cursor, finish, 'Planned pause time', 'Production'))
+        cursor = finish
+    return events
+
+
+def _report(rng, profile, planned_quantity, start, end, day_start, machine, lot):
+    """Отчет о производстве и события батча"""
+    actual_start = start + timedelta(minutes=rng.randint(0, 15))
+    actual_end = max(end + timedelta(minutes=rng.randint(-10, 20)), actual_start + timedelta(minutes=5))
+    events = _events(rng, actual_start, actual_end)
+
+    planned_minutes = (end - start).total_seconds() / 60
+    utilization = sum((e[2] - e[1]).total_seconds() / 60 for e in events if e[3] == 'Utilization hours')
+    actual_quantity = max(1, int(planned_quantity * min(1.02, utilization / planned_minutes * rng.uniform(0.97, 1.03))))
+
+    # Доля брака партии колеблется вокруг средней по детали; изредка - бракованная партия
+    rate = profile['defect_rate'] * rng.lognormvariate(0, 0.4)
+    if rng.random() < 0.03:
+        rate *= 4
+    rate = min(rate, 0.5)
+    mean = actual_quantity * rate
+    defects = min(actual_quantity, max(0, round(rng.gauss(mean, math.sqrt(mean * (1 - rate)) if mean else 0))))
+
+    shares = [rng.gammavariate(weight, 1) for weight in profile['defect_weights']]
+    total = sum(shares)
+    bubble = round(defects * shares[0] / total)
+    underfill = min(defects - bubble, round(defects * shares[1] / total))
+    inclusion = defects - bubble - underfill
+
+    report = (
+        f"L{day_start:%y%m%d}-{machine:03d}-{lot:02d}", actual_quantity, bubble, underfill,
+        inclusion, defects, actual_start, actual_end
+    )
+    return report, events
+
+
+def generate_day(settings, day_index):
+    """
+    Батчи производственных суток day_index по порядку начала:
+    список (строка плана, отчет или None, события).
+    """
+    day_start = settings['start'] + timedelta(days=day_index)
+    day_end = day_start + timedelta(days=1)
+    density = settings['density']
+    batch_minutes = settings['batch_minutes']
+    mean_gap = batch_minutes * (1 - density) / density
+
+    profiles = {}
+    batches = []
+    for machine in range(1, settings['machines'] + 1):
+        rng = random.Random(f"{settings['seed']}:{day_index}:{machine}")
+        machine_parts = _machine_parts(settings, machine)
+        part = rng.choice(machine_parts)
+        cursor = day_start + _minutes(rng.uniform(0, mean_gap)) if mean_gap else day_start
+        lot = 0
+        while True:
+            duration = min(max(rng.lognormvariate(math.log(batch_minutes), 0.35), MIN_BATCH_MINUTES), MAX_BATCH_MINUTES)
+            end = cursor + timedelta(minutes=5 * round(duration / 5))
+            if end > day_end:
+                break
+            # Чаще всего станок продолжает ту же деталь, иначе переналаживается
+            if rng.random() > 0.7:
+                part = rng.choice(machine_parts)
+            if part not in profiles:
+                profiles[part] = _part_profile(settings, part)
+            profile = profiles[part]
+            planned_quantity = max(1, int((end - cursor).total_seconds() / profile['cycle_seconds']))
+
+            report, events = None, []
+            if rng.random() < settings['report_ratio']:
+                lot += 1
+                report, events = _report(rng, profile, planned_quantity, cursor, end, day_start, machine, lot)
+            batches.append(((part_name(part), planned_quantity, machine, cursor, end), report, events))
+
+            cursor = end
+            if mean_gap:
+                cursor += timedelta(minutes=5 * round(rng.expovariate(1 / mean_gap) / 5))
+
+    batches.sort(key=lambda batch: (batch[0][3], batch[0][2]))
+    return batches
+
+
+def _count_day(args):
+    settings, day_index = args
+    batches = generate_day(settings, day_index)
+    return (
+        len(batches),
+        sum(1 for _, report, _ in batches if report),
+        sum(len(events) for _, _, events in batches),
+    )
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    value = str(value)
+    if '\\' in value or '\t' in value or '\n' in value:
+        value = value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+    return value
+
+
+def _copy(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def _write_day(args):
+    """Запись суток одной транзакцией с заранее выделенными диапазонами id"""
+    connect_params, settings, day_index, plan_id, report_id, event_id = args
+    plans, reports, events = [], [], []
+    for plan, report, batch_events in generate_day(settings, day_index):
+        plans.append((plan_id,) + plan)
+        if report:
+            reports.append((report_id, plan_id) + report)
+            report_id += 1
+        for event in batch_events:
+            events.append((event_id, event[0], plan_id) + event[1:])
+            event_id += 1
+        plan_id += 1
+
+    conn = psycopg2.connect(**connect_params)
+    try:
+        with conn.cursor() as cursor:
+            # Триггеры только этой транзакции: сводка пересчитывается целиком,
+            # а журнал изменений для миллионов строк не нужен
+            cursor.execute("SET LOCAL session_replication_role = replica;")
+            _copy(cursor, 'production_plan', PLAN_COLUMNS, plans)
+            _copy(cursor, 'production', REPORT_COLUMNS, reports)
+            _copy(cursor, 'events', EVENT_COLUMNS, events)
+        conn.commit()
+    finally:
+        conn.close()
+    return len(plans), len(reports), len(events)
+
+
+def _next_ids(cursor):
+    cursor.execute("""
+    SELECT (SELECT COALESCE(MAX(id), 0) + 1 FROM production_plan),
+           (SELECT COALESCE(MAX(id), 0) + 1 FROM production),
+           (SELECT COALESCE(MAX(event_id), 0) + 1 FROM events);
+    """)
+    return cursor.fetchone()
+
+
+def seed_database(conn, settings, workers, truncate=False, progress=None):
+    """
+    Генерация settings['days'] суток данных в workers процессах.
+    Возвращает (батчей, отчетов, событий).
+    """
+    days = range(settings['days'])
+    # spawn: дочерним процессам не достаются соединения и потоки процесса Flask
+    context = multiprocessing.get_context('spawn')
+
+    with conn.cursor() as cursor:
+        if truncate:
+            cursor.execute("TRUNCATE production_plan, production, events, production_rollup RESTART IDENTITY;")
+        # Справочник деталей: недостающие имена генератора
+        cursor.execute("""
+        INSERT INTO parts ("Наименование детали")
+        SELECT name FROM unnest(%s::varchar[]) AS names (name)
+        WHERE NOT EXISTS (SELECT 1 FROM parts WHERE "Наименование детали" = names.name);
+        """, ([part_name(n) for n in range(1, settings['parts'] + 1)],))
+        plan_id, report_id, event_id = _next_ids(cursor)
+    conn.commit()
+
+    with context.Pool(workers) as pool:
+        counts = pool.map(_count_day, [(settings, day) for day in days])
+
+        tasks = []
+        for day, (plan_count, report_count, event_count) in zip(days, counts):
+            tasks.append((db.DB_CONNECT_PARAMS, settings, day, plan_id, report_id, event_id))
+            plan_id += plan_count
+            report_id += report_count
+            event_id += event_count
+
+        totals = [0, 0, 0]
+        for written in pool.imap_unordered(_write_day, tasks):
+            for i, n in enumerate(written):
+                totals[i] += n
+            if progress:
+                progress(1)
+
+    with conn.cursor() as cursor:
+        for table, column in (('production_plan', 'id'), ('production', 'id'), ('events', 'event_id')):
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), "
+                f"(SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}), false);"
+            )
+        # Изменения мимо журнала: клиенты синхронизации должны перезагрузить данные
+        cursor.execute("UPDATE plan_changes_state SET pruned_before = GREATEST(pruned_before, txid_current());")
+    conn.commit()
+
+    first_day = settings['start'].date()
+    rollups.rebuild_rollups(conn, first_day - timedelta(days=1), first_day + timedelta(days=settings['days']))
+
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE production_plan, production, events, production_rollup;")
+    finally:
+        conn.autocommit = False
+
+    log_message(
+        f"SUCCESS: Сгенерированы данные: батчей {totals[0]}, отчетов {totals[1]}, "
+        f"событий {totals[2]} (seed {settings['seed']})"
+    )
+    return tuple(totals)
+
+
+@click.command('seed')
+@click.option('--seed', 'seed_value', type=int, default=1, show_default=True,
+              help='Начальное значение генератора; одинаковый seed дает одинаковые данные')
+@click.option('--from', 'day_from', type=click.DateTime(formats=['%Y-%m-%d']), default='2025-01-01',
+              show_default=True, help='Первые производственные сутки (YYYY-MM-DD)')
+@click.option('--days', type=click.IntRange(min=1), default=365, show_default=True,
+              help='Сколько суток генерировать')
+@click.option('--machines', type=click.IntRange(min=1), default=50, show_default=True, help='Число станков')
+@click.option('--parts', 'part_count', type=click.IntRange(min=1), default=300, show_default=True,
+              help='Размер справочника деталей')
+@click.option('--density', type=click.FloatRange(0.05, 1.0), default=0.8, show_default=True,
+              help='Доля времени станка, занятая батчами')
+@click.option('--batch-minutes', type=click.IntRange(MIN_BATCH_MINUTES, MAX_BATCH_MINUTES), default=120,
+              show_default=True, help='Средняя длительность батча, минуты')
+@click.option('--report-ratio', type=click.FloatRange(0.0, 1.0), default=0.95, show_default=True,
+              help='Доля батчей с отчетом о производстве и событиями')
+@click.option('--workers', type=click.IntRange(min=1), default=os.cpu_count() or 1, show_default=True,
+              help='Число процессов генерации')
+@click.option('--truncate', is_flag=True, help='Очистить план, отчеты и события перед генерацией')
+def seed_command(seed_value, day_from, days, machines, part_count, density, batch_minutes,
+                 report_ratio, workers, truncate):
+    """Сгенерировать синтетический план, отчеты и события для нагрузочных тестов"""
+    if truncate:
+        click.confirm('Все батчи, отчеты и события будут удалены. Продолжить?', abort=True)
+
+    conn = db.connect_direct()
+    try:
+        # Сутки начинаются с первой смены, как в сводке и OEE
+        with conn.cursor() as cursor:
+            shift_start_hour, _ = rollups.get_shift_settings(cursor)
+        conn.rollback()
+        settings = {
+            'seed': seed_value,
+            'start': datetime.combine(day_from.date(), time(shift_start_hour)),
+            'days': days,
+            'machines': machines,
+            'parts': part_count,
+            'density': density,
+            'batch_minutes': batch_minutes,
+            'report_ratio': report_ratio,
+        }
+        with click.progressbar(length=days, label='Запись суток') as bar:
+            plans_written, reports_written, events_written = seed_database(
+                conn, settings, workers, truncate, progress=bar.update
+            )
+    except Error as e:
+        raise click.ClickException(f"Ошибка генерации данных: {e}")
+    finally:
+        conn.close()
+
+    click.echo(f"Батчей: {plans_written}, отчетов: {reports_written}, событий: {events_written}")
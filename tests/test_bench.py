@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_bench_startup_only_exits_cleanly():
+    # Журнал приложения не должен попадать в stdout, который разбирает стенд
+    result = subprocess.run([sys.executable, '-m', 'bench', '--startup-only'], cwd=ROOT,
+                            env=dict(os.environ, LOG_STREAM='stdout'),
+                            capture_output=True, text=True, timeout=120)
+    assert result.returncode == 0, result.stderr
+    assert 'create_app_ms' in result.stdout
@@ -0,0 +1,52 @@
+"""
+Проверки списка батчей на настоящей базе: TEST_DATABASE_URL указывает на
+базу с примененными миграциями (flask db upgrade). Без нее тесты
+пропускаются. Все изменения откатываются.
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason='TEST_DATABASE_URL не задан')
+
+
+@pytest.fixture
+def cursor():
+    conn = psycopg2.connect(DATABASE_URL)
+    try:
+        with conn.cursor() as cursor:
+            yield cursor
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def test_plan_with_several_utilization_events_is_listed_once(cursor):
+    from app import fetch_plans_page
+
+    start = datetime(2099, 1, 1, 8, 0)
+    cursor.execute("""
+    INSERT INTO production_plan (part_name, planned_quantity, machine_number, start_time, end_time)
+    VALUES ('Тестовая деталь', 10, 1, %s, %s)
+    RETURNING id;
+    """, (start, start + timedelta(hours=3)))
+    plan_id = cursor.fetchone()[0]
+    for hour in range(3):
+        cursor.execute("""
+        INSERT INTO events (event_name, batch, "Фактические время начала события",
+                            "Фактические время конца события", "Time_group")
+        VALUES ('Работа', %s, %s, %s, 'Utilization hours');
+        """, (plan_id, start + timedelta(hours=hour), start + timedelta(hours=hour + 1)))
+
+    rows = fetch_plans_page(cursor, 50, start_date='2099-01-01', end_date='2099-01-01')['data']
+
+    assert [row['id'] for row in rows].count(plan_id) == 1
+    assert next(row for row in rows if row['id'] == plan_id)['has_utilization_event'] is True
@@ -0,0 +1,73 @@
+"""
+Разбор файлов импорта плана без базы: номера строк и id записей.
+"""
+import io
+import os
+import sys
+
+import pytest
+
+pytest.importorskip('psycopg2')
+pytest.importorskip('flask')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import plans  # noqa: E402
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, None),
+    ('', None),
+    ('42', 42),
+    (' 7 ', 7),
+    (42, 42),
+    (3.0, 3),
+])
+def test_parse_import_id(value, expected):
+    assert plans._parse_import_id(value) == expected
+
+
+@pytest.mark.parametrize('value', ['abc', '1.5', 2.5, True, [1]])
+def test_parse_import_id_rejects_non_integers(value):
+    with pytest.raises(ValueError, match='ID должен быть целым числом'):
+        plans._parse_import_id(value)
+
+
+def test_csv_rows_keep_file_line_numbers_across_blank_lines():
+    data = (
+        "Part_Name;Planned_Quantity;Machine_Number;Start_Time;End_Time;ID\n"
+        "A;10;1;2030-01-01T08:00;2030-01-01T09:00;\n"
+        "\n"
+        "\n"
+        "B;20;2;2030-01-01T10:00;2030-01-01T11:00;5\n"
+    ).encode('utf-8-sig')
+
+    rows = list(plans.iter_plan_rows(io.BytesIO(data), 'csv'))
+
+    assert [line_no for line_no, _ in rows] == [2, 5]
+    assert rows[1][1] == {
+        'part_name': 'B', 'planned_quantity': '20', 'machine_number': '2',
+        'start_time': '2030-01-01T10:00', 'end_time': '2030-01-01T11:00', 'id': '5',
+    }
+
+
+def test_xlsx_rows_keep_sheet_row_numbers():
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['part_name', 'planned_quantity', 'machine_number', 'start_time', 'end_time'])
+    sheet.append(['A', 10, 1, '2030-01-01T08:00', '2030-01-01T09:00'])
+    sheet.append([None, None, None, None, None])
+    sheet.append(['B', 20, 2, '2030-01-01T10:00', '2030-01-01T11:00'])
+    stream = io.BytesIO()
+    workbook.save(stream)
+    stream.seek(0)
+
+    rows = list(plans.iter_plan_rows(stream, 'xlsx'))
+
+    assert [(line_no, row['part_name']) for line_no, row in rows] == [(2, 'A'), (4, 'B')]
+
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        plans.iter_plan_rows(io.BytesIO(b''), 'ods')
@@ -0,0 +1,126 @@
+"""
+Проверки планировщика без базы: производительность станков и их занятость
+подставляются вместо запросов.
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip('psycopg2')
+flask = pytest.importorskip('flask')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import scheduler  # noqa: E402
+from scheduler import MachineTimeline  # noqa: E402
+
+START = datetime(2030, 1, 7, 8, 0)
+
+
+def at(hours, minutes=0):
+    return START + timedelta(hours=hours, minutes=minutes)
+
+
+@pytest.fixture
+def app():
+    app = flask.Flask(__name__)
+    scheduler.init_app(app)
+    app.config['SCHEDULER_HORIZON_DAYS'] = 7
+    with app.app_context():
+        yield app
+
+
+def fake_database(monkeypatch, pair_rates, part_rates=None, bookings=None, pauses=None):
+    bookings = bookings or {}
+    pauses = pauses or {}
+    monkeypatch.setattr(scheduler, 'load_rates', lambda conn, since: (pair_rates, part_rates or {}))
+
+    def load_timelines(conn, machines, horizon_start, horizon_end, extra_pauses, daily_pauses):
+        return {
+            machine: MachineTimeline(machine, bookings.get(machine, []), pauses.get(machine, []) + daily_pauses)
+            for machine in machines
+        }
+    monkeypatch.setattr(scheduler, '_load_timelines', load_timelines)
+
+
+def assert_no_overlaps(plans, bookings):
+    by_machine = {}
+    for plan in plans:
+        start = datetime.strptime(plan['start_time'], '%Y-%m-%dT%H:%M')
+        end = datetime.strptime(plan['end_time'], '%Y-%m-%dT%H:%M')
+        assert end > start
+        by_machine.setdefault(plan['machine_number'], []).append((start, end))
+    for machine, intervals in by_machine.items():
+        intervals = sorted(intervals + bookings.get(machine, []))
+        for (_, previous_end), (start, _) in zip(intervals, intervals[1:]):
+            assert start >= previous_end, f'станок {machine}: пересечение в {start}'
+
+
+def test_earliest_slot_skips_bookings_and_stretches_over_pause():
+    timeline = MachineTimeline(1, [(at(0), at(2))], [(at(3), at(3, 30))])
+
+    assert timeline.earliest_slot(START, 60, at(24)) == (at(2), at(3))
+    # Работа 90 минут перешагивает паузу 30 минут
+    assert timeline.earliest_slot(START, 90, at(24)) == (at(2), at(4))
+    assert timeline.earliest_slot(START, 60, at(2, 30)) is None
+
+
+def test_book_merges_adjacent_intervals_across_pause():
+    timeline = MachineTimeline(1, [(at(0), at(1))], [(at(2), at(2, 30))])
+
+    timeline.book(at(1), at(2))
+    timeline.book(at(2, 30), at(3))
+
+    assert timeline.busy_starts == [at(0)]
+    assert timeline.busy_ends == [at(3)]
+    assert timeline.first_free(START) == at(3)
+    assert timeline.booked_minutes == 90
+
+
+def test_build_schedule_does_not_overlap_bookings_or_other_batches(app, monkeypatch):
+    bookings = {1: [(at(1), at(3))], 2: [(at(0), at(5))]}
+    fake_database(monkeypatch, {('A', 1): 1.0, ('A', 2): 2.0, ('B', 1): 0.5},
+                  bookings=bookings, pauses={1: [(at(4), at(4, 15))]})
+    batches = [
+        {'index': index, 'part_name': 'AB'[index % 2], 'quantity': 30 + index * 7, 'priority': index % 3}
+        for index in range(40)
+    ]
+
+    result = scheduler.build_schedule(None, batches, START, [1, 2])
+
+    assert len(result['plans']) == len(batches)
+    assert result['unscheduled'] == []
+    assert_no_overlaps(result['plans'], bookings)
+
+
+def test_build_schedule_plans_lower_priority_value_first(app, monkeypatch):
+    fake_database(monkeypatch, {('A', 1): 1.0})
+    batches = [
+        {'index': 0, 'part_name': 'A', 'quantity': 60, 'priority': 2},
+        {'index': 1, 'part_name': 'A', 'quantity': 60, 'priority': 0},
+        {'index': 2, 'part_name': 'A', 'quantity': 120, 'priority': 1},
+    ]
+
+    result = scheduler.build_schedule(None, batches, START, [1])
+
+    assert [plan['index'] for plan in result['plans']] == [1, 2, 0]
+    assert result['plans'][0]['start_time'] == '2030-01-07T08:00'
+
+
+def test_build_schedule_reports_unscheduled_batches(app, monkeypatch):
+    fake_database(monkeypatch, {('A', 1): 1.0})
+    batches = [
+        {'index': 0, 'part_name': 'Z', 'quantity': 10, 'priority': 0},
+        # Восемь суток работы не помещаются в горизонт семи суток
+        {'index': 1, 'part_name': 'A', 'quantity': 8 * 24 * 60, 'priority': 0},
+    ]
+
+    result = scheduler.build_schedule(None, batches, START, [1])
+
+    assert result['plans'] == []
+    assert [(batch['index'], batch['reason']) for batch in result['unscheduled']] == [
+        (0, 'Нет данных о производительности для детали'),
+        (1, 'Батч не помещается в горизонт планирования'),
+    ]
@@ -0,0 +1,7 @@
+"""
+Точка входа WSGI-серверов: gunicorn wsgi:app (в том числе с --preload).
+Миграции применяются до запуска: flask --app app db upgrade.
+"""
+from app import create_app
+
+app = create_app()